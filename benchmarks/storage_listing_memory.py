@@ -0,0 +1,113 @@
+"""Compare the memory used to hold a large bucket listing.
+
+Lists a fake bucket of ``NUM_KEYS`` objects
+(served in pages, as the API would)
+into a list of :class:`gcloud.storage.key.Key` objects
+and into a :class:`gcloud.storage.listing.KeyListing`,
+each in a fresh process,
+and reports how much the resident set size grew.
+
+Usage::
+
+  $ python benchmarks/storage_listing_memory.py [NUM_KEYS]
+"""
+
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.connection import Connection
+
+
+PAGE_SIZE = 1000
+
+
+class FakeConnection(Connection):
+  """Serves pages of generated object metadata."""
+
+  def __init__(self, num_keys):
+    super(FakeConnection, self).__init__('project-name')
+    self.num_keys = num_keys
+
+  def api_request(self, method, path=None, query_params=None, **kwargs):
+    start = int((query_params or {}).get('pageToken', 0))
+    end = min(start + PAGE_SIZE, self.num_keys)
+
+    items = []
+    for index in xrange(start, end):
+      generation = 1394452800000000 + index
+      items.append({
+          u'kind': u'storage#object',
+          u'id': u'bucket/logs/%08d.log/%d' % (index, generation),
+          u'selfLink': u'https://www.googleapis.com/storage/v1beta2/b/bucket'
+                       u'/o/logs%%2F%08d.log' % index,
+          u'name': u'logs/%08d.log' % index,
+          u'bucket': u'bucket',
+          u'generation': unicode(generation),
+          u'metageneration': u'1',
+          u'contentType': u'text/plain',
+          u'updated': u'2014-03-10T12:00:00.%03dZ' % (index % 1000),
+          u'storageClass': u'STANDARD',
+          u'size': unicode(index * 10),
+          u'md5Hash': u'kAFQmDzST7DWlj99KOF/cg==',
+          u'mediaLink': u'https://www.googleapis.com/storage/v1beta2/b/bucket'
+                        u'/o/logs%%2F%08d.log?generation=%d&alt=media' % (
+                            index, generation),
+          u'crc32c': u'yZRlqg==',
+          u'etag': u'CIDk7bmRr7wCEAE=',
+          })
+
+    response = {u'items': items}
+    if end < self.num_keys:
+      response[u'nextPageToken'] = unicode(end)
+    return response
+
+
+def get_rss():
+  # Current resident set size in bytes (Linux), or the peak elsewhere.
+  try:
+    with open('/proc/self/statm') as statm:
+      return int(statm.read().split()[1]) * resource.getpagesize()
+  except IOError:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(mode, num_keys):
+  bucket = Bucket(connection=FakeConnection(num_keys), name='bucket')
+  before = get_rss()
+
+  if mode == 'keys':
+    listing = bucket.get_all_keys()
+  else:
+    listing = bucket.get_key_listing(prefetch=0)
+
+  assert len(listing) == num_keys
+  print get_rss() - before
+
+
+def main():
+  if len(sys.argv) == 3:
+    measure(sys.argv[1], int(sys.argv[2]))
+    return
+
+  num_keys = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+  print 'Listing %d keys:' % num_keys
+
+  results = {}
+  for mode in ('keys', 'compact'):
+    output = subprocess.check_output(
+        [sys.executable, __file__, mode, str(num_keys)])
+    results[mode] = int(output.strip())
+    print '  %-8s %8.1f MB  (%d bytes per key)' % (
+        mode, results[mode] / 1048576.0, results[mode] / num_keys)
+
+  print '  compact listing uses %.1fx less memory' % (
+      float(results['keys']) / max(results['compact'], 1))
+
+
+if __name__ == '__main__':
+  main()
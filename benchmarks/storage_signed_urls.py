@@ -0,0 +1,84 @@
+"""Measure how many signed URLs can be generated per second.
+
+Signs ``NUM_URLS`` resources with a freshly generated 2048 bit key:
+
+* ``uncached``: parsing the PKCS12 key for every URL
+  (what :meth:`gcloud.storage.connection.Connection.generate_signed_url`
+  used to do),
+* ``cached``: one URL at a time, with the parsed key cached,
+* ``bulk``: with :meth:`generate_signed_urls` on a process pool.
+
+Usage::
+
+  $ python benchmarks/storage_signed_urls.py [NUM_URLS] [NUM_PROCESSES]
+"""
+
+import base64
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from OpenSSL import crypto
+
+from gcloud.storage import connection as storage_connection
+from gcloud.storage.connection import Connection
+
+
+class Credentials(object):
+
+  def __init__(self):
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+    pkcs12 = crypto.PKCS12()
+    pkcs12.set_privatekey(key)
+    self.private_key = base64.b64encode(pkcs12.export('notasecret'))
+    self.service_account_name = 'account@example.com'
+
+
+def sign_uncached(connection, resources, expiration):
+  for resource in resources:
+    storage_connection._SIGNERS.clear()
+    connection.generate_signed_url(resource, expiration)
+
+
+def sign_cached(connection, resources, expiration):
+  for resource in resources:
+    connection.generate_signed_url(resource, expiration)
+
+
+def sign_bulk(connection, resources, expiration, num_processes):
+  connection.generate_signed_urls(resources, expiration,
+                                  num_processes=num_processes)
+
+
+def main():
+  num_urls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  num_processes = (int(sys.argv[2]) if len(sys.argv) > 2
+                   else multiprocessing.cpu_count())
+
+  connection = Connection('project-name', credentials=Credentials())
+  # Always use the pool for the bulk run, however few URLs there are.
+  connection.SIGNING_POOL_THRESHOLD = 0
+  resources = ['/bucket/objects/%08d.jpg' % i for i in xrange(num_urls)]
+  expiration = int(time.time()) + 3600
+
+  print 'Signing %d URLs (%d processes for bulk):' % (num_urls, num_processes)
+  runs = [
+      ('uncached', lambda: sign_uncached(connection, resources, expiration)),
+      ('cached', lambda: sign_cached(connection, resources, expiration)),
+      ('bulk', lambda: sign_bulk(connection, resources, expiration,
+                                 num_processes)),
+      ]
+  for name, run in runs:
+    start = time.time()
+    run()
+    elapsed = time.time() - start
+    print '  %-8s %8.0f URLs/s  (%.2f ms per URL)' % (
+        name, num_urls / elapsed, elapsed * 1000 / num_urls)
+
+
+if __name__ == '__main__':
+  main()
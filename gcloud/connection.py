@@ -17,13 +17,22 @@ class Connection(object):
   _EMPTY = object()
   """A pointer to represent an empty value for default arguments."""
 
-  def __init__(self, credentials=None):
+  def __init__(self, credentials=None, http=None):
     """
     :type credentials: :class:`gcloud.credentials.Credentials`
     :param credentials: The OAuth2 Credentials to use for this connection.
+
+    :type http: :class:`httplib2.Http` or :class:`gcloud.transport.HttpPool`
+    :param http: (optional) The HTTP transport to use.
+                 Pass a :class:`gcloud.transport.HttpPool`
+                 to share a connection safely across threads.
+                 If not provided, an :class:`httplib2.Http` object
+                 will be created (and authorized) on first use.
     """
 
     self._credentials = credentials
+    if http is not None:
+      self._http = http
 
   @property
   def credentials(self):
@@ -33,7 +42,7 @@ class Connection(object):
   def http(self):
     """A getter for the HTTP transport used in talking to the API.
 
-    :rtype: :class:`httplib2.Http`
+    :rtype: :class:`httplib2.Http` or :class:`gcloud.transport.HttpPool`
     :returns: A Http object used to transport data.
     """
     if not hasattr(self, '_http'):
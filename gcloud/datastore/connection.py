@@ -14,6 +14,11 @@ class Connection(object):
 
   :type credentials: :class:`gcloud.credentials.Credentials`
   :param credentials: The OAuth2 Credentials to use for this connection.
+
+  :type http: :class:`httplib2.Http` or :class:`gcloud.transport.HttpPool`
+  :param http: (optional) The HTTP transport to use.
+               Pass a :class:`gcloud.transport.HttpPool`
+               to share a connection safely across threads.
   """
 
   API_BASE_URL = 'https://www.googleapis.com'
@@ -29,16 +34,16 @@ class Connection(object):
   _EMPTY = object()
   """A pointer to represent an empty value for default arguments."""
 
-  def __init__(self, credentials=None):
+  def __init__(self, credentials=None, http=None):
     self._credentials = credentials
     self._current_transaction = None
-    self._http = None
+    self._http = http
 
   @property
   def http(self):
     """A getter for the HTTP transport used in talking to the API.
 
-    :rtype: :class:`httplib2.Http`
+    :rtype: :class:`httplib2.Http` or :class:`gcloud.transport.HttpPool`
     :returns: A Http object used to transport data.
     """
 
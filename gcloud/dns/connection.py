@@ -28,9 +28,9 @@ class Connection(ApiClientConnection):
   API_NAME = 'dns'
   API_VERSION = 'v1beta1'
 
-  def __init__(self, project=None, credentials=None):
+  def __init__(self, project=None, credentials=None, http=None):
     self.project = project
-    super(Connection, self).__init__(credentials=credentials)
+    super(Connection, self).__init__(credentials=credentials, http=http)
 
   def list_zones(self):
     """Iterates over the zones in this project.
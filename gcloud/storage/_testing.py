@@ -0,0 +1,66 @@
+"""Fakes shared by the storage tests."""
+
+import json
+import re
+import threading
+from StringIO import StringIO
+
+import httplib2
+
+
+class StreamingResponse(object):
+  """Fakes an :class:`httplib.HTTPResponse` read in pieces."""
+
+  def __init__(self, status, body, headers=None):
+    self.status = status
+    self.reason = 'Reason'
+    self.fp = StringIO(body)
+    self.headers = headers or {}
+    self.closed = False
+    self.reads = []
+
+  def read(self, amt=None):
+    self.reads.append(amt)
+    return self.fp.read(amt)
+
+  def getheaders(self):
+    return self.headers.items()
+
+  def getheader(self, name, default=None):
+    for header, value in self.headers.items():
+      if header.lower() == name.lower():
+        return value
+    return default
+
+  def close(self):
+    self.closed = True
+
+
+class RangeHttp(object):
+  """Serves Range requests (and metadata) out of a string, from any thread."""
+
+  def __init__(self, data, status=206):
+    self.data = data
+    self.status = status
+    self.ranges = []
+    self._lock = threading.Lock()
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    if 'Range' not in headers:
+      response = httplib2.Response({'status': 200,
+                                    'content-type': 'application/json'})
+      return response, json.dumps({'name': 'key',
+                                   'size': str(len(self.data))})
+
+    start, end = re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups()
+    start, end = int(start), int(end)
+    with self._lock:
+      self.ranges.append((start, end))
+
+    if self.status != 206:
+      return httplib2.Response({'status': self.status}), self.data
+
+    response = httplib2.Response({
+        'status': 206,
+        'content-range': 'bytes %d-%d/%d' % (start, end, len(self.data))})
+    return response, self.data[start:end + 1]
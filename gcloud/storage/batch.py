@@ -0,0 +1,454 @@
+"""Batching several API calls into a single HTTP request.
+
+Cloud Storage accepts up to 100 API calls
+packed into one ``multipart/mixed`` request
+(see https://developers.google.com/storage/docs/json_api/v1/how-tos/batch).
+Each part is a complete HTTP request,
+and the response is a ``multipart/mixed`` document
+holding one complete HTTP response per part.
+
+The easiest way to use this is
+:func:`gcloud.storage.connection.Connection.batch`.
+Inside the ``with`` block,
+API requests are queued instead of being sent,
+and return a :class:`Future` instead of a result.
+When the block exits,
+the queued requests are sent
+(split into as many batches as needed)
+and the futures are resolved::
+
+  >>> with connection.batch():
+  ...   deleted = bucket.delete_key('file-1.txt')
+  ...   key = bucket.get_key('file-2.txt')
+  >>> print deleted.result()
+  <Key: my-bucket, file-1.txt>
+  >>> print key.result()
+  <Key: my-bucket, file-2.txt>
+
+Only methods that don't need the result of one request
+to make the next one can be batched.
+"""
+
+import email.parser
+import sys
+import urlparse
+import uuid
+
+import httplib2
+
+from gcloud.storage import exceptions
+
+
+class Future(object):
+  """The result of an API request that hasn't been sent yet.
+
+  The result is available once the batch holding the request is sent.
+  """
+
+  def __init__(self):
+    self._done = False
+    self._result = None
+    self._exception = None
+    self._callbacks = []
+
+  def __repr__(self):
+    if not self._done:
+      return '<Future: pending>'
+    elif self._exception is not None:
+      return '<Future: raised %r>' % self._exception
+    return '<Future: %r>' % (self._result,)
+
+  def done(self):
+    """Whether the result is available yet.
+
+    :rtype: bool
+    :returns: True if the request has been sent.
+    """
+
+    return self._done
+
+  def result(self):
+    """Get the result of the request.
+
+    :rtype: anything
+    :returns: The result of the request.
+    :raises: The exception raised by the request, if any.
+    """
+
+    if not self._done:
+      raise RuntimeError('The batch has not been sent yet.')
+    elif self._exception is not None:
+      raise self._exception
+    return self._result
+
+  def exception(self):
+    """Get the exception raised by the request.
+
+    :rtype: :class:`Exception` or None
+    :returns: The exception, or None if the request succeeded.
+    """
+
+    if not self._done:
+      raise RuntimeError('The batch has not been sent yet.')
+    return self._exception
+
+  def set_result(self, result):
+    self._result = result
+    self._finish()
+
+  def set_exception(self, exception):
+    self._exception = exception
+    self._finish()
+
+  def _finish(self):
+    self._done = True
+    for callback in self._callbacks:
+      callback(self)
+    self._callbacks = []
+
+  def add_done_callback(self, callback):
+    """Call a function (with this future) once the result is available.
+
+    :type callback: callable
+    :param callback: The function to call.
+    """
+
+    if self._done:
+      callback(self)
+    else:
+      self._callbacks.append(callback)
+
+  def then(self, callback, errback=None):
+    """Chain a transformation of the result.
+
+    :type callback: callable
+    :param callback: Called with the result when the request succeeds.
+
+    :type errback: callable
+    :param errback: (optional) Called with the exception
+                    when the request fails.
+                    If not provided, the exception is passed along.
+
+    :rtype: :class:`Future`
+    :returns: A future for the value returned by
+              ``callback`` (or ``errback``).
+    """
+
+    future = type(self)()
+
+    def chain(done):
+      try:
+        if done._exception is None:
+          value = callback(done._result)
+        elif errback is not None:
+          value = errback(done._exception)
+        else:
+          raise done._exception
+      except Exception, e:
+        future.set_exception(e)
+      else:
+        future.set_result(value)
+
+    self.add_done_callback(chain)
+    return future
+
+
+def when_done(result, callback, errback=None):
+  """Apply a function to the result of an API request.
+
+  Outside a batch, ``result`` is the parsed response
+  and this just calls ``callback`` with it.
+  Inside a batch, ``result`` is a :class:`Future`
+  and this returns a new future for the value of ``callback``.
+
+  :type result: anything or :class:`Future`
+  :param result: The value returned by
+                 :func:`gcloud.storage.connection.Connection.api_request`.
+
+  :type callback: callable
+  :param callback: Called with the result.
+
+  :type errback: callable
+  :param errback: (optional) Called with the exception
+                  if a deferred request fails.
+
+  :rtype: anything or :class:`Future`
+  :returns: The value of ``callback``, or a future for it.
+  """
+
+  if isinstance(result, Future):
+    return result.then(callback, errback)
+  return callback(result)
+
+
+class Batch(object):
+  """A group of API requests to be sent in as few HTTP requests as possible.
+
+  Requests are sent :attr:`MAX_REQUESTS` at a time.
+
+  :type connection: :class:`gcloud.storage.connection.Connection`
+  :param connection: The connection to send the batch with.
+  """
+
+  MAX_REQUESTS = 100
+  """The most requests the API accepts in a single batch."""
+
+  def __init__(self, connection):
+    self.connection = connection
+    self._requests = []
+
+  def __len__(self):
+    return len(self._requests)
+
+  def __enter__(self):
+    self.connection.push_batch(self)
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.connection.pop_batch(self)
+
+    # Don't send anything if the block failed.
+    if exc_type is None:
+      self.finish()
+    else:
+      self.abort(exc_value)
+
+  def abort(self, cause=None):
+    """Drop the queued requests without sending them.
+
+    The futures of deferred requests fail with
+    :class:`gcloud.storage.exceptions.BatchAbortedError`,
+    so nothing waits on them forever.
+
+    :type cause: Exception
+    :param cause: (optional) Why the batch was dropped.
+    """
+
+    requests, self._requests = self._requests, []
+    error = exceptions.BatchAbortedError(cause)
+    for request in requests:
+      if request[4] is not None:
+        request[4].set_exception(error)
+
+  def get_url(self):
+    return self.connection.API_BASE_URL + '/batch'
+
+  def add(self, method, path, query_params=None, data=None,
+          content_type=None):
+    """Add an API request to the batch.
+
+    The arguments are the same as for
+    :func:`gcloud.storage.connection.Connection.api_request`.
+
+    :rtype: int
+    :returns: The position of this request in the batch.
+    """
+
+    url = self.connection.build_api_url(path=path, query_params=query_params)
+    return self.add_url(method, url, data=data, content_type=content_type)
+
+  def add_url(self, method, url, data=None, content_type=None, future=None,
+              expect_json=True):
+    """Add a request for a fully built API URL to the batch.
+
+    :type method: string
+    :param method: The HTTP method name (ie, ``GET``, ``POST``, etc).
+
+    :type url: string
+    :param url: The URL to request.
+
+    :type data: string
+    :param data: The data to send as the body of the request.
+
+    :type content_type: string
+    :param content_type: The proper MIME type of the data provided.
+
+    :type future: :class:`Future`
+    :param future: (optional) A future to resolve with the parsed response
+                   once the batch is sent.
+
+    :type expect_json: bool
+    :param expect_json: Whether the response of the request should be JSON.
+
+    :rtype: int
+    :returns: The position of this request in the batch.
+    """
+
+    self._requests.append(
+        (method, url, data, content_type, future, expect_json))
+    return len(self._requests) - 1
+
+  def defer(self, method, url, data=None, content_type=None,
+            expect_json=True):
+    """Queue a request and return a future for its parsed response.
+
+    This is what :func:`gcloud.storage.connection.Connection.api_request`
+    does with requests made inside a batch.
+
+    :rtype: :class:`Future`
+    :returns: A future resolving to the parsed response,
+              or to the exception
+              :func:`gcloud.storage.connection.Connection.api_request`
+              would have raised.
+    """
+
+    future = Future()
+    self.add_url(method, url, data=data, content_type=content_type,
+                 future=future, expect_json=expect_json)
+    return future
+
+  @staticmethod
+  def build_body(requests, boundary):
+    """Build the ``multipart/mixed`` body of a batch request.
+
+    :type requests: list of tuples
+    :param requests: The requests to include, as added to the batch.
+
+    :type boundary: string
+    :param boundary: The string separating the parts.
+
+    :rtype: string
+    :returns: The body of the batch request.
+    """
+
+    lines = []
+    for index, request in enumerate(requests):
+      method, url, data, content_type = request[:4]
+      parts = urlparse.urlsplit(url)
+      request_path = parts.path
+      if parts.query:
+        request_path += '?' + parts.query
+
+      lines.extend([
+          '--' + boundary,
+          'Content-Type: application/http',
+          'Content-Transfer-Encoding: binary',
+          'Content-ID: <%d>' % index,
+          '',
+          '%s %s HTTP/1.1' % (method, request_path),
+          ])
+
+      if data:
+        lines.append('Content-Type: %s' % (content_type or 'text/plain'))
+        lines.append('Content-Length: %d' % len(data))
+      lines.append('')
+      lines.append(data or '')
+
+    lines.append('--' + boundary + '--')
+    return '\r\n'.join(lines)
+
+  @staticmethod
+  def parse_response(response, content):
+    """Split a batch response into the responses to each request.
+
+    :type response: dict
+    :param response: The headers of the batch response.
+
+    :type content: string
+    :param content: The ``multipart/mixed`` body of the batch response.
+
+    :rtype: dict
+    :returns: A dictionary mapping each request's position in the batch
+              to a tuple of its ``response`` and ``content``.
+    """
+
+    message = email.parser.Parser().parsestr(
+        'Content-Type: %s\r\n\r\n%s' % (response['content-type'], content))
+
+    results = {}
+    for part in message.get_payload():
+      # Content-IDs come back as <response-N>.
+      index = int(part['Content-ID'].strip('<>').rsplit('-', 1)[1])
+
+      status_line, _, rest = part.get_payload().partition('\n')
+      sub_message = email.parser.Parser().parsestr(rest)
+      headers = dict((name.lower(), value)
+                     for name, value in sub_message.items())
+      headers['status'] = status_line.split()[1]
+
+      results[index] = (httplib2.Response(headers), sub_message.get_payload())
+
+    return results
+
+  def send(self, requests):
+    """Send up to :attr:`MAX_REQUESTS` requests in a single HTTP request.
+
+    :type requests: list of tuples
+    :param requests: The requests to send, as added to the batch.
+
+    :rtype: list of tuples of ``response`` (a dictionary of sorts)
+            and ``content`` (a string).
+    :returns: The HTTP response object and content of each request.
+    :raises: :class:`gcloud.storage.exceptions.ConnectionError`
+             if the batch request as a whole fails.
+    """
+
+    boundary = '===============%s==' % uuid.uuid4().hex
+    response, content = self.connection.make_request(
+        method='POST', url=self.get_url(),
+        data=self.build_body(requests, boundary),
+        content_type='multipart/mixed; boundary="%s"' % boundary)
+
+    if not 200 <= response.status < 300:
+      raise exceptions.ConnectionError(response, content)
+
+    results = self.parse_response(response, content)
+    return [results[index] for index in xrange(len(requests))]
+
+  def finish(self):
+    """Send the batch, resolving the futures of deferred requests.
+
+    :rtype: list of tuples of ``response`` (a dictionary of sorts)
+            and ``content`` (a string).
+    :returns: The HTTP response object and content of each request,
+              in the order the requests were added.
+    :raises: :class:`gcloud.storage.exceptions.ConnectionError`
+             if a batch request as a whole fails
+             (after failing the futures of the requests it held).
+             Any other error stops the remaining batch requests
+             and is raised after failing every unresolved future.
+    """
+
+    requests, self._requests = self._requests, []
+    responses = []
+    batch_error = None
+
+    for start in xrange(0, len(requests), self.MAX_REQUESTS):
+      group = requests[start:start + self.MAX_REQUESTS]
+
+      try:
+        group_responses = self.send(group)
+      except exceptions.ConnectionError, e:
+        batch_error = batch_error or e
+        for request in group:
+          if request[4] is not None:
+            request[4].set_exception(e)
+        continue
+      except:
+        # Nothing more is sent, but nothing is left waiting either.
+        exc_info = sys.exc_info()
+        for request in requests[start:]:
+          future = request[4]
+          if future is not None and not future.done():
+            future.set_exception(exc_info[1])
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+      for request, (response, content) in zip(group, group_responses):
+        future, expect_json = request[4:]
+        if future is None:
+          continue
+
+        try:
+          result = self.connection.process_response(
+              response, content, expect_json=expect_json)
+        except Exception, e:
+          future.set_exception(e)
+        else:
+          future.set_result(result)
+
+      responses.extend(group_responses)
+
+    if batch_error is not None:
+      raise batch_error
+
+    return responses
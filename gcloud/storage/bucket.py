@@ -1,8 +1,63 @@
 from gcloud.storage import exceptions
+from gcloud.storage import workers
 from gcloud.storage.acl import BucketACL
 from gcloud.storage.acl import DefaultObjectACL
+from gcloud.storage.batch import Batch
+from gcloud.storage.batch import when_done
 from gcloud.storage.iterator import KeyIterator
+from gcloud.storage.iterator import ShardedKeyIterator
 from gcloud.storage.key import Key
+from gcloud.storage.listing import KeyListing
+from gcloud.storage.retry import NETWORK_ERRORS
+
+
+class MultiResult(object):
+  """The outcome of applying an operation to several keys at once.
+
+  :type succeeded: list of :class:`gcloud.storage.key.Key`
+  :param succeeded: The keys the operation succeeded for.
+
+  :type errors: list of tuples of ``(key, exception)``
+  :param errors: The keys the operation failed for, and why.
+  """
+
+  def __init__(self, succeeded=None, errors=None):
+    self.succeeded = succeeded or []
+    self.errors = errors or []
+
+  def __repr__(self):
+    return '<%s: %d succeeded, %d errors>' % (
+        self.__class__.__name__, len(self.succeeded), len(self.errors))
+
+  @property
+  def failed_keys(self):
+    """The keys the operation failed for, ready to be retried.
+
+    :rtype: list of :class:`gcloud.storage.key.Key`
+    """
+
+    return [key for key, _ in self.errors]
+
+  def add(self, key, error):
+    if error is None:
+      self.succeeded.append(key)
+    else:
+      self.errors.append((key, error))
+
+
+class MultiDeleteResult(MultiResult):
+  """The outcome of deleting several keys at once."""
+
+  def __init__(self, deleted=None, errors=None):
+    super(MultiDeleteResult, self).__init__(succeeded=deleted, errors=errors)
+
+  def __repr__(self):
+    return '<MultiDeleteResult: %d deleted, %d errors>' % (
+        len(self.deleted), len(self.errors))
+
+  @property
+  def deleted(self):
+    return self.succeeded
 
 
 class Bucket(object):
@@ -15,11 +70,18 @@ class Bucket(object):
   :param name: The name of the bucket.
   """
 
+  REWRITE_API_VERSION = 'v1'
+  """The API version with the ``rewriteTo`` endpoint (see :func:`copy_key`)."""
+
   def __init__(self, connection=None, name=None, metadata=None):
     self.connection = connection
     self.name = name
     self.metadata = metadata
 
+    # Fields fetched with a partial reload,
+    # which might be missing from the metadata if they're unset.
+    self._loaded_fields = set()
+
     # ACL rules are lazily retrieved.
     self.acl = None
     self.default_object_acl = None
@@ -79,11 +141,20 @@ class Bucket(object):
     # Coerce this to a key object (either from a Key or a string).
     key = self.new_key(key)
 
-    try:
-      response = self.connection.api_request(method='GET', path=key.path)
+    def make_key(response):
       return Key.from_dict(response, bucket=self)
+
+    def not_found(error):
+      if isinstance(error, exceptions.NotFoundError):
+        return None
+      raise error
+
+    try:
+      response = self.connection.get_resource(
+          key.path, cache_key=(self.name, key.name))
     except exceptions.NotFoundError:
       return None
+    return when_done(response, make_key, not_found)
 
   def get_all_keys(self):
     """List all the keys in this bucket.
@@ -101,6 +172,78 @@ class Bucket(object):
 
     return list(self)
 
+  def get_key_listing(self, prefix=None, prefetch=1):
+    """List the keys in this bucket into a compact listing.
+
+    This is much lighter than :func:`Bucket.get_all_keys`
+    for buckets with millions of keys,
+    keeping only a few fields per key
+    (see :class:`gcloud.storage.listing.KeyListing`).
+
+    :type prefix: string
+    :param prefix: (optional) Only list keys whose names start with this.
+
+    :type prefetch: int
+    :param prefetch: The number of pages to fetch ahead in the background.
+
+    :rtype: :class:`gcloud.storage.listing.KeyListing`
+    :returns: The keys in this bucket.
+    """
+
+    return KeyListing.from_bucket(self, prefix=prefix, prefetch=prefetch)
+
+  def iter_keys(self, prefix=None, delimiter=None, fields=None, prefetch=0,
+                num_workers=None, ordered=False):
+    """List the keys in this bucket, with more control than ``iter(bucket)``.
+
+    For example,
+    to list just the names and sizes of the keys under ``logs/``,
+    with 16 directories listed at a time::
+
+      >>> for key in bucket.iter_keys(prefix='logs/', fields=['name', 'size'],
+      ...                             num_workers=16):
+      ...   print key.name, key.get_metadata('size')
+
+    :type prefix: string
+    :param prefix: (optional) Only list keys whose names start with this.
+
+    :type delimiter: string
+    :param delimiter: (optional) Don't list keys whose names contain this
+                      after the prefix.
+                      When listing in parallel,
+                      this separates the directories to shard on
+                      and defaults to ``/``.
+
+    :type fields: list of strings
+    :param fields: (optional) The fields to load for each key.
+
+    :type prefetch: int
+    :param prefetch: The number of pages to fetch ahead in the background
+                     (when not listing in parallel).
+
+    :type num_workers: int
+    :param num_workers: (optional) If set, list this many directories
+                        at the same time (see
+                        :class:`gcloud.storage.iterator.ShardedKeyIterator`).
+
+    :type ordered: bool
+    :param ordered: When listing in parallel,
+                    whether to keep keys in lexicographic order.
+
+    :rtype: :class:`gcloud.storage.iterator.KeyIterator`
+            or :class:`gcloud.storage.iterator.ShardedKeyIterator`
+    :returns: An iterator of :class:`gcloud.storage.key.Key` objects.
+    """
+
+    if num_workers:
+      return ShardedKeyIterator(self, prefix=prefix,
+                                delimiter=delimiter or '/',
+                                num_workers=num_workers, ordered=ordered,
+                                fields=fields)
+
+    return KeyIterator(self, prefix=prefix, delimiter=delimiter,
+                       fields=fields, prefetch=prefetch)
+
   def new_key(self, key):
     """Given a path name (or a Key), return a :class:`gcloud.storage.key.Key` object.
 
@@ -185,17 +328,308 @@ class Bucket(object):
     """
 
     key = self.new_key(key)
-    self.connection.api_request(method='DELETE', path=key.path)
-    return key
+    response = self.connection.api_request(method='DELETE', path=key.path)
+    self.connection.invalidate_metadata(self.name, key.name)
+    return when_done(response, lambda _: key)
+
+  def delete_keys(self, keys, num_workers=4):
+    """Deletes several keys from the current bucket.
+
+    The deletes are packed into batch requests
+    (see :class:`gcloud.storage.batch.Batch`)
+    of up to 100 keys each,
+    and ``num_workers`` batches are sent at the same time.
+
+    Unlike :func:`Bucket.delete_key`,
+    this doesn't raise an exception if a key can't be deleted,
+    instead the failures are listed in the result::
+
+      >>> result = bucket.delete_keys(['file-1.txt', 'doesnt-exist'])
+      >>> print result.deleted
+      [<Key: my-bucket, file-1.txt>]
+      >>> print result.errors
+      [(<Key: my-bucket, doesnt-exist>, NotFoundError(...))]
+
+    :type keys: iterable of string or :class:`gcloud.storage.key.Key`
+    :param keys: The key names or Key objects to delete.
+
+    :type num_workers: int
+    :param num_workers: The number of batch requests to send at the same time.
+
+    :rtype: :class:`MultiDeleteResult`
+    :returns: The keys deleted and the keys that couldn't be.
+    """
+
+    result = MultiDeleteResult()
+    for key, error in self.iter_delete_keys(keys, num_workers=num_workers):
+      result.add(key, error)
+    return result
+
+  def iter_delete_keys(self, keys, num_workers=4):
+    """Deletes several keys, yielding the outcome for each one.
 
-  def delete_keys(self, keys):
-    # TODO: What should be the return value here?
-    # NOTE: boto returns a MultiDeleteResult instance.
-    for key in keys:
-      self.delete_key(key)
+    This is the engine behind :func:`Bucket.delete_keys`.
+    It reads ``keys`` lazily and keeps nothing around,
+    so it can be used to delete millions of keys.
 
-  def copy_key(self):
-    raise NotImplementedError
+    :type keys: iterable of string or :class:`gcloud.storage.key.Key`
+    :param keys: The key names or Key objects to delete.
+
+    :type num_workers: int
+    :param num_workers: The number of batch requests to send at the same time.
+
+    :rtype: generator of tuples of ``(key, exception)``
+    :returns: Each key and the exception raised deleting it
+              (or None if it was deleted), in no particular order.
+    """
+
+    def delete(key):
+      return self.connection.api_request(method='DELETE', path=key.path)
+
+    return self._iter_batched(keys, delete, num_workers)
+
+  def make_keys_public(self, keys=None, num_workers=4, progress=None):
+    """Give all users read access to several keys.
+
+    Unlike :func:`gcloud.storage.key.Key.make_public`,
+    this doesn't load each key's ACL first:
+    it adds an ``allUsers`` reader entry to each key
+    (which does nothing if the entry is already there).
+    The requests are packed into batches of up to 100 keys,
+    and ``num_workers`` batches are sent at the same time.
+
+    A key that can't be updated doesn't stop the others.
+    The failures are listed in the result
+    and can be retried::
+
+      >>> result = bucket.make_keys_public()
+      >>> if result.errors:
+      ...   result = bucket.make_keys_public(result.failed_keys)
+
+    :type keys: iterable of string or :class:`gcloud.storage.key.Key`
+    :param keys: (optional) The key names or Key objects to update.
+                 Defaults to every key in the bucket.
+
+    :type num_workers: int
+    :param num_workers: The number of batch requests to send at the same time.
+
+    :type progress: callable
+    :param progress: (optional) Called with ``(key, exception)``
+                     as each key is done
+                     (``exception`` is None if the key was updated).
+
+    :rtype: :class:`MultiResult`
+    :returns: The keys updated and the keys that couldn't be.
+    """
+
+    if keys is None:
+      # Only the names are needed to address each key.
+      keys = KeyIterator(self, fields=['name'], prefetch=1)
+
+    def grant_read(key):
+      return self.connection.api_request(
+          method='POST', path=key.path + '/acl',
+          data={'entity': 'allUsers', 'role': 'READER'})
+
+    result = MultiResult()
+    for key, error in self._iter_batched(keys, grant_read, num_workers):
+      result.add(key, error)
+      if progress:
+        progress(key, error)
+    return result
+
+  def _iter_batched(self, keys, make_request, num_workers):
+    # Calls make_request(key) for each key inside a batch
+    # (see Connection.batch) and yields (key, exception) pairs.
+
+    def send_batch(batch_keys):
+      futures = []
+      try:
+        with self.connection.batch():
+          for key in batch_keys:
+            futures.append((key, make_request(key)))
+      except exceptions.ConnectionError:
+        pass  # Every future in the failed batch holds the error.
+      except NETWORK_ERRORS, e:
+        # The batch never got an answer, so its futures never resolved.
+        return [(key, future.exception() if future.done() else e)
+                for key, future in futures]
+
+      return [(key, future.exception()) for key, future in futures]
+
+    keys = (self.new_key(key) for key in keys)
+    groups = workers.iter_groups(keys, Batch.MAX_REQUESTS)
+    for results in workers.imap_unordered(send_batch, groups, num_workers):
+      for key, error in results:
+        self.connection.invalidate_metadata(self.name, key.name)
+        yield key, error
+
+  def copy_key(self, key, destination_bucket=None, new_name=None,
+               max_bytes_per_call=None):
+    """Copy a key to a new name and/or bucket, server side.
+
+    The data never leaves Cloud Storage::
+
+      >>> backups = connection.get_bucket('my-backups')
+      >>> bucket.copy_key('my-file.txt', backups, 'my-file.txt.bak')
+      <Key: my-backups, my-file.txt.bak>
+
+    This uses the ``rewriteTo`` endpoint.
+    A copy that can't finish in one call
+    (like a large object copied to another location or storage class)
+    returns a rewrite token instead,
+    and the copy is continued with it until it's done.
+
+    Copies can take several requests,
+    so they can't be made inside a batch.
+
+    :type key: string or :class:`gcloud.storage.key.Key`
+    :param key: The key name or Key object to copy.
+
+    :type destination_bucket: :class:`Bucket`
+    :param destination_bucket: (optional) The bucket to copy to.
+                               Defaults to this bucket.
+
+    :type new_name: string
+    :param new_name: (optional) The name of the copy.
+                     Defaults to the name of the key.
+
+    :type max_bytes_per_call: int
+    :param max_bytes_per_call: (optional) The most bytes to copy per request.
+                               Typically you won't have to provide this.
+
+    :rtype: :class:`gcloud.storage.key.Key`
+    :returns: The new key.
+    :raises: :class:`gcloud.storage.exceptions.NotFoundError`
+    """
+
+    if self.connection.current_batch is not None:
+      raise ValueError('Copies cannot be made inside a batch.')
+
+    key = self.new_key(key)
+    destination_bucket = destination_bucket or self
+    new_key = destination_bucket.new_key(new_name or key.name)
+
+    path = '%s/rewriteTo%s' % (key.path, new_key.path)
+    query_params = {}
+    if max_bytes_per_call:
+      query_params['maxBytesRewrittenPerCall'] = max_bytes_per_call
+
+    while True:
+      response = self.connection.api_request(
+          method='POST', path=path, query_params=query_params,
+          api_version=self.REWRITE_API_VERSION)
+      if response.get('done'):
+        break
+      query_params['rewriteToken'] = response['rewriteToken']
+
+    self.connection.invalidate_metadata(destination_bucket.name, new_key.name)
+    return new_key._set_metadata(response['resource'])
+
+  def copy_keys(self, keys, destination_bucket=None, rename=None,
+                num_workers=8, progress=None):
+    """Copy several keys server side, ``num_workers`` at a time.
+
+    A key that can't be copied doesn't stop the others.
+    The failures are listed in the result
+    and can be retried::
+
+      >>> result = bucket.copy_keys(bucket.iter_keys(prefix='2014/'),
+      ...                           destination_bucket=archive)
+      >>> if result.errors:
+      ...   result = bucket.copy_keys(result.failed_keys, archive)
+
+    :type keys: iterable of string or :class:`gcloud.storage.key.Key`
+    :param keys: The key names or Key objects to copy.
+
+    :type destination_bucket: :class:`Bucket`
+    :param destination_bucket: (optional) The bucket to copy to.
+                               Defaults to this bucket.
+
+    :type rename: callable
+    :param rename: (optional) Called with each key name
+                   to get the name of its copy.
+                   Defaults to keeping the same name.
+
+    :type num_workers: int
+    :param num_workers: The number of keys to copy at the same time.
+
+    :type progress: callable
+    :param progress: (optional) Called with ``(key, exception)``
+                     as each key is done
+                     (``exception`` is None if the key was copied).
+
+    :rtype: :class:`MultiResult`
+    :returns: The new keys (in ``succeeded``)
+              and the keys that couldn't be copied (in ``errors``).
+    """
+
+    return self._copy_keys(keys, destination_bucket, rename, num_workers,
+                           progress, delete=False)
+
+  def move_keys(self, keys, destination_bucket=None, rename=None,
+                num_workers=8, progress=None):
+    """Move several keys server side, ``num_workers`` at a time.
+
+    Each key is copied (see :func:`Bucket.copy_key`)
+    and then deleted,
+    so a failed move leaves the original key in place.
+
+    :type keys: iterable of string or :class:`gcloud.storage.key.Key`
+    :param keys: The key names or Key objects to move.
+
+    :type destination_bucket: :class:`Bucket`
+    :param destination_bucket: (optional) The bucket to move to.
+                               Defaults to this bucket.
+
+    :type rename: callable
+    :param rename: (optional) Called with each key name
+                   to get its new name.
+                   Defaults to keeping the same name.
+
+    :type num_workers: int
+    :param num_workers: The number of keys to move at the same time.
+
+    :type progress: callable
+    :param progress: (optional) Called with ``(key, exception)``
+                     as each key is done
+                     (``exception`` is None if the key was moved).
+
+    :rtype: :class:`MultiResult`
+    :returns: The new keys (in ``succeeded``)
+              and the keys that couldn't be moved (in ``errors``).
+    """
+
+    return self._copy_keys(keys, destination_bucket, rename, num_workers,
+                           progress, delete=True)
+
+  def _copy_keys(self, keys, destination_bucket, rename, num_workers,
+                 progress, delete):
+    destination_bucket = destination_bucket or self
+
+    def copy(key):
+      new_name = rename(key.name) if rename else key.name
+      try:
+        if (delete and destination_bucket.name == self.name and
+            new_name == key.name):
+          raise ValueError('Cannot move %r onto itself.' % key)
+        new_key = self.copy_key(key, destination_bucket, new_name)
+        if delete:
+          self.delete_key(key)
+      except Exception, e:
+        return key, None, e
+      return key, new_key, None
+
+    result = MultiResult()
+    keys = (self.new_key(key) for key in keys)
+    for key, new_key, error in workers.imap_unordered(copy, keys, num_workers):
+      if error is None:
+        result.add(new_key, None)
+      else:
+        result.add(key, error)
+      if progress:
+        progress(key, error)
+    return result
 
   def upload_file(self, filename, key=None):
     # TODO: What do we do about overwriting data?
@@ -249,27 +683,53 @@ class Bucket(object):
     :returns: Whether metadata is available locally.
     """
 
-    if not self.metadata:
+    if field and field in self._loaded_fields:
+      return True
+    elif not self.metadata:
       return False
     elif field and field not in self.metadata:
       return False
     else:
       return True
 
-  def reload_metadata(self, full=False):
+  def reload_metadata(self, full=False, fields=None):
     """Reload metadata from Cloud Storage.
 
     :type full: bool
     :param full: If True, loads all data (include ACL data).
 
+    :type fields: list of strings
+    :param fields: (optional) Only load these fields
+                   (ie, ``['size', 'updated']``)
+                   and keep the rest of the metadata already loaded.
+
     :rtype: :class:`Bucket`
     :returns: The bucket you just reloaded data for.
     """
 
     projection = 'full' if full else 'noAcl'
     query_params = {'projection': projection}
-    self.metadata = self.connection.api_request(
-        method='GET', path=self.path, query_params=query_params)
+    if fields:
+      query_params['fields'] = ','.join(fields)
+
+    response = self.connection.get_resource(
+        self.path, query_params=query_params, cache_key=(self.name, ''))
+
+    if fields:
+      return when_done(
+          response, lambda metadata: self._update_metadata(metadata, fields))
+    return when_done(response, self._set_metadata)
+
+  def _set_metadata(self, metadata):
+    self.metadata = metadata
+    self._loaded_fields = set()
+    return self
+
+  def _update_metadata(self, metadata, fields):
+    updated = dict(self.metadata or {})
+    updated.update(metadata)
+    self.metadata = updated
+    self._loaded_fields.update(fields)
     return self
 
   def get_metadata(self, field=None, default=None):
@@ -279,7 +739,8 @@ class Bucket(object):
     and that field can be retrieved by refreshing data
     from Cloud Storage,
     this method will reload the data using
-    :func:`Bucket.reload_metadata`.
+    :func:`Bucket.reload_metadata`
+    (fetching only that field if the rest is already loaded).
 
     :type field: string
     :param field: (optional) A particular field to retrieve from metadata.
@@ -293,7 +754,11 @@ class Bucket(object):
 
     if not self.has_metadata(field=field):
       full = (field and field in ('acl', 'defaultObjectAcl'))
-      self.reload_metadata(full=full)
+      if field and self.metadata:
+        # We already have the rest, so only fetch what's missing.
+        self.reload_metadata(full=full, fields=[field])
+      else:
+        self.reload_metadata(full=full)
 
     if field:
       return self.metadata.get(field, default)
@@ -316,10 +781,11 @@ class Bucket(object):
     :returns: The current bucket.
     """
 
-    self.metadata = self.connection.api_request(
+    response = self.connection.api_request(
         method='PATCH', path=self.path, data=metadata,
         query_params={'projection': 'full'})
-    return self
+    self.connection.invalidate_metadata(self.name)
+    return when_done(response, self._set_metadata)
 
   def configure_website(self, main_page_suffix=None, not_found_page=None):
     """Configure website-related metadata.
@@ -536,16 +1002,29 @@ class Bucket(object):
 
     return self.save_default_object_acl(acl=[])
 
-  def make_public(self, recursive=False, future=False):
+  def make_public(self, recursive=False, future=False, num_workers=4,
+                  progress=None):
     """Make a bucket public.
 
     :type recursive: bool
     :param recursive: If True, this will make all keys inside the bucket
-                      public as well.
+                      public as well
+                      (see :func:`Bucket.make_keys_public`).
 
     :type future: bool
     :param future: If True, this will make all objects created in the future
                    public as well.
+
+    :type num_workers: int
+    :param num_workers: The number of batch requests to send at the same time
+                        when ``recursive`` is True.
+
+    :type progress: callable
+    :param progress: (optional) Called with ``(key, exception)``
+                     as each key is done when ``recursive`` is True.
+
+    :rtype: :class:`MultiResult` or None
+    :returns: The outcome for the keys when ``recursive`` is True.
     """
 
     self.get_acl().all().grant_read()
@@ -556,6 +1035,4 @@ class Bucket(object):
       self.save_default_object_acl()
 
     if recursive:
-      for key in self:
-        key.get_acl().all().grant_read()
-        key.save_acl()
+      return self.make_keys_public(num_workers=num_workers, progress=progress)
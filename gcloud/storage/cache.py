@@ -0,0 +1,505 @@
+"""Caching metadata and object data between requests.
+
+Fetching a key's (or a bucket's) metadata costs a round trip,
+even if the same object was fetched a second ago.
+Give a connection a metadata cache
+and :func:`gcloud.storage.bucket.Bucket.get_key`,
+:func:`gcloud.storage.key.Key.reload_metadata`,
+:func:`gcloud.storage.bucket.Bucket.reload_metadata`
+and :func:`gcloud.storage.connection.Connection.get_bucket`
+go through it::
+
+  >>> from gcloud.storage.cache import MemoryMetadataCache
+  >>> connection.metadata_cache = MemoryMetadataCache(ttl=60)
+  >>> key = bucket.get_key('config.json')  # Fetched.
+  >>> key = bucket.get_key('config.json')  # Served from the cache.
+  >>> print connection.metadata_cache.get_stats()
+  {'hits': 1, 'misses': 1, 'revalidations': 0}
+
+Entries younger than ``ttl`` seconds are used as they are.
+Older entries are revalidated with a conditional request
+(``If-None-Match`` with the stored ETag),
+which costs a round trip but no payload
+if the resource hasn't changed.
+Changes made through the same connection
+(uploads, patches, ACL changes and deletes)
+drop the affected entries,
+but changes made elsewhere can go unnoticed for up to ``ttl`` seconds.
+
+:class:`SqliteMetadataCache` keeps the entries in a file,
+so they survive restarts
+and can be shared between processes.
+
+Object data can be cached too,
+in a local directory shared by every process using it
+(see :class:`ContentCache`)::
+
+  >>> from gcloud.storage.cache import ContentCache
+  >>> connection.content_cache = ContentCache('/var/cache/gcloud')
+  >>> model = bucket.get_key('model.bin').get_contents_as_string()
+
+Cached data is keyed by generation,
+so it is never stale,
+but checking the generation costs a metadata request
+unless the metadata is cached as well.
+"""
+
+import collections
+import copy
+import errno
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from gcloud.storage.iterator import KeyStreamIterator
+from gcloud.storage.transfer import Checksum
+
+
+CacheEntry = collections.namedtuple(
+    'CacheEntry', ['metadata', 'etag', 'stored_at'])
+"""A cached resource: its metadata, its ETag and when it was fetched."""
+
+
+class MetadataCache(object):
+  """The interface (and bookkeeping) shared by metadata caches.
+
+  Entries are keyed by bucket name, object name
+  (an empty string for the bucket itself)
+  and variant
+  (the query string used to fetch them,
+  since ``projection`` and ``fields`` change the result).
+
+  :type ttl: int or float
+  :param ttl: The number of seconds an entry is used
+              without revalidating it.
+  """
+
+  def __init__(self, ttl=60):
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self.revalidations = 0
+    self._stats_lock = threading.Lock()
+
+  def get(self, bucket_name, name, variant):
+    """Get an entry.
+
+    :rtype: :class:`CacheEntry` or None
+    :returns: The entry, or None if it isn't cached.
+    """
+
+    raise NotImplementedError
+
+  def set(self, bucket_name, name, variant, metadata, etag=None):
+    """Store an entry, replacing any existing one."""
+
+    raise NotImplementedError
+
+  def touch(self, bucket_name, name, variant):
+    """Mark an entry as fetched just now (after revalidating it)."""
+
+    raise NotImplementedError
+
+  def invalidate(self, bucket_name, name=''):
+    """Drop every variant of an object (or of a bucket)."""
+
+    raise NotImplementedError
+
+  def clear(self):
+    """Drop every entry."""
+
+    raise NotImplementedError
+
+  def is_fresh(self, entry):
+    """Whether an entry can be used without revalidating it.
+
+    :type entry: :class:`CacheEntry`
+    :param entry: The entry to check.
+
+    :rtype: bool
+    """
+
+    return time.time() - entry.stored_at < self.ttl
+
+  def record(self, outcome):
+    """Count a lookup.
+
+    :type outcome: string
+    :param outcome: One of ``'hits'``, ``'misses'`` or ``'revalidations'``.
+    """
+
+    with self._stats_lock:
+      setattr(self, outcome, getattr(self, outcome) + 1)
+
+  def get_stats(self):
+    """Get the lookup counters.
+
+    :rtype: dict
+    :returns: The number of hits, misses and revalidations.
+    """
+
+    with self._stats_lock:
+      return {'hits': self.hits, 'misses': self.misses,
+              'revalidations': self.revalidations}
+
+
+class MemoryMetadataCache(MetadataCache):
+  """A metadata cache in memory, evicting the least recently used entries.
+
+  :type max_entries: int
+  :param max_entries: The most entries to keep.
+
+  :type ttl: int or float
+  :param ttl: The number of seconds an entry is used
+              without revalidating it.
+  """
+
+  def __init__(self, max_entries=10000, ttl=60):
+    super(MemoryMetadataCache, self).__init__(ttl=ttl)
+    self.max_entries = max_entries
+    self._entries = collections.OrderedDict()
+    self._variants = {}  # (bucket_name, name) -> set of variants.
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, bucket_name, name, variant):
+    with self._lock:
+      entry = self._entries.pop((bucket_name, name, variant), None)
+      if entry is None:
+        return None
+
+      # Re-insert to mark it as the most recently used.
+      self._entries[(bucket_name, name, variant)] = entry
+
+    # Callers are free to modify what they get back.
+    return entry._replace(metadata=copy.deepcopy(entry.metadata))
+
+  def set(self, bucket_name, name, variant, metadata, etag=None):
+    entry = CacheEntry(copy.deepcopy(metadata), etag, time.time())
+
+    with self._lock:
+      self._entries.pop((bucket_name, name, variant), None)
+      self._entries[(bucket_name, name, variant)] = entry
+      self._variants.setdefault((bucket_name, name), set()).add(variant)
+
+      while len(self._entries) > self.max_entries:
+        (old_bucket, old_name, old_variant), _ = self._entries.popitem(
+            last=False)
+        self._discard_variant(old_bucket, old_name, old_variant)
+
+  def touch(self, bucket_name, name, variant):
+    with self._lock:
+      # Re-insert to mark it as the most recently used.
+      entry = self._entries.pop((bucket_name, name, variant), None)
+      if entry is not None:
+        self._entries[(bucket_name, name, variant)] = entry._replace(
+            stored_at=time.time())
+
+  def invalidate(self, bucket_name, name=''):
+    with self._lock:
+      for variant in self._variants.pop((bucket_name, name), ()):
+        self._entries.pop((bucket_name, name, variant), None)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self._variants.clear()
+
+  def _discard_variant(self, bucket_name, name, variant):
+    variants = self._variants.get((bucket_name, name))
+    if variants is not None:
+      variants.discard(variant)
+      if not variants:
+        del self._variants[(bucket_name, name)]
+
+
+class SqliteMetadataCache(MetadataCache):
+  """A metadata cache in a SQLite database.
+
+  The database can be shared by several processes.
+
+  :type filename: string
+  :param filename: The path of the database file.
+
+  :type ttl: int or float
+  :param ttl: The number of seconds an entry is used
+              without revalidating it.
+  """
+
+  def __init__(self, filename, ttl=60):
+    super(SqliteMetadataCache, self).__init__(ttl=ttl)
+    self.filename = filename
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(filename, timeout=30,
+                               check_same_thread=False)
+
+    with self._lock:
+      with self._db:
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS metadata ('
+            '  bucket TEXT, name TEXT, variant TEXT,'
+            '  metadata TEXT, etag TEXT, stored_at REAL,'
+            '  PRIMARY KEY (bucket, name, variant))')
+
+  def get(self, bucket_name, name, variant):
+    with self._lock:
+      row = self._db.execute(
+          'SELECT metadata, etag, stored_at FROM metadata'
+          ' WHERE bucket = ? AND name = ? AND variant = ?',
+          (bucket_name, name, variant)).fetchone()
+
+    if row is None:
+      return None
+    return CacheEntry(json.loads(row[0]), row[1], row[2])
+
+  def set(self, bucket_name, name, variant, metadata, etag=None):
+    with self._lock:
+      with self._db:
+        self._db.execute(
+            'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)',
+            (bucket_name, name, variant, json.dumps(metadata), etag,
+             time.time()))
+
+  def touch(self, bucket_name, name, variant):
+    with self._lock:
+      with self._db:
+        self._db.execute(
+            'UPDATE metadata SET stored_at = ?'
+            ' WHERE bucket = ? AND name = ? AND variant = ?',
+            (time.time(), bucket_name, name, variant))
+
+  def invalidate(self, bucket_name, name=''):
+    with self._lock:
+      with self._db:
+        self._db.execute(
+            'DELETE FROM metadata WHERE bucket = ? AND name = ?',
+            (bucket_name, name))
+
+  def clear(self):
+    with self._lock:
+      with self._db:
+        self._db.execute('DELETE FROM metadata')
+
+  def close(self):
+    """Close the database."""
+
+    with self._lock:
+      self._db.close()
+
+
+class ContentCache(object):
+  """A size-bounded directory of object data.
+
+  Each file holds one generation of one object.
+  Files are written under a temporary name
+  and renamed into place once complete (and verified),
+  so several processes can share the directory
+  without ever reading half a file.
+  When the directory grows beyond ``max_size``,
+  the least recently used files are deleted.
+
+  :type directory: string
+  :param directory: The directory to keep the data in.
+
+  :type max_size: int
+  :param max_size: The most bytes to keep in the directory.
+  """
+
+  TEMP_PREFIX = '.tmp-'
+
+  def __init__(self, directory, max_size=1024 * 1024 * 1024):
+    self.directory = directory
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+
+    if not os.path.isdir(directory):
+      try:
+        os.makedirs(directory)
+      except OSError:
+        # Another process might have just created it.
+        if not os.path.isdir(directory):
+          raise
+
+  def get_filename(self, bucket_name, name, generation):
+    """Get the path where an object's data is cached.
+
+    :type bucket_name: string
+    :param bucket_name: The name of the bucket.
+
+    :type name: string
+    :param name: The name of the key.
+
+    :type generation: int or string
+    :param generation: The generation of the object.
+
+    :rtype: string
+    :returns: The path of the cached file (which might not exist).
+    """
+
+    cache_key = u'%s/%s#%s' % (bucket_name, name, generation)
+    digest = hashlib.sha1(cache_key.encode('utf-8')).hexdigest()
+    return os.path.join(self.directory, digest)
+
+  def open(self, key, checksum=None):
+    """Open the cached data of a key, downloading it first if needed.
+
+    :type key: :class:`gcloud.storage.key.Key`
+    :param key: The key to read.
+
+    :type checksum: string
+    :param checksum: (optional) The algorithm (``'md5'`` or ``'crc32c'``)
+                     to verify the data with,
+                     even if it is already cached.
+                     A cached file that doesn't match is downloaded again.
+
+    :rtype: file
+    :returns: The cached file, open for reading.
+    """
+
+    generation = key.get_metadata('generation')
+    filename = self.get_filename(key.bucket.name, key.name, generation)
+
+    try:
+      fh = open(filename, 'rb')
+    except IOError, e:
+      if e.errno != errno.ENOENT:
+        raise
+    else:
+      if checksum and not self._is_intact(key, fh, checksum):
+        fh.close()
+        self._remove(filename)
+      else:
+        # The modification time tracks the last use.
+        self._touch(filename)
+        self._record('hits')
+        return fh
+
+    self._record('misses')
+    return self.fetch(key, generation, filename, checksum=checksum)
+
+  @staticmethod
+  def _is_intact(key, fh, algorithm):
+    # Gzip encoded keys are cached decompressed,
+    # so they can only be verified as they are downloaded.
+    if key.metadata.get('contentEncoding') == 'gzip':
+      return True
+
+    checksum = Checksum(algorithm)
+    for chunk in iter(lambda: fh.read(key.CHUNK_SIZE), ''):
+      checksum.update(chunk)
+    fh.seek(0)
+
+    expected = key.get_metadata(Checksum.METADATA_FIELDS[algorithm])
+    return expected is None or expected == checksum.b64digest()
+
+  def fetch(self, key, generation, filename, checksum=None):
+    """Download a generation of a key into the cache.
+
+    :type key: :class:`gcloud.storage.key.Key`
+    :param key: The key to download.
+
+    :type generation: int or string
+    :param generation: The generation to download.
+
+    :type filename: string
+    :param filename: Where to put the data.
+
+    :type checksum: string
+    :param checksum: (optional) The algorithm to verify the data with.
+                     Defaults to MD5 when the key's hash is known.
+
+    :rtype: file
+    :returns: The downloaded file, open for reading.
+              It is opened before evicting other files,
+              so it stays readable even if it is evicted
+              (ie, by another process sharing the directory).
+    """
+
+    if checksum:
+      checksum = Checksum(checksum)
+    elif key.metadata.get('md5Hash'):
+      checksum = Checksum('md5')
+
+    fd, temp_filename = tempfile.mkstemp(dir=self.directory,
+                                         prefix=self.TEMP_PREFIX)
+    try:
+      with os.fdopen(fd, 'wb') as fh:
+        for chunk in KeyStreamIterator(key, checksum=checksum,
+                                       generation=generation):
+          fh.write(chunk)
+      os.rename(temp_filename, filename)
+    except:
+      if os.path.exists(temp_filename):
+        os.remove(temp_filename)
+      raise
+
+    fh = open(filename, 'rb')
+    self.evict(keep=filename)
+    return fh
+
+  def evict(self, keep=None):
+    """Delete the least recently used files until under ``max_size``.
+
+    :type keep: string
+    :param keep: (optional) The path of a file not to delete
+                 (ie, one just downloaded, larger than ``max_size`` alone).
+    """
+
+    files = []
+    total_size = 0
+    for filename in os.listdir(self.directory):
+      if filename.startswith(self.TEMP_PREFIX):
+        continue
+
+      path = os.path.join(self.directory, filename)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue  # Evicted by another process.
+
+      total_size += stat.st_size
+      if path != keep:
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    files.sort()
+    for _, size, path in files:
+      if total_size <= self.max_size:
+        break
+      self._remove(path)
+      total_size -= size
+
+  def get_stats(self):
+    """Get the lookup counters.
+
+    :rtype: dict
+    :returns: The number of hits and misses.
+    """
+
+    with self._lock:
+      return {'hits': self.hits, 'misses': self.misses}
+
+  def _record(self, outcome):
+    with self._lock:
+      setattr(self, outcome, getattr(self, outcome) + 1)
+
+  @staticmethod
+  def _touch(filename):
+    try:
+      os.utime(filename, None)
+    except OSError:
+      pass
+
+  @staticmethod
+  def _remove(filename):
+    try:
+      os.remove(filename)
+    except OSError:
+      pass  # Already evicted by another process.
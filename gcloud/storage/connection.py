@@ -1,10 +1,16 @@
 import base64
 import datetime
+import httplib
 import httplib2
 import json
+import multiprocessing
+import threading
 import time
 import urllib
+import urlparse
+import weakref
 
+from Crypto import Random
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import RSA
 from Crypto.Signature import PKCS1_v1_5
@@ -12,9 +18,13 @@ from OpenSSL import crypto
 import pytz
 
 from gcloud import connection
+from gcloud.transport import HttpPool
 from gcloud.storage import exceptions
+from gcloud.storage.batch import Batch
+from gcloud.storage.batch import when_done
 from gcloud.storage.bucket import Bucket
 from gcloud.storage.iterator import BucketIterator
+from gcloud.storage.retry import RetryPolicy
 
 
 class Connection(connection.Connection):
@@ -67,19 +77,116 @@ class Connection(connection.Connection):
 
   API_ACCESS_ENDPOINT = 'https://storage.googleapis.com'
 
+  SIGNING_POOL_THRESHOLD = 500
+  """The fewest URLs :meth:`generate_signed_urls` signs on a process pool."""
+
+  STREAMING_TIMEOUT = 60
+  """The seconds a streaming request waits on its socket before giving up."""
+
   def __init__(self, project, *args, **kwargs):
     """
     :type project: string
     :param project: The project name to connect to.
+
+    :type metadata_cache: :class:`gcloud.storage.cache.MetadataCache`
+    :param metadata_cache: (optional) A cache for bucket and key metadata
+                           (see :mod:`gcloud.storage.cache`).
+
+    :type content_cache: :class:`gcloud.storage.cache.ContentCache`
+    :param content_cache: (optional) A local cache for the data of keys.
+
+    :type retry_policy: :class:`gcloud.storage.retry.RetryPolicy`
+    :param retry_policy: (optional) When to retry failed requests
+                         (see :mod:`gcloud.storage.retry`).
+                         Defaults to a new :class:`RetryPolicy`.
     """
 
+    self.metadata_cache = kwargs.pop('metadata_cache', None)
+    self.content_cache = kwargs.pop('content_cache', None)
+    self.retry_policy = kwargs.pop('retry_policy', None) or RetryPolicy()
     super(Connection, self).__init__(*args, **kwargs)
 
     self.project = project
+    self._batch_state = threading.local()
 
   def __iter__(self):
     return iter(BucketIterator(connection=self))
 
+  @property
+  def http(self):
+    """A getter for the HTTP transport used in talking to the API.
+
+    Unlike the base class,
+    this defaults to a :class:`gcloud.transport.HttpPool`
+    so that transfers can use the connection
+    from several worker threads at once.
+
+    :rtype: :class:`gcloud.transport.HttpPool` or :class:`httplib2.Http`
+    :returns: The object used to transport data.
+    """
+
+    if not hasattr(self, '_http'):
+      self._http = HttpPool(credentials=self.credentials,
+                            http_factory=self.create_http)
+    return self._http
+
+  @staticmethod
+  def create_http():
+    """Factory method for the :class:`httplib2.Http` objects in the pool.
+
+    :rtype: :class:`httplib2.Http`
+    :returns: An Http object that doesn't treat 308 as a redirect.
+    """
+
+    http = httplib2.Http()
+    # Resumable uploads use 308 to mean "Resume Incomplete".
+    if 308 in getattr(http, 'redirect_codes', ()):
+      http.redirect_codes = http.redirect_codes - set([308])
+    return http
+
+  def batch(self):
+    """Group the API requests made in a ``with`` block into batches.
+
+    Inside the block,
+    :func:`api_request` (and so most methods of buckets and keys)
+    returns a :class:`gcloud.storage.batch.Future`
+    instead of the result.
+    The requests are sent when the block exits::
+
+      >>> with connection.batch():
+      ...   for name in names:
+      ...     bucket.delete_key(name)
+
+    Batching only applies to the thread that entered the block.
+    See :mod:`gcloud.storage.batch` for more details.
+
+    :rtype: :class:`gcloud.storage.batch.Batch`
+    :returns: A context manager collecting the requests.
+    """
+
+    return Batch(self)
+
+  @property
+  def current_batch(self):
+    """The batch collecting this thread's API requests, if any.
+
+    :rtype: :class:`gcloud.storage.batch.Batch` or None
+    :returns: The innermost active batch.
+    """
+
+    batches = getattr(self._batch_state, 'batches', None)
+    return batches[-1] if batches else None
+
+  def push_batch(self, batch):
+    if not hasattr(self._batch_state, 'batches'):
+      self._batch_state.batches = []
+    self._batch_state.batches.append(batch)
+
+  def pop_batch(self, batch):
+    if self.current_batch is not batch:
+      raise ValueError('Batches must be exited in the reverse order.')
+    self._batch_state.batches.pop()
+
   def __contains__(self, bucket_name):
     return self.lookup(bucket_name) is not None
 
@@ -132,7 +239,7 @@ class Connection(connection.Connection):
     :type url: string
     :param url: The URL to send the request to.
 
-    :type data: string
+    :type data: string, buffer or memoryview
     :param data: The data to send as the body of the request.
 
     :type content_type: string
@@ -150,11 +257,12 @@ class Connection(connection.Connection):
     headers['Accept-Encoding'] = 'gzip'
 
     if data:
-      content_length = len(str(data))
+      # Don't use str() here, data might be a (large) buffer or memoryview.
+      content_length = len(data)
     else:
       content_length = 0
 
-    headers['Content-Length'] = content_length
+    headers['Content-Length'] = str(content_length)
 
     if content_type:
       headers['Content-Type'] = content_type
@@ -162,6 +270,101 @@ class Connection(connection.Connection):
     return self.http.request(uri=url, method=method, headers=headers,
                                body=data)
 
+  def make_retried_request(self, method, url, data=None, content_type=None,
+                           headers=None):
+    """Send a request that is safe to repeat, retrying it if it fails.
+
+    Network errors and retryable statuses
+    are retried according to :attr:`retry_policy`.
+    Other responses (including errors) are returned as they are.
+
+    The arguments are the same as for :func:`make_request`.
+
+    :rtype: tuple of ``response`` (a dictionary of sorts)
+            and ``content`` (a string).
+    :returns: The HTTP response object and the content of the response.
+    :raises: :class:`gcloud.storage.exceptions.ConnectionError`
+             if every attempt got a retryable status.
+    """
+
+    def send():
+      response, content = self.make_request(
+          method=method, url=url, data=data, content_type=content_type,
+          headers=dict(headers or {}))
+      if response.status in self.retry_policy.retryable_statuses:
+        raise exceptions.ConnectionError(response, content)
+      return response, content
+
+    return self.retry_policy.call(send)
+
+  def get_http_connection(self, url):
+    """Factory method for the raw connections used by streaming requests.
+
+    :type url: string
+    :param url: The URL that will be requested.
+
+    :rtype: :class:`httplib.HTTPConnection`
+    :returns: An (unopened) connection to the URL's host,
+              timing out after :attr:`STREAMING_TIMEOUT` seconds.
+    """
+
+    parts = urlparse.urlsplit(url)
+    if parts.scheme == 'https':
+      return httplib.HTTPSConnection(parts.netloc,
+                                     timeout=self.STREAMING_TIMEOUT)
+    return httplib.HTTPConnection(parts.netloc, timeout=self.STREAMING_TIMEOUT)
+
+  def make_streaming_request(self, method, url, headers=None):
+    """Send a request to the API without reading the response body.
+
+    :class:`httplib2.Http` always reads the whole response into memory,
+    so this goes around it and returns the raw response,
+    which the caller can ``read`` a piece at a time.
+    The caller is responsible for closing the response.
+
+    This also bypasses :attr:`http`
+    (and so the :class:`gcloud.transport.HttpPool`):
+    each streaming request opens and closes its own socket,
+    which doesn't count against the pool's ``max_per_host``.
+    A socket that stalls for :attr:`STREAMING_TIMEOUT` seconds
+    raises :class:`socket.timeout`.
+
+    Typically, you shouldn't need to use this method.
+
+    :type method: string
+    :param method: The HTTP method to use in the request.
+
+    :type url: string
+    :param url: The URL to send the request to.
+
+    :type headers: dict
+    :param headers: A dictionary of HTTP headers to send with the request.
+
+    :rtype: :class:`httplib.HTTPResponse`
+    :returns: The HTTP response, with its body still unread.
+    """
+
+    headers = headers or {}
+    # We hand back the raw bytes,
+    # so unless the caller can decode them, don't ask for an encoding.
+    headers.setdefault('Accept-Encoding', 'identity')
+    headers['Connection'] = 'close'
+
+    if self.credentials:
+      if (not self.credentials.access_token or
+          self.credentials.access_token_expired):
+        self.credentials.refresh(httplib2.Http())
+      self.credentials.apply(headers)
+
+    parts = urlparse.urlsplit(url)
+    request_path = parts.path
+    if parts.query:
+      request_path += '?' + parts.query
+
+    http_connection = self.get_http_connection(url)
+    http_connection.request(method, request_path, headers=headers)
+    return http_connection.getresponse()
+
   def api_request(self, method, path=None, query_params=None,
                   data=None, content_type=None,
                   api_base_url=None, api_version=None,
@@ -201,7 +404,13 @@ class Connection(connection.Connection):
     :param expect_json: If True, this method will try to parse the response
                         as JSON and raise an exception if that cannot be done.
 
-    :raises: Exception if the response code is not 200 OK.
+    :rtype: dict, string or :class:`gcloud.storage.batch.Future`
+    :returns: The parsed response,
+              or a future for it when called inside :func:`batch`.
+
+    :raises: :class:`gcloud.storage.exceptions.ConnectionError`
+             if the response code is not 2xx
+             (after retrying, for idempotent methods).
     """
 
     url = self.build_api_url(path=path, query_params=query_params,
@@ -214,8 +423,126 @@ class Connection(connection.Connection):
       data = json.dumps(data)
       content_type = 'application/json'
 
-    response, content = self.make_request(
-        method=method, url=url, data=data, content_type=content_type)
+    batch = self.current_batch
+    if batch is not None:
+      return batch.defer(method=method, url=url, data=data,
+                         content_type=content_type, expect_json=expect_json)
+
+    if method in self.retry_policy.idempotent_methods:
+      response, content = self.make_retried_request(
+          method=method, url=url, data=data, content_type=content_type)
+    else:
+      response, content = self.make_request(
+          method=method, url=url, data=data, content_type=content_type)
+    return self.process_response(response, content, expect_json=expect_json)
+
+  def get_resource(self, path, query_params=None, cache_key=None):
+    """Get the metadata of a bucket or key, using the metadata cache.
+
+    Without a :attr:`metadata_cache` (or a ``cache_key``)
+    this is the same as a ``GET`` with :func:`api_request`.
+
+    :type path: string
+    :param path: The path to the resource (ie, ``'/b/bucket-name'``).
+
+    :type query_params: dict
+    :param query_params: A dictionary of keys and values to insert into
+                         the query string of the URL.
+
+    :type cache_key: tuple
+    :param cache_key: (optional) The bucket name and key name
+                      (an empty string for a bucket)
+                      to cache the resource under.
+
+    :rtype: dict or :class:`gcloud.storage.batch.Future`
+    :returns: The parsed resource.
+    :raises: :class:`gcloud.storage.exceptions.NotFoundError`
+             if the resource doesn't exist.
+    """
+
+    cache = self.metadata_cache
+    if cache is None or cache_key is None:
+      return self.api_request(method='GET', path=path,
+                              query_params=query_params)
+
+    bucket_name, name = cache_key
+    variant = urllib.urlencode(sorted((query_params or {}).items()))
+
+    entry = cache.get(bucket_name, name, variant)
+    if entry is not None and cache.is_fresh(entry):
+      cache.record('hits')
+      return entry.metadata
+
+    if self.current_batch is not None:
+      # Batched requests can't be conditional, so just refresh the entry.
+      def store(metadata):
+        cache.set(bucket_name, name, variant, metadata,
+                  etag=metadata.get('etag'))
+        return metadata
+
+      cache.record('misses')
+      response = self.api_request(method='GET', path=path,
+                                  query_params=query_params)
+      return when_done(response, store)
+
+    headers = {}
+    if entry is not None and entry.etag:
+      headers['If-None-Match'] = entry.etag
+
+    url = self.build_api_url(path=path, query_params=query_params)
+    response, content = self.make_retried_request(method='GET', url=url,
+                                                  headers=headers)
+
+    if response.status == 304:
+      cache.touch(bucket_name, name, variant)
+      cache.record('revalidations')
+      return entry.metadata
+
+    try:
+      metadata = self.process_response(response, content)
+    except exceptions.NotFoundError:
+      # Deleted since it was cached.
+      cache.invalidate(bucket_name, name)
+      raise
+    cache.set(bucket_name, name, variant, metadata,
+              etag=response.get('etag') or metadata.get('etag'))
+    cache.record('misses')
+    return metadata
+
+  def invalidate_metadata(self, bucket_name, name=''):
+    """Drop a bucket or key from the metadata cache, if there is one.
+
+    This is called for every change made through this connection.
+
+    :type bucket_name: string
+    :param bucket_name: The name of the bucket.
+
+    :type name: string
+    :param name: The name of the key (or empty for the bucket itself).
+    """
+
+    if self.metadata_cache is not None:
+      self.metadata_cache.invalidate(bucket_name, name)
+
+  def process_response(self, response, content, expect_json=True):
+    """Check the response to an API request and parse its content.
+
+    :type response: dict
+    :param response: The HTTP response object.
+
+    :type content: string
+    :param content: The content of the response.
+
+    :type expect_json: bool
+    :param expect_json: If True, parse the content as JSON
+                        and raise an exception if that cannot be done.
+
+    :rtype: dict or string
+    :returns: The parsed content.
+    :raises: :class:`gcloud.storage.exceptions.NotFoundError` for a 404,
+             :class:`gcloud.storage.exceptions.ConnectionError`
+             for any other error.
+    """
 
     # TODO: Add better error handling.
     if response.status == 404:
@@ -232,6 +559,22 @@ class Connection(connection.Connection):
 
     return content
 
+  def iter_buckets(self, fields=None, prefetch=0):
+    """List the buckets in this project, loading only some fields.
+
+    :type fields: list of strings
+    :param fields: (optional) The fields to load for each bucket
+                   (ie, ``['name', 'location']``).
+
+    :type prefetch: int
+    :param prefetch: The number of pages to fetch ahead in the background.
+
+    :rtype: :class:`gcloud.storage.iterator.BucketIterator`
+    :returns: An iterator of :class:`gcloud.storage.bucket.Bucket` objects.
+    """
+
+    return BucketIterator(connection=self, fields=fields, prefetch=prefetch)
+
   def get_all_buckets(self, *args, **kwargs):
     """Get all buckets in the project.
 
@@ -285,7 +628,7 @@ class Connection(connection.Connection):
 
     # TODO: URL-encode the bucket name to be safe?
     bucket = self.new_bucket(bucket_name)
-    response = self.api_request(method='GET', path=bucket.path)
+    response = self.get_resource(bucket.path, cache_key=(bucket.name, ''))
     return Bucket.from_dict(response, connection=self)
 
   def lookup(self, bucket_name):
@@ -379,12 +722,14 @@ class Connection(connection.Connection):
 
     bucket = self.new_bucket(bucket)
 
-    # This force delete operation is slow.
     if force:
-      for key in bucket:
-        key.delete()
+      for key, error in bucket.iter_delete_keys(bucket):
+        # Someone else deleting a key first is fine.
+        if error and not isinstance(error, exceptions.NotFoundError):
+          raise error
 
     response = self.api_request(method='DELETE', path=bucket.path)
+    self.invalidate_metadata(bucket.name)
     return True
 
   def new_bucket(self, bucket):
@@ -444,57 +789,205 @@ class Connection(connection.Connection):
     :returns: A signed URL you can use to access the resource until expiration.
     """
 
-    # expiration can be an absolute timestamp (int, long),
-    # an absolute time (datetime.datetime),
-    # or a relative time (datetime.timedelta).
-    # We should convert all of these into an absolute timestamp.
-
-    # If it's a timedelta, add it to `now` in UTC.
-    if isinstance(expiration, datetime.timedelta):
-      now = datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
-      expiration = now + expiration
-
-    # If it's a datetime, convert to a timestamp.
-    if isinstance(expiration, datetime.datetime):
-      # Make sure the timezone on the value is UTC
-      # (either by converting or replacing the value).
-      if expiration.tzinfo:
-        expiration = expiration.astimezone(pytz.utc)
-      else:
-        expiration = expiration.replace(tzinfo=pytz.utc)
-
-      # Turn the datetime into a timestamp (seconds, not microseconds).
-      expiration = int(time.mktime(expiration.timetuple()))
-
-    if not isinstance(expiration, (int, long)):
-      raise ValueError('Expected an integer timestamp, datetime, or timedelta. '
-                       'Got %s' % type(expiration))
-
-    # Generate the string to sign.
-    signature_string = '\n'.join([
-      method,
-      content_md5 or '',
-      content_type or '',
-      str(expiration),
-      resource])
+    expiration = get_expiration_seconds(expiration)
+    signature_string = get_signature_string(
+        resource, expiration, method=method, content_md5=content_md5,
+        content_type=content_type)
+    signature = base64.b64encode(
+        self.get_signer().sign(SHA256.new(signature_string)))
+    return self._build_signed_url(resource, expiration, signature)
+
+  def generate_signed_urls(self, resources, expiration, method='GET',
+                           num_processes=None):
+    """Generate signed URLs for many resources at once.
+
+    RSA signing is CPU bound,
+    so large batches are signed on a pool of processes
+    (each of which parses the private key once)::
+
+      >>> urls = connection.generate_signed_urls(
+      ...     ['/bucket-name/%s' % name for name in names],
+      ...     datetime.timedelta(hours=1))
+
+    Batches smaller than :attr:`SIGNING_POOL_THRESHOLD`
+    are signed in this process,
+    where starting a pool would cost more than it saves.
+
+    :type resources: iterable of strings
+    :param resources: The resources to sign
+                      (typically, ``/bucket-name/path/to/key.txt``).
+
+    :type expiration: int, long, datetime.datetime, datetime.timedelta
+    :param expiration: When the signed URLs should expire.
+
+    :type method: string
+    :param method: The HTTP verb that will be used when requesting the URLs.
+
+    :type num_processes: int
+    :param num_processes: (optional) The number of processes to sign with.
+                          Defaults to the number of CPUs.
+                          Use 1 to always sign in this process.
+
+    :rtype: list of strings
+    :returns: A signed URL for each resource, in the same order.
+    """
+
+    resources = list(resources)
+    expiration = get_expiration_seconds(expiration)
+    signature_strings = [get_signature_string(resource, expiration, method)
+                         for resource in resources]
 
-    # Take our PKCS12 (.p12) key and make it into a RSA key we can use...
-    pkcs12 = crypto.load_pkcs12(base64.b64decode(self.credentials.private_key), 'notasecret')
-    pem = crypto.dump_privatekey(crypto.FILETYPE_PEM, pkcs12.get_privatekey())
-    pem_key = RSA.importKey(pem)
+    if num_processes is None:
+      num_processes = multiprocessing.cpu_count()
 
-    # Sign the string with the RSA key.
-    signer = PKCS1_v1_5.new(pem_key)
-    signature_hash = SHA256.new(signature_string)
-    signature_bytes = signer.sign(signature_hash)
-    signature = base64.b64encode(signature_bytes)
+    if num_processes <= 1 or len(resources) < self.SIGNING_POOL_THRESHOLD:
+      signer = self.get_signer()
+      signatures = [base64.b64encode(signer.sign(SHA256.new(string)))
+                    for string in signature_strings]
+    else:
+      pool = multiprocessing.Pool(
+          num_processes, initializer=_init_signing_process,
+          initargs=(self.credentials.private_key,))
+      try:
+        chunksize = max(1, len(signature_strings) // (num_processes * 4))
+        signatures = pool.map(_sign_in_process, signature_strings, chunksize)
+      finally:
+        pool.close()
+        pool.join()
+
+    return [self._build_signed_url(resource, expiration, signature)
+            for resource, signature in zip(resources, signatures)]
+
+  def get_signer(self):
+    """Get the signer for this connection's private key.
+
+    Parsing the PKCS12 key is about as slow as signing with it,
+    so the parsed key is cached for as long as the credentials live
+    (and re-parsed if their private key changes).
+
+    :rtype: :class:`Crypto.Signature.PKCS1_v1_5.PKCS115_SigScheme`
+    :returns: A signer for the credentials' private key.
+    """
+
+    private_key = self.credentials.private_key
+    with _SIGNERS_LOCK:
+      cached = _SIGNERS.get(self.credentials)
+    if cached and cached[0] == private_key:
+      return cached[1]
 
-    # Set the right query parameters.
+    signer = load_signer(private_key)
+    with _SIGNERS_LOCK:
+      _SIGNERS[self.credentials] = (private_key, signer)
+    return signer
+
+  def _build_signed_url(self, resource, expiration, signature):
     query_params = {'GoogleAccessId': self.credentials.service_account_name,
                     'Expires': str(expiration),
                     'Signature': signature}
 
-    # Return the built URL.
     return '{endpoint}{resource}?{querystring}'.format(
         endpoint=self.API_ACCESS_ENDPOINT, resource=resource,
         querystring=urllib.urlencode(query_params))
+
+
+def get_expiration_seconds(expiration):
+  """Convert an expiration to an absolute timestamp.
+
+  :type expiration: int, long, datetime.datetime, datetime.timedelta
+  :param expiration: An absolute timestamp (int, long),
+                     an absolute time (datetime.datetime),
+                     or a time relative to now (datetime.timedelta).
+
+  :rtype: int
+  :returns: The expiration as seconds since the epoch.
+  """
+
+  # If it's a timedelta, add it to `now` in UTC.
+  if isinstance(expiration, datetime.timedelta):
+    now = datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
+    expiration = now + expiration
+
+  # If it's a datetime, convert to a timestamp.
+  if isinstance(expiration, datetime.datetime):
+    # Make sure the timezone on the value is UTC
+    # (either by converting or replacing the value).
+    if expiration.tzinfo:
+      expiration = expiration.astimezone(pytz.utc)
+    else:
+      expiration = expiration.replace(tzinfo=pytz.utc)
+
+    # Turn the datetime into a timestamp (seconds, not microseconds).
+    expiration = int(time.mktime(expiration.timetuple()))
+
+  if not isinstance(expiration, (int, long)):
+    raise ValueError('Expected an integer timestamp, datetime, or timedelta. '
+                     'Got %s' % type(expiration))
+
+  return expiration
+
+
+def get_signature_string(resource, expiration, method='GET',
+                         content_md5=None, content_type=None):
+  """Build the string that is signed for a signed URL.
+
+  :type resource: string
+  :param resource: The resource being signed.
+
+  :type expiration: int
+  :param expiration: When the URL expires (seconds since the epoch).
+
+  :type method: string
+  :param method: The HTTP verb that will be used when requesting the URL.
+
+  :type content_md5: string
+  :param content_md5: (optional) The MD5 hash of the object.
+
+  :type content_type: string
+  :param content_type: (optional) The content type of the object.
+
+  :rtype: string
+  :returns: The string to sign.
+  """
+
+  return '\n'.join([
+      method,
+      content_md5 or '',
+      content_type or '',
+      str(expiration),
+      resource])
+
+
+def load_signer(private_key):
+  """Parse a base64 encoded PKCS12 private key into a signer.
+
+  :type private_key: string
+  :param private_key: The key, as stored on service account credentials.
+
+  :rtype: :class:`Crypto.Signature.PKCS1_v1_5.PKCS115_SigScheme`
+  :returns: A signer for the key.
+  """
+
+  # Take our PKCS12 (.p12) key and make it into a RSA key we can use...
+  pkcs12 = crypto.load_pkcs12(base64.b64decode(private_key), 'notasecret')
+  pem = crypto.dump_privatekey(crypto.FILETYPE_PEM, pkcs12.get_privatekey())
+  return PKCS1_v1_5.new(RSA.importKey(pem))
+
+
+# Parsed signers, by credentials (see Connection.get_signer).
+_SIGNERS = weakref.WeakKeyDictionary()
+_SIGNERS_LOCK = threading.Lock()
+
+# The signer of a signing pool process (see Connection.generate_signed_urls).
+_process_signer = None
+
+
+def _init_signing_process(private_key):
+  global _process_signer
+  # PyCrypto's RNG (used for blinding) refuses to run in a forked child
+  # until it's re-seeded.
+  Random.atfork()
+  _process_signer = load_signer(private_key)
+
+
+def _sign_in_process(signature_string):
+  return base64.b64encode(_process_signer.sign(SHA256.new(signature_string)))
@@ -9,13 +9,35 @@ class ConnectionError(StorageError):
   def __init__(self, response, content):
     message = str(response) + content
     super(ConnectionError, self).__init__(message)
+    self.response = response
+    self.content = content
+
+  @property
+  def status(self):
+    """The HTTP status of the failed response."""
+    return getattr(self.response, 'status', None)
 
 
 class NotFoundError(ConnectionError):
 
   def __init__(self, response, content):
-    self.message = 'GET %s returned a 404.' % (response.url)
+    # httplib2 records the requested URL in the content-location header.
+    self.message = 'GET %s returned a 404.' % (
+        response.get('content-location'))
+    self.response = response
+    self.content = content
 
 
 class StorageDataError(StorageError):
   pass
+
+
+class BatchAbortedError(StorageError):
+  """A batched request was never sent because its batch was abandoned."""
+
+  def __init__(self, cause=None):
+    message = 'The batch was aborted'
+    if cause is not None:
+      message += ': %r' % (cause,)
+    super(BatchAbortedError, self).__init__(message + '.')
+    self.cause = cause
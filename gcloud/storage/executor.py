@@ -0,0 +1,604 @@
+"""Running connection, bucket and key calls in the background.
+
+Every request in :mod:`gcloud.storage` blocks the calling thread
+until the response has been read.
+An :class:`AsyncConnection` runs the same calls on a pool of threads
+(sharing the connection's pooled HTTP transport)
+and returns a :class:`Task` straight away,
+so a single caller can keep thousands of reads queued::
+
+  >>> from gcloud.storage.executor import AsyncConnection
+  >>> with AsyncConnection(connection, max_in_flight=64) as client:
+  ...   bucket = client.get_bucket('my-bucket').result()
+  ...   tasks = [bucket.new_key(name).get_contents_as_string()
+  ...            for name in names]
+  ...   for task in client.as_completed(tasks):
+  ...     process(task.result())
+
+The wrappers keep the method names of the classes they wrap
+(:func:`AsyncBucket.get_key`, :func:`AsyncKey.get_contents_as_string`, ...)
+but return tasks instead of results.
+Iterating over an :class:`AsyncKeyIterator`
+fetches the next page of the listing in the background,
+and :func:`AsyncKeyIterator.iter_contents`
+downloads the keys listed while the listing goes on.
+
+This is **not** non-blocking I/O:
+there is no event loop,
+and every request in flight still holds a thread
+(and a socket) until its response has been read.
+Queued tasks are cheap,
+but the number of requests actually in flight
+is capped by ``max_in_flight`` threads,
+so this suits hundreds of concurrent requests rather than tens of thousands.
+
+At most ``max_in_flight`` calls run at a time
+(listing pages included).
+Pass the same ``semaphore`` to several clients
+to share one limit between them,
+and ``max_pending`` to make :func:`AsyncConnection.submit` block
+(instead of queueing without bound)
+when that many tasks are waiting.
+Requests beyond the transport's own ``max_per_host``
+wait for a pooled socket
+(see :class:`gcloud.transport.HttpPool`).
+"""
+
+import Queue
+import threading
+from multiprocessing.pool import ThreadPool
+
+from gcloud.storage.batch import Future
+from gcloud.storage.iterator import KeyIterator
+
+
+class Task(Future):
+  """The result of a call running in the background.
+
+  Unlike a batch :class:`gcloud.storage.batch.Future`,
+  :func:`result` and :func:`exception` wait for the call to finish.
+  Callbacks run in the thread that finished the call.
+  """
+
+  def __init__(self):
+    super(Task, self).__init__()
+    self._event = threading.Event()
+    self._lock = threading.Lock()
+
+  def wait(self, timeout=None):
+    """Wait for the call to finish.
+
+    :type timeout: float
+    :param timeout: (optional) The most seconds to wait.
+
+    :rtype: bool
+    :returns: True if the call has finished.
+    """
+
+    self._event.wait(timeout)
+    return self._event.is_set()
+
+  def result(self, timeout=None):
+    """Wait for and get the result of the call.
+
+    :type timeout: float
+    :param timeout: (optional) The most seconds to wait.
+
+    :rtype: anything
+    :returns: The result of the call.
+    :raises: The exception raised by the call, if any,
+             or :class:`RuntimeError` if it didn't finish in time.
+    """
+
+    if not self.wait(timeout):
+      raise RuntimeError('The call has not finished yet.')
+    return super(Task, self).result()
+
+  def exception(self, timeout=None):
+    """Wait for and get the exception raised by the call.
+
+    :type timeout: float
+    :param timeout: (optional) The most seconds to wait.
+
+    :rtype: :class:`Exception` or None
+    :returns: The exception, or None if the call succeeded.
+    """
+
+    if not self.wait(timeout):
+      raise RuntimeError('The call has not finished yet.')
+    return super(Task, self).exception()
+
+  def _finish(self):
+    with self._lock:
+      self._done = True
+      callbacks, self._callbacks = self._callbacks, []
+    self._event.set()
+    for callback in callbacks:
+      callback(self)
+
+  def add_done_callback(self, callback):
+    with self._lock:
+      if not self._done:
+        self._callbacks.append(callback)
+        return
+    callback(self)
+
+
+class AsyncConnection(object):
+  """Runs calls on a connection in the background.
+
+  :type connection: :class:`gcloud.storage.connection.Connection`
+  :param connection: The connection to make requests with.
+
+  :type max_in_flight: int
+  :param max_in_flight: The most calls to run at the same time.
+
+  :type max_pending: int
+  :param max_pending: (optional) The most calls to have queued or running.
+                      :func:`submit` blocks while there are this many.
+
+  :type semaphore: :class:`threading.Semaphore`
+  :param semaphore: (optional) A semaphore every call holds while it runs,
+                    to limit several clients together.
+  """
+
+  def __init__(self, connection, max_in_flight=32, max_pending=None,
+               semaphore=None):
+    if max_in_flight < 1:
+      raise ValueError('max_in_flight must be at least 1.')
+
+    self.connection = connection
+    self.max_in_flight = max_in_flight
+    self._semaphore = semaphore
+    self._pending = None
+    if max_pending:
+      self._pending = threading.BoundedSemaphore(max_pending)
+    self._pool = ThreadPool(max_in_flight)
+    self._closed = False
+
+  def __repr__(self):
+    return '<AsyncConnection: %s, %d in flight>' % (
+        self.connection.project, self.max_in_flight)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def close(self):
+    """Wait for the queued calls to finish and stop the threads."""
+
+    if not self._closed:
+      self._closed = True
+      self._pool.close()
+      self._pool.join()
+
+  def submit(self, function, *args, **kwargs):
+    """Call a function in the background.
+
+    :type function: callable
+    :param function: The function to call with ``args`` and ``kwargs``.
+
+    :rtype: :class:`Task`
+    :returns: A task for the value returned by ``function``.
+    """
+
+    if self._closed:
+      raise ValueError('Cannot submit calls to a closed AsyncConnection.')
+
+    if self._pending is not None:
+      self._pending.acquire()
+
+    task = Task()
+    self._pool.apply_async(self._run, (task, function, args, kwargs))
+    return task
+
+  def _run(self, task, function, args, kwargs):
+    try:
+      if self._semaphore is not None:
+        self._semaphore.acquire()
+      try:
+        value = function(*args, **kwargs)
+      finally:
+        if self._semaphore is not None:
+          self._semaphore.release()
+    except Exception, e:
+      task.set_exception(e)
+    else:
+      task.set_result(value)
+    finally:
+      if self._pending is not None:
+        self._pending.release()
+
+  @staticmethod
+  def as_completed(tasks):
+    """Yield tasks as they finish.
+
+    :type tasks: iterable of :class:`Task`
+    :param tasks: The tasks to wait for.
+
+    :rtype: iterator of :class:`Task`
+    :returns: The same tasks, in the order they finished.
+    """
+
+    finished = Queue.Queue()
+    count = 0
+    for task in tasks:
+      task.add_done_callback(finished.put)
+      count += 1
+    for _ in xrange(count):
+      yield finished.get()
+
+  def map_unordered(self, function, iterable, window=None):
+    """Apply a function to each item in the background.
+
+    Items are read from ``iterable`` lazily,
+    keeping at most ``window`` calls queued or running.
+
+    :type function: callable
+    :param function: The function to call with each item.
+
+    :type iterable: iterable
+    :param iterable: The items.
+
+    :type window: int
+    :param window: (optional) The most calls to have queued or running.
+                   Defaults to twice ``max_in_flight``.
+
+    :rtype: iterator of :class:`Task`
+    :returns: A finished task for each item, in the order they finished.
+    """
+
+    tasks = ((item, self.submit(function, item)) for item in iterable)
+    for _, task in self.iter_finished(tasks, window):
+      yield task
+
+  def iter_finished(self, tagged_tasks, window=None):
+    """Wait for tasks as they are created, in the order they finish.
+
+    The next task is only taken from ``tagged_tasks``
+    when fewer than ``window`` of the ones taken so far are unfinished,
+    so a lazy iterable doesn't queue more calls than that.
+
+    :type tagged_tasks: iterable of tuples of ``(tag, Task)``
+    :param tagged_tasks: The tasks, each with a value to yield alongside it.
+
+    :type window: int
+    :param window: (optional) The most unfinished tasks to take.
+                   Defaults to twice ``max_in_flight``.
+
+    :rtype: iterator of tuples of ``(tag, Task)``
+    :returns: The finished tasks with their tags.
+    """
+
+    window = window or 2 * self.max_in_flight
+    finished = Queue.Queue()
+    outstanding = 0
+    for tag, task in tagged_tasks:
+      task.add_done_callback(lambda done, tag=tag: finished.put((tag, done)))
+      outstanding += 1
+      if outstanding >= window:
+        yield finished.get()
+        outstanding -= 1
+    for _ in xrange(outstanding):
+      yield finished.get()
+
+  def get_bucket(self, bucket_name):
+    """Get a bucket by name.
+
+    :type bucket_name: string
+    :param bucket_name: The name of the bucket.
+
+    :rtype: :class:`Task`
+    :returns: A task for an :class:`AsyncBucket`.
+              It raises :class:`gcloud.storage.exceptions.NotFoundError`
+              if the bucket doesn't exist.
+    """
+
+    return self.submit(self.connection.get_bucket,
+                       bucket_name).then(self.wrap_bucket)
+
+  def lookup(self, bucket_name):
+    """Get a bucket by name, or None if it doesn't exist.
+
+    :type bucket_name: string
+    :param bucket_name: The name of the bucket.
+
+    :rtype: :class:`Task`
+    :returns: A task for an :class:`AsyncBucket` or None.
+    """
+
+    def wrap(bucket):
+      return bucket and self.wrap_bucket(bucket)
+
+    return self.submit(self.connection.lookup, bucket_name).then(wrap)
+
+  def get_all_buckets(self):
+    """List the buckets in the project.
+
+    :rtype: :class:`Task`
+    :returns: A task for a list of :class:`AsyncBucket` objects.
+    """
+
+    def wrap(buckets):
+      return [self.wrap_bucket(bucket) for bucket in buckets]
+
+    return self.submit(self.connection.get_all_buckets).then(wrap)
+
+  def wrap_bucket(self, bucket):
+    """Wrap a bucket to make its calls in the background.
+
+    :type bucket: :class:`gcloud.storage.bucket.Bucket`
+    :param bucket: The bucket to wrap.
+
+    :rtype: :class:`AsyncBucket`
+    :returns: The wrapped bucket.
+    """
+
+    return AsyncBucket(self, bucket)
+
+
+class AsyncBucket(object):
+  """A bucket whose requests run in the background.
+
+  :type client: :class:`AsyncConnection`
+  :param client: The client running the requests.
+
+  :type bucket: :class:`gcloud.storage.bucket.Bucket`
+  :param bucket: The bucket to wrap.
+  """
+
+  def __init__(self, client, bucket):
+    self.client = client
+    self.bucket = bucket
+
+  def __repr__(self):
+    return '<AsyncBucket: %s>' % self.bucket.name
+
+  @property
+  def name(self):
+    return self.bucket.name
+
+  def __iter__(self):
+    return iter(self.iter_keys())
+
+  def new_key(self, key):
+    """Get a key object by name, without making a request.
+
+    :type key: string or :class:`gcloud.storage.key.Key`
+    :param key: A path name or actual key object.
+
+    :rtype: :class:`AsyncKey`
+    :returns: The wrapped key.
+    """
+
+    return AsyncKey(self.client, self.bucket.new_key(key))
+
+  def get_key(self, key):
+    """Get a key object by name.
+
+    :type key: string or :class:`gcloud.storage.key.Key`
+    :param key: The name of the key to retrieve.
+
+    :rtype: :class:`Task`
+    :returns: A task for an :class:`AsyncKey`,
+              or None if the key doesn't exist.
+    """
+
+    def wrap(found):
+      return found and AsyncKey(self.client, found)
+
+    return self.client.submit(self.bucket.get_key, key).then(wrap)
+
+  def delete_key(self, key):
+    """Delete a key from this bucket.
+
+    :type key: string or :class:`gcloud.storage.key.Key`
+    :param key: The key to delete.
+
+    :rtype: :class:`Task`
+    :returns: A task for the deleted :class:`gcloud.storage.key.Key`.
+    """
+
+    return self.client.submit(self.bucket.delete_key, key)
+
+  def iter_keys(self, prefix=None, delimiter=None, fields=None,
+                prefetch=True):
+    """List the keys in this bucket.
+
+    :type prefix: string
+    :param prefix: (optional) Only list keys whose names start with this.
+
+    :type delimiter: string
+    :param delimiter: (optional) Don't list keys whose names contain this
+                      after the prefix.
+
+    :type fields: list of strings
+    :param fields: (optional) The fields to load for each key.
+
+    :type prefetch: bool
+    :param prefetch: Whether to fetch the next page
+                     while the current one is being iterated.
+
+    :rtype: :class:`AsyncKeyIterator`
+    :returns: An iterator of :class:`AsyncKey` objects.
+    """
+
+    return AsyncKeyIterator(self, prefix=prefix, delimiter=delimiter,
+                            fields=fields, prefetch=prefetch)
+
+
+class AsyncKey(object):
+  """A key whose requests run in the background.
+
+  :type client: :class:`AsyncConnection`
+  :param client: The client running the requests.
+
+  :type key: :class:`gcloud.storage.key.Key`
+  :param key: The key to wrap.
+  """
+
+  def __init__(self, client, key):
+    self.client = client
+    self.key = key
+
+  def __repr__(self):
+    return '<AsyncKey: %s, %s>' % (self.key.bucket.name, self.key.name)
+
+  @property
+  def name(self):
+    return self.key.name
+
+  @property
+  def metadata(self):
+    return self.key.metadata
+
+  def get_contents_as_string(self, checksum=None):
+    """Download the key's data.
+
+    :type checksum: string
+    :param checksum: (optional) The algorithm (``'md5'`` or ``'crc32c'``)
+                     used to verify the data as it is downloaded.
+
+    :rtype: :class:`Task`
+    :returns: A task for the data, as a string.
+    """
+
+    return self.client.submit(self.key.get_contents_as_string,
+                              checksum=checksum)
+
+  def get_contents_to_filename(self, filename, **kwargs):
+    """Download the key's data to a file.
+
+    Takes the same arguments as
+    :func:`gcloud.storage.key.Key.get_contents_to_filename`.
+
+    :rtype: :class:`Task`
+    :returns: A task finishing when the file has been written.
+    """
+
+    return self.client.submit(self.key.get_contents_to_filename,
+                              filename, **kwargs)
+
+  def set_contents_from_string(self, data, **kwargs):
+    """Upload a string as the key's data.
+
+    Takes the same arguments as
+    :func:`gcloud.storage.key.Key.set_contents_from_string`.
+
+    :rtype: :class:`Task`
+    :returns: A task for this :class:`AsyncKey`.
+    """
+
+    task = self.client.submit(self.key.set_contents_from_string,
+                              data, **kwargs)
+    return task.then(lambda _: self)
+
+  def set_contents_from_filename(self, filename, **kwargs):
+    """Upload a file as the key's data.
+
+    Takes the same arguments as
+    :func:`gcloud.storage.key.Key.set_contents_from_filename`.
+
+    :rtype: :class:`Task`
+    :returns: A task for this :class:`AsyncKey`.
+    """
+
+    task = self.client.submit(self.key.set_contents_from_filename,
+                              filename, **kwargs)
+    return task.then(lambda _: self)
+
+  def reload_metadata(self, full=False, fields=None):
+    """Reload the key's metadata.
+
+    :rtype: :class:`Task`
+    :returns: A task for this :class:`AsyncKey`.
+    """
+
+    task = self.client.submit(self.key.reload_metadata, full=full,
+                              fields=fields)
+    return task.then(lambda _: self)
+
+  def exists(self):
+    """Check whether the key exists.
+
+    :rtype: :class:`Task`
+    :returns: A task for True or False.
+    """
+
+    return self.client.submit(self.key.exists)
+
+  def delete(self):
+    """Delete the key.
+
+    :rtype: :class:`Task`
+    :returns: A task finishing when the key has been deleted.
+    """
+
+    return self.client.submit(self.key.delete)
+
+
+class AsyncKeyIterator(object):
+  """Lists the keys in a bucket, fetching pages in the background.
+
+  :type bucket: :class:`AsyncBucket`
+  :param bucket: The bucket to list.
+
+  :type prefix: string
+  :param prefix: (optional) Only list keys whose names start with this.
+
+  :type delimiter: string
+  :param delimiter: (optional) Don't list keys whose names contain this
+                    after the prefix.
+
+  :type fields: list of strings
+  :param fields: (optional) The fields to load for each key.
+
+  :type prefetch: bool
+  :param prefetch: Whether to fetch the next page
+                   while the current one is being iterated.
+  """
+
+  def __init__(self, bucket, prefix=None, delimiter=None, fields=None,
+               prefetch=True):
+    self.bucket = bucket
+    self.prefix = prefix
+    self.delimiter = delimiter
+    self.fields = fields
+    self.prefetch = prefetch
+
+  def __iter__(self):
+    # Each page is requested through the client,
+    # so listing counts against its limits like any other call.
+    client = self.bucket.client
+    iterator = KeyIterator(self.bucket.bucket, prefix=self.prefix,
+                           delimiter=self.delimiter, fields=self.fields)
+
+    next_page = client.submit(iterator.get_next_page_response)
+    while next_page is not None:
+      response = next_page.result()
+      next_page = None
+      if self.prefetch and iterator.has_next_page():
+        next_page = client.submit(iterator.get_next_page_response)
+
+      for key in iterator.get_items_from_response(response):
+        yield AsyncKey(client, key)
+
+      if next_page is None and iterator.has_next_page():
+        next_page = client.submit(iterator.get_next_page_response)
+
+  def iter_contents(self, window=None):
+    """Download the keys listed, while the listing goes on.
+
+    :type window: int
+    :param window: (optional) The most downloads to have queued or running.
+                   Defaults to twice the client's ``max_in_flight``.
+
+    :rtype: iterator of tuples of ``(AsyncKey, Task)``
+    :returns: Each key with a finished task for its data,
+              in the order the downloads finished.
+    """
+
+    tasks = ((key, key.get_contents_as_string()) for key in self)
+    return self.bucket.client.iter_finished(tasks, window)
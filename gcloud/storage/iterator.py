@@ -37,8 +37,58 @@ if you find what you're looking for
   >>>   print item.name
   >>>   if not item.is_valid:
   >>>     break
+
+Each page is normally requested
+only once the previous one has been used up.
+To overlap the requests with your own processing,
+pass ``prefetch``
+and up to that many pages
+are fetched ahead by a background thread::
+
+  >>> for key in KeyIterator(bucket, prefetch=2):
+  >>>   process(key)
 """
 
+import Queue
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import httplib2
+
+from gcloud.storage import exceptions
+from gcloud.storage.transfer import iter_gunzip
+
+
+def _put_unless_stopped(queue, item, stopped, interval):
+  # Blocks until there is room in the queue,
+  # giving up if the consumer has gone away.
+  while not stopped.is_set():
+    try:
+      queue.put(item, timeout=interval)
+      return True
+    except Queue.Full:
+      pass
+  return False
+
+
+def get_list_fields(item_fields):
+  """Build a ``fields`` projection for a list request.
+
+  The page token (and the prefixes of a delimited listing)
+  are always kept, so paging still works.
+
+  :type item_fields: list of strings
+  :param item_fields: The fields to keep for each item
+                      (ie, ``['name', 'size']``).
+
+  :rtype: string
+  :returns: The value for the ``fields`` query parameter.
+  """
+
+  return 'nextPageToken,prefixes,items(%s)' % ','.join(item_fields)
+
 
 class Iterator(object):
   """A generic class for iterating through Cloud Storage list responses.
@@ -48,22 +98,99 @@ class Iterator(object):
 
   :type path: string
   :param path: The path to query for the list of items.
+
+  :type prefetch: int
+  :param prefetch: The number of pages to fetch ahead in the background.
+                   Defaults to 0, fetching each page only when needed.
+
+  :type extra_params: dict
+  :param extra_params: (optional) Query parameters to send with every page
+                       request, alongside the page token.
   """
 
-  def __init__(self, connection, path):
+  PREFETCH_POLL_INTERVAL = 0.1
+  """How often (in seconds) a waiting prefetch thread checks for a stop."""
+
+  def __init__(self, connection, path, prefetch=0, extra_params=None):
     self.connection = connection
     self.path = path
+    self.prefetch = prefetch
+    self.extra_params = extra_params or {}
     self.page_number = 0
     self.next_page_token = None
 
   def __iter__(self):
     """Iterate through the list of items."""
 
-    while self.has_next_page():
-      response = self.get_next_page_response()
+    for response in self.iter_pages():
       for item in self.get_items_from_response(response):
         yield item
 
+  def iter_pages(self):
+    """Request the remaining pages, prefetching them if asked to.
+
+    :rtype: generator of dict
+    :returns: The parsed JSON response of each page.
+    """
+
+    if self.prefetch:
+      return self.iter_prefetched_responses()
+    return self.iter_responses()
+
+  def iter_responses(self):
+    """Request the remaining pages one after another.
+
+    :rtype: generator of dict
+    :returns: The parsed JSON response of each page.
+    """
+
+    while self.has_next_page():
+      yield self.get_next_page_response()
+
+  def iter_prefetched_responses(self):
+    """Request the remaining pages from a background thread.
+
+    The thread stays at most :attr:`prefetch` pages
+    ahead of the caller,
+    and stops when the generator is closed.
+
+    :rtype: generator of dict
+    :returns: The parsed JSON response of each page.
+    """
+
+    pages = Queue.Queue(maxsize=self.prefetch)
+    stopped = threading.Event()
+
+    def put(page):
+      _put_unless_stopped(pages, page, stopped, self.PREFETCH_POLL_INTERVAL)
+
+    def fetch():
+      try:
+        for response in self.iter_responses():
+          put((True, response))
+          if stopped.is_set():
+            return
+      except:
+        put((False, sys.exc_info()))
+      else:
+        put((False, None))
+
+    thread = threading.Thread(target=fetch)
+    thread.daemon = True
+    thread.start()
+
+    try:
+      while True:
+        succeeded, value = pages.get()
+        if succeeded:
+          yield value
+        elif value is None:
+          return
+        else:
+          raise value[0], value[1], value[2]
+    finally:
+      stopped.set()
+
   def has_next_page(self):
     """Determines whether or not this iterator has more pages.
 
@@ -83,8 +210,10 @@ class Iterator(object):
     :returns: A dictionary of query parameters or None if there are none.
     """
 
+    query_params = dict(self.extra_params)
     if self.next_page_token:
-      return {'pageToken': self.next_page_token}
+      query_params['pageToken'] = self.next_page_token
+    return query_params or None
 
   def get_next_page_response(self):
     """Requests the next page from the path provided.
@@ -140,10 +269,24 @@ class BucketIterator(Iterator):
 
   :type connection: :class:`gcloud.storage.connection.Connection`
   :param connection: The connection to use for querying the list of buckets.
+
+  :type fields: list of strings
+  :param fields: (optional) The fields to load for each bucket
+                 (ie, ``['name', 'location']``).
+                 Defaults to every field.
+
+  :type prefetch: int
+  :param prefetch: The number of pages to fetch ahead in the background.
   """
 
-  def __init__(self, connection):
-    super(BucketIterator, self).__init__(connection=connection, path='/b')
+  def __init__(self, connection, fields=None, prefetch=0):
+    extra_params = {}
+    if fields:
+      extra_params['fields'] = get_list_fields(fields)
+
+    super(BucketIterator, self).__init__(connection=connection, path='/b',
+                                         prefetch=prefetch,
+                                         extra_params=extra_params)
 
   def get_items_from_response(self, response):
     """Factory method which yields :class:`gcloud.storage.bucket.Bucket` items from a response.
@@ -164,14 +307,56 @@ class KeyIterator(Iterator):
   but instead should use the helper methods
   on :class:`gcloud.storage.key.Key` objects.
 
+  When listing with a ``delimiter``,
+  the "directories" found
+  (names up to and including the delimiter)
+  are collected in :attr:`prefixes` as the pages are read.
+
   :type bucket: :class:`gcloud.storage.bucket.Bucket`
   :param bucket: The bucket from which to list keys.
+
+  :type prefix: string
+  :param prefix: (optional) Only list keys whose names start with this.
+
+  :type delimiter: string
+  :param delimiter: (optional) Don't list keys whose names contain this
+                    after the prefix, and collect their prefixes instead.
+
+  :type max_results: int
+  :param max_results: (optional) The most keys to return per page.
+
+  :type fields: list of strings
+  :param fields: (optional) The fields to load for each key
+                 (ie, ``['name', 'size']``).
+                 Defaults to every field.
+
+  :type prefetch: int
+  :param prefetch: The number of pages to fetch ahead in the background.
   """
 
-  def __init__(self, bucket):
+  def __init__(self, bucket, prefix=None, delimiter=None, max_results=None,
+               fields=None, prefetch=0):
     self.bucket = bucket
+    self.fields = fields
+    self.prefixes = set()
+
+    extra_params = {}
+    if prefix:
+      extra_params['prefix'] = prefix
+    if delimiter:
+      extra_params['delimiter'] = delimiter
+    if max_results:
+      extra_params['maxResults'] = max_results
+    if fields:
+      extra_params['fields'] = get_list_fields(fields)
+
     super(KeyIterator, self).__init__(
-        connection=bucket.connection, path=bucket.path + '/o')
+        connection=bucket.connection, path=bucket.path + '/o',
+        prefetch=prefetch, extra_params=extra_params)
+
+  def reset(self):
+    super(KeyIterator, self).reset()
+    self.prefixes = set()
 
   def get_items_from_response(self, response):
     """Factory method which yields :class:`gcloud.storage.key.Key` items from a response.
@@ -181,25 +366,237 @@ class KeyIterator(Iterator):
     """
 
     from gcloud.storage.key import Key
+    self.prefixes.update(response.get('prefixes', []))
     for item in response.get('items', []):
-      yield Key.from_dict(item, bucket=self.bucket)
+      yield Key.from_dict(item, bucket=self.bucket, fields=self.fields)
+
+
+class ShardedKeyIterator(object):
+  """Lists keys under several prefixes at the same time.
+
+  A single listing is a chain of page tokens,
+  so it can only go as fast as one request after another.
+  This lists the top level of ``prefix`` with ``delimiter``,
+  a page at a time,
+  and lists each "directory" it finds (in full) on its own worker::
+
+    >>> for key in ShardedKeyIterator(bucket, num_workers=16):
+    ...   print key.name
+
+  Only the first level is sharded,
+  so this helps most when the keys are spread
+  over many top level directories.
+
+  :type bucket: :class:`gcloud.storage.bucket.Bucket`
+  :param bucket: The bucket from which to list keys.
+
+  :type prefix: string
+  :param prefix: (optional) Only list keys whose names start with this.
+
+  :type delimiter: string
+  :param delimiter: The separator between "directories" in key names.
+
+  :type num_workers: int
+  :param num_workers: The number of directories to list at the same time.
+
+  :type ordered: bool
+  :param ordered: If True, yield the keys in lexicographic order
+                  (as a plain listing would).
+                  Otherwise keys are yielded as soon as they arrive.
+
+  :type fields: list of strings
+  :param fields: (optional) The fields to load for each key.
+
+  :type max_results: int
+  :param max_results: (optional) The most keys to return per page.
+
+  :type max_pending_pages: int
+  :param max_pending_pages: The most pages each worker
+                            may hold before they are consumed.
+  """
+
+  POLL_INTERVAL = 0.1
+  """How often (in seconds) a waiting worker checks for a stop."""
+
+  def __init__(self, bucket, prefix=None, delimiter='/', num_workers=8,
+               ordered=False, fields=None, max_results=None,
+               max_pending_pages=2):
+    self.bucket = bucket
+    self.prefix = prefix
+    self.delimiter = delimiter
+    self.num_workers = num_workers
+    self.ordered = ordered
+    self.fields = fields
+    self.max_results = max_results
+    self.max_pending_pages = max_pending_pages
+
+  def get_iterator(self, prefix, delimiter=None):
+    return KeyIterator(self.bucket, prefix=prefix, delimiter=delimiter,
+                       max_results=self.max_results, fields=self.fields)
+
+  def list_shard(self, prefix, queue, stopped):
+    """List every key under a prefix, putting each page on a queue.
+
+    The queue receives ``(True, keys)`` for each page,
+    then ``(False, None)`` when done
+    or ``(False, exc_info)`` on failure.
+    """
+
+    iterator = self.get_iterator(prefix)
+    try:
+      for response in iterator.iter_responses():
+        keys = list(iterator.get_items_from_response(response))
+        if not _put_unless_stopped(queue, (True, keys), stopped,
+                                   self.POLL_INTERVAL):
+          return
+    except:
+      _put_unless_stopped(queue, (False, sys.exc_info()), stopped,
+                          self.POLL_INTERVAL)
+    else:
+      _put_unless_stopped(queue, (False, None), stopped, self.POLL_INTERVAL)
+
+  def __iter__(self):
+    top = self.get_iterator(self.prefix, delimiter=self.delimiter)
+    stopped = threading.Event()
+    pool = ThreadPool(self.num_workers)
+
+    try:
+      if self.ordered:
+        results = self._iter_ordered(top, pool, stopped)
+      else:
+        results = self._iter_unordered(top, pool, stopped)
+
+      for key in results:
+        yield key
+    finally:
+      stopped.set()
+      pool.terminate()
+      pool.join()
+
+  @staticmethod
+  def _iter_top_pages(top):
+    # The top level is listed a page at a time
+    # (a flat bucket has nothing but top level keys),
+    # yielding the keys and the "directories" of each page.
+    for response in top.iter_pages():
+      keys = list(top.get_items_from_response(response))
+      yield keys, sorted(response.get('prefixes', []))
+
+  def _iter_unordered(self, top, pool, stopped):
+    queue = Queue.Queue(maxsize=self.max_pending_pages * self.num_workers)
+    remaining = 0
+
+    for keys, shards in self._iter_top_pages(top):
+      for shard in shards:
+        pool.apply_async(self.list_shard, (shard, queue, stopped))
+      remaining += len(shards)
+
+      for key in keys:
+        yield key
+
+      # Pass on whatever the shards have listed so far, without waiting.
+      while remaining and not queue.empty():
+        page = self._get_page(queue)
+        if page is None:
+          remaining -= 1
+          continue
+        for key in page:
+          yield key
+
+    while remaining:
+      page = self._get_page(queue)
+      if page is None:
+        remaining -= 1
+        continue
+      for key in page:
+        yield key
+
+  def _iter_ordered(self, top, pool, stopped):
+    # Listings are sorted,
+    # and everything under a prefix sorts in the same place as the prefix,
+    # so each page's keys and shards can be interleaved by name
+    # before moving on to the next page.
+    # Pages are consumed one shard at a time, in order.
+    # The pool starts shards in order too,
+    # so the shard being consumed is always running.
+    for keys, shards in self._iter_top_pages(top):
+      queues = {}
+      for shard in shards:
+        queues[shard] = Queue.Queue(maxsize=self.max_pending_pages)
+        pool.apply_async(self.list_shard, (shard, queues[shard], stopped))
+
+      units = [(key.name, key) for key in keys]
+      units.extend((shard, None) for shard in shards)
+      units.sort(key=lambda unit: unit[0])
+
+      for name, key in units:
+        if key is not None:
+          yield key
+          continue
+
+        queue = queues.pop(name)
+        while True:
+          page = self._get_page(queue)
+          if page is None:
+            break
+          for key in page:
+            yield key
+
+  @staticmethod
+  def _get_page(queue):
+    # Returns the next page of keys, or None when the shard is done.
+    succeeded, value = queue.get()
+    if succeeded:
+      return value
+    elif value is None:
+      return None
+    raise value[0], value[1], value[2]
 
 
 class KeyDataIterator(object):
-  # TODO: Use an actual HTTP streaming library,
-  #       not multiple requests and the range header.
+  """Iterates over a key's data one Range request at a time.
 
-  def __init__(self, key):
+  Each chunk costs a full round trip,
+  but a failure only loses a single chunk.
+  See :class:`KeyStreamIterator` for a single request alternative.
+
+  :type key: :class:`gcloud.storage.key.Key`
+  :param key: The key to download.
+
+  :type chunk_sizer: :class:`gcloud.storage.transfer.AdaptiveChunkSize`
+  :param chunk_sizer: (optional) Picks the size of each Range request.
+                      If not provided, every request asks for
+                      :attr:`gcloud.storage.key.Key.CHUNK_SIZE` bytes.
+
+  :type checksum: :class:`gcloud.storage.transfer.Checksum`
+  :param checksum: (optional) Updated with every chunk received
+                   and verified once all the data has been read.
+  """
+
+  def __init__(self, key, chunk_sizer=None, checksum=None):
     self.key = key
+    self.chunk_sizer = chunk_sizer
+    self.checksum = checksum
     self.reset()
 
   def __iter__(self):
     while self.has_more_data():
-      yield self.get_next_chunk()
+      started = time.time()
+      chunk = self.get_next_chunk()
+      if self.chunk_sizer:
+        self.chunk_sizer.record(len(chunk), time.time() - started)
+      if self.checksum:
+        self.checksum.update(chunk)
+      yield chunk
+
+    if self.checksum:
+      self.checksum.verify(self.checksum.get_expected(
+          response=self._last_response, metadata=self.key.metadata))
 
   def reset(self):
     self._bytes_written = 0
     self._total_bytes = None
+    self._last_response = None
 
   def has_more_data(self):
     if self._bytes_written == 0:
@@ -211,34 +608,170 @@ class KeyDataIterator(object):
     else:
       return (self._bytes_written < self._total_bytes)
 
+  def get_chunk_size(self):
+    if self.chunk_sizer:
+      return self.chunk_sizer.size
+    return self.key.CHUNK_SIZE
+
   def get_headers(self):
     start = self._bytes_written
-    end = self._bytes_written + self.key.CHUNK_SIZE
+    end = self._bytes_written + self.get_chunk_size() - 1
 
-    if self._total_bytes and end > self._total_bytes:
+    if self._total_bytes and end >= self._total_bytes:
       end = ''
 
     return {'Range': 'bytes=%s-%s' % (start, end)}
 
   def get_url(self):
-    return self.key.connection.build_api_url(
-        path=self.key.path, query_params={'alt': 'media'})
+    return self.key.get_media_url()
 
   def get_next_chunk(self):
     if not self.has_more_data():
       raise RuntimeError('No more data in this iterator. Try resetting.')
 
-    response, content = self.key.connection.make_request(
+    response, content = self.key.connection.make_retried_request(
         method='GET', url=self.get_url(), headers=self.get_headers())
 
     if response.status in (200, 206):
       self._bytes_written += len(content)
+      self._last_response = response
 
       if 'content-range' in response:
         content_range = response['content-range']
         self._total_bytes = int(content_range.rsplit('/', 1)[1])
 
       return content
+    elif response.status == 404:
+      raise exceptions.NotFoundError(response, content)
 
     # Expected a 200 or a 206... Got something else, which is bad.
-    raise Exception(response)
+    raise exceptions.ConnectionError(response, content)
+
+
+class KeyStreamIterator(object):
+  """Iterates over a key's data from a single streaming request.
+
+  Rather than sending a Range request per chunk
+  (like :class:`KeyDataIterator`),
+  this sends one ``alt=media`` request
+  and yields the body in ``buffer_size`` pieces as it arrives.
+  Only one piece is held in memory at a time.
+
+  Objects stored with a ``contentEncoding`` of ``gzip``
+  are downloaded compressed
+  (so the checksum is computed on the stored bytes)
+  and decompressed piece by piece.
+
+  :type key: :class:`gcloud.storage.key.Key`
+  :param key: The key to download.
+
+  :type buffer_size: int
+  :param buffer_size: The size of the pieces to yield.
+                      Defaults to :attr:`gcloud.storage.key.Key.CHUNK_SIZE`.
+
+  :type checksum: :class:`gcloud.storage.transfer.Checksum`
+  :param checksum: (optional) Updated with every piece received
+                   and verified once all the data has been read.
+
+  :type generation: int or string
+  :param generation: (optional) Download this generation of the object
+                     rather than the latest one.
+
+  :type decompress: bool
+  :param decompress: If False, yield gzip encoded data as it is stored.
+  """
+
+  def __init__(self, key, buffer_size=None, checksum=None, generation=None,
+               decompress=True):
+    self.key = key
+    self.buffer_size = buffer_size or key.CHUNK_SIZE
+    self.checksum = checksum
+    self.generation = generation
+    self.decompress = decompress
+
+  def __iter__(self):
+    # Only starting the download can be retried:
+    # the data can't be replayed once it has been yielded.
+    response = self.key.connection.retry_policy.call(self.open_response)
+
+    try:
+      data = self.iter_response(response)
+      if (self.decompress and
+          response.getheader('content-encoding', '').lower() == 'gzip'):
+        data = iter_gunzip(data, self.buffer_size)
+      for chunk in data:
+        yield chunk
+    finally:
+      response.close()
+
+  def open_response(self):
+    """Send the download request.
+
+    :rtype: :class:`httplib.HTTPResponse`
+    :returns: The response, with its body unread.
+    :raises: :class:`gcloud.storage.exceptions.ConnectionError`
+             for statuses worth retrying.
+    """
+
+    connection = self.key.connection
+    response = connection.make_streaming_request(
+        method='GET', url=self.get_url(),
+        headers={'Accept-Encoding': 'gzip'})
+
+    if response.status in connection.retry_policy.retryable_statuses:
+      try:
+        content = response.read()
+      finally:
+        response.close()
+      raise exceptions.ConnectionError(httplib2.Response(
+          dict(response.getheaders(), status=response.status)), content)
+    return response
+
+  def iter_response(self, response):
+    """Read a response body, checking the status and the checksum.
+
+    :type response: :class:`httplib.HTTPResponse`
+    :param response: The (unread) response to a download request.
+
+    :rtype: generator of strings
+    :returns: The body, as it is stored, in ``buffer_size`` pieces.
+    :raises: :class:`gcloud.storage.exceptions.NotFoundError`,
+             :class:`gcloud.storage.exceptions.StorageDataError`
+             if the body is shorter than its ``Content-Length``
+             or doesn't match its checksum.
+    """
+
+    if response.status != 200:
+      content = response.read()
+      error_response = httplib2.Response(
+          dict(response.getheaders(), status=response.status))
+      if response.status == 404:
+        raise exceptions.NotFoundError(error_response, content)
+      raise exceptions.ConnectionError(error_response, content)
+
+    # httplib returns an empty read when the connection drops early,
+    # just as it does at the end of the body.
+    received = 0
+    while True:
+      data = response.read(self.buffer_size)
+      if not data:
+        break
+      received += len(data)
+      if self.checksum:
+        self.checksum.update(data)
+      yield data
+
+    content_length = response.getheader('content-length')
+    if content_length is not None and received != int(content_length):
+      raise exceptions.StorageDataError(
+          'Received %d of %s bytes of %s.' % (
+              received, content_length, self.key.name))
+
+    if self.checksum:
+      headers = dict((name.lower(), value)
+                     for name, value in response.getheaders())
+      self.checksum.verify(self.checksum.get_expected(
+          response=headers, metadata=self.key.metadata))
+
+  def get_url(self):
+    return self.key.get_media_url(generation=self.generation)
@@ -2,10 +2,25 @@ import errno
 import json
 import mimetypes
 import os
+import shutil
 from StringIO import StringIO
 
 from gcloud.storage.acl import ObjectACL
+from gcloud.storage.batch import when_done
 from gcloud.storage.iterator import KeyDataIterator
+from gcloud.storage.iterator import KeyStreamIterator
+from gcloud.storage.reader import GzipKeyReader
+from gcloud.storage.reader import KeyReader
+from gcloud.storage.transfer import BufferReader
+from gcloud.storage.transfer import Checksum
+from gcloud.storage.transfer import MappedFileReader
+from gcloud.storage.transfer import ParallelDownload
+from gcloud.storage.transfer import ParallelUpload
+from gcloud.storage.transfer import ResumableUpload
+from gcloud.storage.transfer import StreamingUpload
+from gcloud.storage.transfer import get_file_size
+from gcloud.storage.transfer import iter_file
+from gcloud.storage.transfer import iter_gzip
 
 
 class Key(object):
@@ -17,6 +32,15 @@ class Key(object):
   This must be a multiple of 256 KB per the API specification.
   """
 
+  STREAM_SIZE_LIMIT = 64 * 1024 * 1024  # 64 MB.
+  """The largest object to download with a single streaming request (64 MB).
+
+  Objects bigger than this (when their size is known)
+  are downloaded one Range request at a time
+  so that a failure doesn't lose the whole transfer.
+  Set this to ``None`` to always stream.
+  """
+
   def __init__(self, bucket=None, name=None, metadata=None):
     """
     :type bucket: :class:`gcloud.storage.bucket.Bucket`
@@ -35,11 +59,19 @@ class Key(object):
     self.name = name
     self.metadata = metadata or {}
 
+    # Fields fetched with a partial reload,
+    # which might be missing from the metadata if they're unset.
+    self._loaded_fields = set()
+
+    # The fields a projected listing limited the metadata to
+    # (None if it came with every field).
+    self._fields = None
+
     # Lazily get the ACL information.
     self.acl = None
 
   @classmethod
-  def from_dict(cls, key_dict, bucket=None):
+  def from_dict(cls, key_dict, bucket=None, fields=None):
     """Instantiate a :class:`Key` from data returned by the JSON API.
 
     :type key_dict: dict
@@ -50,11 +82,18 @@ class Key(object):
     :param bucket: The bucket to which this key belongs
                    (and by proxy, which connection to use).
 
+    :type fields: list of strings
+    :param fields: (optional) The only fields requested for ``key_dict``
+                   (ie, by a listing with a ``fields`` projection).
+
     :rtype: :class:`Key`
     :returns: A key based on the data provided.
     """
 
-    return cls(bucket=bucket, name=key_dict['name'], metadata=key_dict)
+    key = cls(bucket=bucket, name=key_dict['name'], metadata=key_dict)
+    if fields:
+      key._fields = set(fields)
+    return key
 
   def __repr__(self):
     if self.bucket:
@@ -92,6 +131,23 @@ class Key(object):
 
     return self.bucket.path + '/o/' + self.name
 
+  def get_media_url(self, generation=None):
+    """Get the API URL to download this key's data from.
+
+    :type generation: int or string
+    :param generation: (optional) Download this generation of the object
+                       rather than the latest one.
+
+    :rtype: string
+    :returns: The ``alt=media`` URL for this key.
+    """
+
+    query_params = {'alt': 'media'}
+    if generation is not None:
+      query_params['generation'] = generation
+    return self.connection.build_api_url(path=self.path,
+                                         query_params=query_params)
+
   @property
   def public_url(self):
     return '{storage_base_url}/{self.bucket.name}/{self.name}'.format(
@@ -141,28 +197,122 @@ class Key(object):
 
     return self.bucket.delete_key(self)
 
-  def get_contents_to_file(self, fh):
+  def get_contents_to_file(self, fh, num_workers=1, chunk_sizer=None,
+                           checksum=None):
     """Gets the contents of this key to a file-like object.
 
+    By default the data is read from a single streaming request
+    (see :class:`gcloud.storage.iterator.KeyStreamIterator`),
+    unless the key is known to be bigger than :attr:`STREAM_SIZE_LIMIT`.
+
+    If ``num_workers`` is more than 1,
+    the data is fetched as several byte ranges at the same time
+    (see :class:`gcloud.storage.transfer.ParallelDownload`),
+    in which case ``fh`` must be seekable.
+
+    If a ``chunk_sizer`` is provided,
+    the data is fetched one Range request at a time
+    (see :class:`gcloud.storage.iterator.KeyDataIterator`)
+    with the size of each range picked from the measured throughput.
+
+    If the connection has a ``content_cache``,
+    the data is copied from the cache instead
+    (see :class:`gcloud.storage.cache.ContentCache`),
+    and only downloaded (in a single stream) if it isn't there yet.
+    A ``checksum`` is verified against the cached data too.
+
+    Keys stored with a ``contentEncoding`` of ``gzip``
+    (see :func:`Key.set_contents_from_stream`)
+    are always downloaded with a single streaming request
+    and decompressed as they arrive.
+
     :type fh: file
     :param fh: A file handle to which to write the key's data.
 
-    :raises: :class:`gcloud.storage.exceptions.NotFoundError`
+    :type num_workers: int
+    :param num_workers: The number of ranges to download at the same time.
+
+    :type chunk_sizer: :class:`gcloud.storage.transfer.AdaptiveChunkSize`
+    :param chunk_sizer: (optional) Picks the size of each Range request.
+
+    :type checksum: string
+    :param checksum: (optional) The algorithm (``'md5'`` or ``'crc32c'``)
+                     used to verify the data as it is downloaded.
+                     This can't be used with ``num_workers``.
+
+    :raises: :class:`gcloud.storage.exceptions.NotFoundError`,
+             :class:`gcloud.storage.exceptions.StorageDataError`
+             if the data doesn't match its checksum.
     """
 
-    for chunk in KeyDataIterator(self):
-      try:
-        fh.write(chunk)
-      except IOError, e:
-        if e.errno == errno.ENOSPC:
-          raise Exception('No space left on device.')
+    if num_workers > 1 and checksum:
+      raise ValueError('Ranges downloaded in parallel arrive out of order, '
+                       'so they cannot be checksummed as they arrive.')
+
+    content_cache = self.connection.content_cache
+    if content_cache is not None and (num_workers > 1 or chunk_sizer):
+      raise ValueError('Keys are cached with a single streaming request, '
+                       'so num_workers and chunk_sizer cannot be used '
+                       'with a content cache.')
+
+    try:
+      if content_cache is not None:
+        with content_cache.open(self, checksum=checksum) as cached:
+          shutil.copyfileobj(cached, fh, self.CHUNK_SIZE)
+      elif num_workers > 1 and not self._is_gzipped(load=True):
+        ParallelDownload(self, num_workers=num_workers).download_to_file(fh)
+      else:
+        data_iterator = self._get_data_iterator(
+            chunk_sizer=chunk_sizer,
+            checksum=(checksum and Checksum(checksum)))
+        for chunk in data_iterator:
+          fh.write(chunk)
+    except IOError, e:
+      if e.errno == errno.ENOSPC:
+        raise Exception('No space left on device.')
+      raise
+
+  def _is_gzipped(self, load=False):
+    # Compressed data can't be split into ranges and decompressed,
+    # so before picking a ranged download (with ``load``)
+    # find out how a bare ``bucket.new_key(name)``
+    # (or a key from a projected listing) is stored.
+    if load and not self._knows_field('contentEncoding'):
+      self.get_metadata('contentEncoding')
+    return self.metadata.get('contentEncoding') == 'gzip'
+
+  def _knows_field(self, field):
+    # Whether a field missing from the metadata is known to be unset,
+    # rather than just not loaded.
+    if not self.metadata:
+      return False
+    return (field in self.metadata or field in self._loaded_fields or
+            self._fields is None)
+
+  def _get_data_iterator(self, chunk_sizer=None, checksum=None):
+    if self._is_gzipped(load=bool(chunk_sizer)):
+      return KeyStreamIterator(self, checksum=checksum)
 
-  def get_contents_to_filename(self, filename):
+    size = self.metadata.get('size')
+    if chunk_sizer or (self.STREAM_SIZE_LIMIT is not None and
+                       size is not None and
+                       int(size) > self.STREAM_SIZE_LIMIT):
+      return KeyDataIterator(self, chunk_sizer=chunk_sizer, checksum=checksum)
+    return KeyStreamIterator(self, checksum=checksum)
+
+  def get_contents_to_filename(self, filename, num_workers=1, checksum=None):
     """Get the contents of this key to a file by name.
 
     :type filename: string
     :param filename: A filename to be passed to ``open``.
 
+    :type num_workers: int
+    :param num_workers: The number of ranges to download at the same time.
+
+    :type checksum: string
+    :param checksum: (optional) The algorithm (``'md5'`` or ``'crc32c'``)
+                     used to verify the data as it is downloaded.
+
     :raises: :class:`gcloud.storage.exceptions.NotFoundError`
     """
 
@@ -170,24 +320,78 @@ class Key(object):
     # TODO: Add good exception handling.
     # TODO: Set timestamp? Make optional, default being to set it if possible?
     with open(filename, 'wb') as fh:
-      self.get_contents_to_file(fh)
+      self.get_contents_to_file(fh, num_workers=num_workers,
+                                checksum=checksum)
 
-  def get_contents_as_string(self):
+  def get_contents_as_string(self, checksum=None):
     """Gets the data stored on this Key as a string.
 
+    :type checksum: string
+    :param checksum: (optional) The algorithm (``'md5'`` or ``'crc32c'``)
+                     used to verify the data as it is downloaded.
+
     :rtype: string
     :returns: The data stored in this key.
     :raises: :class:`gcloud.storage.exceptions.NotFoundError`
     """
 
     string_buffer = StringIO()
-    self.get_contents_to_file(string_buffer)
+    self.get_contents_to_file(string_buffer, checksum=checksum)
     return string_buffer.getvalue()
 
+  def open(self, block_size=None, read_ahead=None, max_blocks=None,
+           decompress=True):
+    """Open this key's data as a seekable, read-only file object.
+
+    Only the parts of the object that are read are downloaded
+    (see :class:`gcloud.storage.reader.KeyReader`),
+    so this works with modules that read files,
+    like :mod:`zipfile`, :mod:`tarfile`, :mod:`csv` or :mod:`pickle`::
+
+      >>> import tarfile
+      >>> with key.open() as fh:
+      ...   tarfile.open(fileobj=fh).extract('README')
+
+    :type block_size: int
+    :param block_size: (optional) The size of each Range request.
+
+    :type read_ahead: int
+    :param read_ahead: (optional) The number of extra blocks to fetch
+                       with each request while reading sequentially.
+
+    :type max_blocks: int
+    :param max_blocks: (optional) The number of blocks to keep in memory.
+
+    :type decompress: bool
+    :param decompress: If the key is stored with a ``contentEncoding``
+                       of ``gzip``, whether to decompress it as it is read
+                       (see :class:`gcloud.storage.reader.GzipKeyReader`).
+
+    :rtype: :class:`gcloud.storage.reader.KeyReader`
+            or :class:`gcloud.storage.reader.GzipKeyReader`
+    :returns: A file object positioned at the start of the data.
+    :raises: :class:`gcloud.storage.exceptions.NotFoundError`
+    """
+
+    reader = KeyReader(self, block_size=block_size, read_ahead=read_ahead,
+                       max_blocks=max_blocks)
+    if decompress and reader.content_encoding == 'gzip':
+      return GzipKeyReader(reader)
+    return reader
+
   def set_contents_from_file(self, fh, rewind=False, size=None,
-                             content_type=None):
+                             content_type=None, num_workers=1,
+                             part_size=None, resume_store=None,
+                             chunk_sizer=None, checksum=None, gzip=False):
     """Set the contents of this key to the contents of a file handle.
 
+    If ``num_workers`` is more than 1
+    and the file is bigger than ``part_size``,
+    the file is uploaded as several parts at the same time
+    which are then composed into this key
+    (see :class:`gcloud.storage.transfer.ParallelUpload`),
+    in which case ``fh`` must be seekable.
+
     :type fh: file
     :param fh: A file handle open for reading.
 
@@ -198,67 +402,225 @@ class Key(object):
     :type size: int
     :param size: The number of bytes to read from the file handle.
                  If not provided, we'll try to guess the size using
-                 :func:`os.fstat`
+                 :func:`os.fstat`.
+                 If that isn't possible
+                 (ie, ``fh`` is a pipe or a socket),
+                 the data is streamed until ``fh`` runs out
+                 (see :func:`Key.set_contents_from_stream`),
+                 which can't use ``num_workers``, ``part_size``
+                 or ``resume_store``.
+
+    :type num_workers: int
+    :param num_workers: The number of parts to upload at the same time.
+
+    :type part_size: int
+    :param part_size: The size of each part of a parallel upload.
+                      Defaults to
+                      :attr:`gcloud.storage.transfer.ParallelUpload.PART_SIZE`.
+
+    :type resume_store: :class:`gcloud.storage.transfer.ResumableUploadStateStore`
+    :param resume_store: (optional) Where to save the upload session
+                         so that an interrupted upload of the same file
+                         can continue where it stopped.
+
+    :type chunk_sizer: :class:`gcloud.storage.transfer.AdaptiveChunkSize`
+    :param chunk_sizer: (optional) Picks the size of each uploaded chunk
+                        from the measured throughput.
+
+    :type checksum: string
+    :param checksum: (optional) The algorithm (``'md5'`` or ``'crc32c'``)
+                     used to verify the data as it is uploaded.
+                     For parallel uploads each part is verified.
+
+    :type gzip: bool
+    :param gzip: If True, compress the data as it is uploaded
+                 (see :func:`Key.set_contents_from_stream`).
+                 Compressed uploads can't use ``num_workers``
+                 or ``resume_store``.
+
+    :raises: :class:`gcloud.storage.exceptions.StorageDataError`
+             if the uploaded object doesn't match the checksum.
     """
 
     # Rewind the file if desired.
     if rewind:
       fh.seek(0, os.SEEK_SET)
 
+    if gzip:
+      if num_workers > 1 or resume_store is not None:
+        raise ValueError('Compressed uploads are streamed, so they cannot '
+                         'be uploaded in parts or resumed.')
+      return self.set_contents_from_stream(
+          iter_file(fh, self.CHUNK_SIZE, size=size),
+          content_type=content_type, chunk_sizer=chunk_sizer,
+          checksum=checksum, gzip=True)
+
     # Get the basic stats about the file.
-    total_bytes = size or os.fstat(fh.fileno()).st_size
-    bytes_uploaded = 0
+    total_bytes = size or get_file_size(fh)
+    if total_bytes is None:
+      if (num_workers > 1 or part_size is not None or
+          resume_store is not None):
+        raise ValueError('The size of the file is unknown, so it is streamed '
+                         'and cannot be uploaded in parts or resumed.')
+      return self.set_contents_from_stream(
+          fh, content_type=content_type, chunk_sizer=chunk_sizer,
+          checksum=checksum)
+
+    if num_workers > 1:
+      upload = ParallelUpload(self, num_workers=num_workers,
+                              part_size=part_size, checksum=checksum)
+      if total_bytes > upload.part_size:
+        self.metadata = upload.upload_from_file(
+            fh, total_bytes, content_type=content_type)
+        self.connection.invalidate_metadata(self.bucket.name, self.name)
+        return
+
+    upload = ResumableUpload(self, fh, total_bytes, content_type=content_type,
+                             resume_store=resume_store,
+                             chunk_sizer=chunk_sizer,
+                             checksum=(checksum and Checksum(checksum)))
+    upload.upload()
+    self.connection.invalidate_metadata(self.bucket.name, self.name)
+
+  def set_contents_from_stream(self, source, content_type=None,
+                               chunk_sizer=None, checksum=None, gzip=False):
+    """Set the contents of this key from data of unknown length.
+
+    This reads ``source`` until it runs out,
+    holding only one chunk in memory,
+    so the output of a pipeline can be uploaded
+    without spooling it to disk first::
+
+      >>> import subprocess
+      >>> dump = subprocess.Popen(['pg_dump', 'mydb'], stdout=subprocess.PIPE)
+      >>> key.set_contents_from_stream(dump.stdout)
+
+      >>> def generate_lines():
+      ...   for row in rows:
+      ...     yield ','.join(row) + '\\n'
+      >>> key.set_contents_from_stream(generate_lines(), 'text/csv')
+
+    :type source: file or iterable of strings
+    :param source: A file handle open for reading,
+                   or an iterable of the pieces of data.
+
+    :type content_type: string
+    :param content_type: The content type of the data.
+
+    :type chunk_sizer: :class:`gcloud.storage.transfer.AdaptiveChunkSize`
+    :param chunk_sizer: (optional) Picks the size of each uploaded chunk.
+
+    :type checksum: string
+    :param checksum: (optional) The algorithm (``'md5'`` or ``'crc32c'``)
+                     used to verify the data as it is uploaded
+                     (after compression, if ``gzip`` is set).
+
+    :type gzip: bool
+    :param gzip: If True, compress the data with gzip as it is uploaded
+                 and store it with a ``contentEncoding`` of ``gzip``.
+                 It is decompressed again when downloaded
+                 (see :func:`Key.get_contents_to_file` and :func:`Key.open`).
 
-    # Set up a resumable upload session.
-    headers = {
-        'X-Upload-Content-Type': content_type or 'application/unknown',
-        'X-Upload-Content-Length': total_bytes
-        }
+    :rtype: :class:`Key`
+    :returns: The updated Key object.
+    :raises: :class:`gcloud.storage.exceptions.StorageDataError`
+             if the uploaded object doesn't match the checksum.
+    """
 
-    upload_url = self.connection.build_api_url(
-        path=self.bucket.path + '/o',
-        query_params={'uploadType': 'resumable', 'name': self.name},
-        api_base_url=self.connection.API_BASE_URL + '/upload')
+    metadata = None
+    if gzip:
+      if hasattr(source, 'read'):
+        source = iter_file(source, self.CHUNK_SIZE)
+      source = iter_gzip(source)
+      metadata = {'contentEncoding': 'gzip'}
+
+    upload = StreamingUpload(self, source, content_type=content_type,
+                             chunk_sizer=chunk_sizer,
+                             checksum=(checksum and Checksum(checksum)),
+                             metadata=metadata)
+    upload.upload()
+    self.connection.invalidate_metadata(self.bucket.name, self.name)
+    return self
 
-    response, content = self.connection.make_request(
-        method='POST', url=upload_url,
-        headers=headers)
+  def set_contents_from_filename(self, filename, num_workers=1,
+                                 part_size=None, resume_store=None,
+                                 chunk_sizer=None, checksum=None, gzip=False):
+    """Open a path and set this key's contents to the content of that file.
 
-    # Get the resumable upload URL.
-    upload_url = response['location']
+    The file is memory-mapped
+    and each chunk is sent straight from the map,
+    without being copied into a new string first.
 
-    while bytes_uploaded < total_bytes:
-      # Construct the range header.
-      data = fh.read(self.CHUNK_SIZE)
-      chunk_size = len(data)
+    :type filename: string
+    :param filename: The path to the file.
 
-      start = bytes_uploaded
-      end = bytes_uploaded + chunk_size - 1
+    :type num_workers: int
+    :param num_workers: The number of parts to upload at the same time.
 
-      headers = {
-          'Content-Range': 'bytes %d-%d/%d' % (start, end, total_bytes),
-          }
+    :type part_size: int
+    :param part_size: The size of each part of a parallel upload.
 
-      # TODO: Error checking for response code.
-      # TODO: Exponential backoff when errors come through.
-      response, content = self.connection.make_request(content_type='text/plain',
-          method='POST', url=upload_url, headers=headers, data=data)
+    :type resume_store: :class:`gcloud.storage.transfer.ResumableUploadStateStore`
+    :param resume_store: (optional) Where to save the upload session.
 
-      bytes_uploaded += chunk_size
+    :type chunk_sizer: :class:`gcloud.storage.transfer.AdaptiveChunkSize`
+    :param chunk_sizer: (optional) Picks the size of each uploaded chunk.
 
-  def set_contents_from_filename(self, filename):
-    """Open a path and set this key's contents to the content of that file.
+    :type checksum: string
+    :param checksum: (optional) The algorithm (``'md5'`` or ``'crc32c'``)
+                     used to verify the data as it is uploaded.
 
-    :type filename: string
-    :param filename: The path to the file.
+    :type gzip: bool
+    :param gzip: If True, compress the data as it is uploaded.
     """
 
     content_type, _ = mimetypes.guess_type(filename)
 
     with open(filename, 'rb') as fh:
-      self.set_contents_from_file(fh, content_type=content_type)
+      # Empty files can't be memory-mapped.
+      if os.fstat(fh.fileno()).st_size:
+        reader = MappedFileReader(fh)
+      else:
+        reader = fh
+
+      try:
+        self.set_contents_from_file(reader, content_type=content_type,
+                                    num_workers=num_workers,
+                                    part_size=part_size,
+                                    resume_store=resume_store,
+                                    chunk_sizer=chunk_sizer,
+                                    checksum=checksum, gzip=gzip)
+      finally:
+        if reader is not fh:
+          reader.close()
+
+  def set_contents_from_buffer(self, data, content_type=None, gzip=False):
+    """Sets the contents of this key to the data in a buffer.
+
+    Unlike :func:`Key.set_contents_from_string`,
+    this accepts anything supporting the buffer interface
+    (``bytearray``, ``memoryview``, ``mmap.mmap``, ...)
+    and uploads it without making a copy.
+
+    :type data: string, bytearray, memoryview or mmap.mmap
+    :param data: The data to store in this key.
+
+    :type content_type: string
+    :param content_type: The content type of the data.
+
+    :type gzip: bool
+    :param gzip: If True, compress the data as it is uploaded.
+
+    :rtype: :class:`Key`
+    :returns: The updated Key object.
+    """
+
+    self.set_contents_from_file(fh=BufferReader(data), size=len(data),
+                                content_type=content_type, gzip=gzip)
+    return self
 
-  def set_contents_from_string(self, data, content_type='text/plain'):
+  def set_contents_from_string(self, data, content_type='text/plain',
+                               gzip=False):
     """Sets the contents of this key to the provided string.
 
     You can use this method to quickly set the value of a key::
@@ -269,23 +631,25 @@ class Key(object):
       >>> key = bucket.new_key('my_text_file.txt')
       >>> key.set_contents_from_string('This is the contents of my file!')
 
-    Under the hood this is using a string buffer
-    and calling :func:`gcloud.storage.key.Key.set_contents_from_file`.
+    Under the hood this is calling
+    :func:`gcloud.storage.key.Key.set_contents_from_buffer`,
+    so the string isn't copied.
 
     :type data: string
     :param data: The data to store in this key.
 
+    :type gzip: bool
+    :param gzip: If True, compress the data as it is uploaded.
+
     :rtype: :class:`Key`
     :returns: The updated Key object.
     """
 
     # TODO: How do we handle NotFoundErrors?
-    string_buffer = StringIO()
-    string_buffer.write(data)
-    self.set_contents_from_file(fh=string_buffer, rewind=True,
-                                size=string_buffer.len,
-                                content_type=content_type)
-    return self
+    if isinstance(data, unicode):
+      data = data.encode('utf-8')
+    return self.set_contents_from_buffer(data, content_type=content_type,
+                                         gzip=gzip)
 
   def has_metadata(self, field=None):
     """Check if metadata is available locally.
@@ -297,27 +661,55 @@ class Key(object):
     :returns: Whether metadata is available locally.
     """
 
-    if not self.metadata:
+    if field and field in self._loaded_fields:
+      return True
+    elif not self.metadata:
       return False
     elif field and field not in self.metadata:
       return False
     else:
       return True
 
-  def reload_metadata(self, full=False):
+  def reload_metadata(self, full=False, fields=None):
     """Reload metadata from Cloud Storage.
 
     :type full: bool
     :param full: If True, loads all data (include ACL data).
 
+    :type fields: list of strings
+    :param fields: (optional) Only load these fields
+                   (ie, ``['size', 'updated']``)
+                   and keep the rest of the metadata already loaded.
+
     :rtype: :class:`Key`
     :returns: The key you just reloaded data for.
     """
 
     projection = 'full' if full else 'noAcl'
     query_params = {'projection': projection}
-    self.metadata = self.connection.api_request(
-        method='GET', path=self.path, query_params=query_params)
+    if fields:
+      query_params['fields'] = ','.join(fields)
+
+    response = self.connection.get_resource(
+        self.path, query_params=query_params,
+        cache_key=(self.bucket.name, self.name))
+
+    if fields:
+      return when_done(
+          response, lambda metadata: self._update_metadata(metadata, fields))
+    return when_done(response, self._set_metadata)
+
+  def _set_metadata(self, metadata):
+    self.metadata = metadata
+    self._loaded_fields = set()
+    self._fields = None
+    return self
+
+  def _update_metadata(self, metadata, fields):
+    updated = dict(self.metadata or {})
+    updated.update(metadata)
+    self.metadata = updated
+    self._loaded_fields.update(fields)
     return self
 
   def get_metadata(self, field=None, default=None):
@@ -327,7 +719,8 @@ class Key(object):
     and that field can be retrieved by refreshing data
     from Cloud Storage,
     this method will reload the data using
-    :func:`Key.reload_metadata`.
+    :func:`Key.reload_metadata`
+    (fetching only that field if the rest is already loaded).
 
     :type field: string
     :param field: (optional) A particular field to retrieve from metadata.
@@ -341,7 +734,11 @@ class Key(object):
 
     if not self.has_metadata(field=field):
       full = (field and field == 'acl')
-      self.reload_metadata(full=full)
+      if field and self.metadata:
+        # We already have the rest, so only fetch what's missing.
+        self.reload_metadata(full=full, fields=[field])
+      else:
+        self.reload_metadata(full=full)
 
     if field:
       return self.metadata.get(field, default)
@@ -364,10 +761,11 @@ class Key(object):
     :returns: The current key.
     """
 
-    self.metadata = self.connection.api_request(
+    response = self.connection.api_request(
         method='PATCH', path=self.path, data=metadata,
         query_params={'projection': 'full'})
-    return self
+    self.connection.invalidate_metadata(self.bucket.name, self.name)
+    return when_done(response, self._set_metadata)
 
   def reload_acl(self):
     """Reload the ACL data from Cloud Storage.
@@ -0,0 +1,251 @@
+"""A compact, in-memory listing of the keys in a bucket.
+
+:func:`gcloud.storage.bucket.Bucket.get_all_keys`
+builds a :class:`gcloud.storage.key.Key` for every object,
+each with its own ``__dict__`` and full metadata dictionary.
+That's fine for a few thousand keys,
+but a bucket with millions of objects
+takes gigabytes of memory to list that way.
+
+:class:`KeyListing` keeps just the fields most listings need
+in column arrays
+(names as UTF-8 strings, repeated values interned)
+and only builds a :class:`gcloud.storage.key.Key` when one is asked for::
+
+  >>> listing = bucket.get_key_listing(prefix='logs/')
+  >>> print len(listing), listing.total_size()
+  2500000 1073741824000
+  >>> print listing[0]
+  <Key: my-bucket, logs/2014-01-01.log>
+"""
+
+import base64
+import calendar
+import time
+from array import array
+
+from gcloud.storage.iterator import KeyIterator
+from gcloud.storage.key import Key
+
+
+def _get_int_typecode():
+  # Generations are microsecond timestamps,
+  # so they need 64 bits.
+  for typecode in ('L', 'd'):
+    if array(typecode).itemsize >= 8:
+      return typecode
+
+
+_INT_TYPECODE = _get_int_typecode()
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+_EMPTY_MD5 = '\0' * 16
+
+
+def _parse_timestamp(value):
+  # RFC 3339 timestamps (ie, 2014-03-10T12:00:00.123Z)
+  # to milliseconds since the epoch.
+  seconds, _, fraction = value.rstrip('Z').partition('.')
+  timestamp = calendar.timegm(time.strptime(seconds, _TIMESTAMP_FORMAT))
+  return timestamp * 1000 + int((fraction + '000')[:3])
+
+
+def _format_timestamp(millis):
+  seconds, millis = divmod(int(millis), 1000)
+  return '%s.%03dZ' % (
+      time.strftime(_TIMESTAMP_FORMAT, time.gmtime(seconds)), millis)
+
+
+class KeyListing(object):
+  """The names, sizes, generations, hashes and times of many keys.
+
+  Keys are kept in the order they were added
+  (the order of the listing).
+
+  :type bucket: :class:`gcloud.storage.bucket.Bucket`
+  :param bucket: The bucket the keys belong to.
+  """
+
+  FIELDS = ('name', 'size', 'generation', 'md5Hash', 'updated',
+            'contentType')
+  """The fields kept for each key (and requested when listing)."""
+
+  def __init__(self, bucket):
+    self.bucket = bucket
+    self._names = []
+    self._sizes = array(_INT_TYPECODE)
+    self._generations = array(_INT_TYPECODE)
+    self._updated = array(_INT_TYPECODE)
+    self._md5s = bytearray()
+    self._missing_md5s = set()
+    self._content_types = []
+
+  @classmethod
+  def from_bucket(cls, bucket, prefix=None, prefetch=1):
+    """List a bucket straight into a :class:`KeyListing`.
+
+    No :class:`gcloud.storage.key.Key` objects are built along the way.
+
+    :type bucket: :class:`gcloud.storage.bucket.Bucket`
+    :param bucket: The bucket to list.
+
+    :type prefix: string
+    :param prefix: (optional) Only list keys whose names start with this.
+
+    :type prefetch: int
+    :param prefetch: The number of pages to fetch ahead in the background.
+
+    :rtype: :class:`KeyListing`
+    :returns: The keys in the bucket.
+    """
+
+    listing = cls(bucket)
+    iterator = KeyIterator(bucket, prefix=prefix, fields=cls.FIELDS,
+                           prefetch=prefetch)
+    for response in iterator.iter_pages():
+      listing.extend(response.get('items', []))
+    return listing
+
+  def __len__(self):
+    return len(self._names)
+
+  def __repr__(self):
+    return '<KeyListing: %s, %d keys>' % (self.bucket.name, len(self))
+
+  def __iter__(self):
+    for index in xrange(len(self)):
+      yield self[index]
+
+  def __getitem__(self, index):
+    return Key.from_dict(self.get_metadata(index), bucket=self.bucket,
+                         fields=self.FIELDS)
+
+  def append(self, item):
+    """Add a key to the listing.
+
+    :type item: dict
+    :param item: The key's metadata, as returned by the JSON API.
+    """
+
+    name = item['name']
+    if isinstance(name, unicode):
+      name = name.encode('utf-8')
+    self._names.append(name)
+
+    self._sizes.append(int(item.get('size', 0)))
+    self._generations.append(int(item.get('generation', 0)))
+
+    updated = item.get('updated')
+    self._updated.append(_parse_timestamp(updated) if updated else 0)
+
+    md5_hash = item.get('md5Hash')
+    if md5_hash:
+      self._md5s.extend(base64.b64decode(md5_hash))
+    else:
+      # Composite objects don't have an MD5 hash.
+      self._missing_md5s.add(len(self._names) - 1)
+      self._md5s.extend(_EMPTY_MD5)
+
+    content_type = item.get('contentType')
+    if content_type is not None:
+      content_type = intern(str(content_type))
+    self._content_types.append(content_type)
+
+  def extend(self, items):
+    """Add several keys to the listing.
+
+    :type items: iterable of dict
+    :param items: The keys' metadata, as returned by the JSON API.
+    """
+
+    for item in items:
+      self.append(item)
+
+  def get_name(self, index):
+    """Get the name of a key without building it.
+
+    :type index: int
+    :param index: The position of the key in the listing.
+
+    :rtype: unicode
+    :returns: The name of the key.
+    """
+
+    return self._names[index].decode('utf-8')
+
+  def get_size(self, index):
+    """Get the size of a key without building it.
+
+    :type index: int
+    :param index: The position of the key in the listing.
+
+    :rtype: int
+    :returns: The size of the key in bytes.
+    """
+
+    return int(self._sizes[index])
+
+  def get_updated(self, index):
+    """Get the time a key was last updated without building it.
+
+    :type index: int
+    :param index: The position of the key in the listing.
+
+    :rtype: float
+    :returns: Seconds since the epoch (0 if not known).
+    """
+
+    return self._updated[index] / 1000.0
+
+  def get_metadata(self, index):
+    """Get the metadata of a key, in the format of the JSON API.
+
+    Timestamps are normalized to millisecond precision.
+
+    :type index: int
+    :param index: The position of the key in the listing.
+
+    :rtype: dict
+    :returns: The fields in :attr:`FIELDS` that were set for the key.
+    """
+
+    if index < 0:
+      index += len(self)
+
+    metadata = {
+        'name': self.get_name(index),
+        'size': str(self.get_size(index)),
+        'generation': str(int(self._generations[index])),
+        }
+
+    if self._updated[index]:
+      metadata['updated'] = _format_timestamp(self._updated[index])
+
+    if index not in self._missing_md5s:
+      md5 = self._md5s[index * 16:(index + 1) * 16]
+      metadata['md5Hash'] = base64.b64encode(str(md5))
+
+    if self._content_types[index] is not None:
+      metadata['contentType'] = self._content_types[index]
+
+    return metadata
+
+  def iter_names(self):
+    """Iterate over the key names without building keys.
+
+    :rtype: generator of unicode
+    :returns: The name of each key.
+    """
+
+    for name in self._names:
+      yield name.decode('utf-8')
+
+  def total_size(self):
+    """The total size of the keys in the listing.
+
+    :rtype: int
+    :returns: The sum of the key sizes, in bytes.
+    """
+
+    return int(sum(self._sizes))
@@ -0,0 +1,338 @@
+"""A seekable, read-only file object over a key's data.
+
+:func:`gcloud.storage.key.Key.open` returns a :class:`KeyReader`,
+which fetches the parts of the object that are actually read
+with Range requests,
+so modules that expect a file
+can read straight from Cloud Storage
+without downloading the whole object first::
+
+  >>> import zipfile
+  >>> with bucket.get_key('archive.zip').open() as fh:
+  ...   print zipfile.ZipFile(fh).namelist()
+  ['README', 'data/part-00000.csv']
+
+  >>> import csv
+  >>> for row in csv.reader(bucket.get_key('data.csv').open()):
+  ...   print row
+
+Data is fetched in blocks of :attr:`KeyReader.BLOCK_SIZE` bytes.
+While reading sequentially,
+each request also fetches the next few blocks
+(the read-ahead window),
+and the most recently used blocks are kept
+so that seeking back and forth
+(as ``zipfile`` and ``tarfile`` do)
+doesn't fetch the same data twice.
+
+Keys stored with a ``contentEncoding`` of ``gzip``
+are read through a :class:`GzipKeyReader`,
+which decompresses the blocks as they are read.
+"""
+
+import gzip
+import os
+from collections import OrderedDict
+
+import httplib2
+
+from gcloud.storage import exceptions
+
+
+class KeyReader(object):
+  """A buffered, seekable, read-only file object over a key's data.
+
+  Every read comes from the same generation of the object
+  (the one current when the reader was opened),
+  so an overwrite while reading can't mix two versions.
+
+  :type key: :class:`gcloud.storage.key.Key`
+  :param key: The key to read.
+
+  :type block_size: int
+  :param block_size: The size of each block fetched.
+                     Defaults to :attr:`BLOCK_SIZE`.
+
+  :type read_ahead: int
+  :param read_ahead: The number of blocks after the one being read
+                     to fetch in the same request, when reading sequentially.
+                     Defaults to :attr:`READ_AHEAD`.
+
+  :type max_blocks: int
+  :param max_blocks: The number of blocks to keep in memory.
+                     Defaults to :attr:`MAX_BLOCKS`.
+  """
+
+  BLOCK_SIZE = 256 * 1024  # 256 KB.
+  """The default size of each block fetched (256 KB)."""
+
+  READ_AHEAD = 4
+  """The default number of blocks to read ahead."""
+
+  MAX_BLOCKS = 32
+  """The default number of blocks to keep in memory."""
+
+  mode = 'rb'
+
+  def __init__(self, key, block_size=None, read_ahead=None, max_blocks=None):
+    self.key = key
+    self.block_size = block_size or self.BLOCK_SIZE
+    self.read_ahead = self.READ_AHEAD if read_ahead is None else read_ahead
+    self.max_blocks = max(max_blocks or self.MAX_BLOCKS, self.read_ahead + 1)
+
+    self.size = int(key.get_metadata('size'))
+    self.generation = key.get_metadata('generation')
+    self.content_encoding = key.metadata.get('contentEncoding')
+
+    self.closed = False
+    self.num_requests = 0
+    self._position = 0
+    self._blocks = OrderedDict()
+    # Reading from the start counts as sequential.
+    self._last_block = -1
+
+  @property
+  def name(self):
+    return self.key.name
+
+  def __repr__(self):
+    return '<KeyReader: %s, %s>' % (self.key.bucket.name, self.key.name)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    line = self.readline()
+    if not line:
+      raise StopIteration
+    return line
+
+  def close(self):
+    """Close the reader and drop the buffered blocks."""
+
+    self.closed = True
+    self._blocks.clear()
+
+  def seekable(self):
+    return True
+
+  def readable(self):
+    return True
+
+  def _check_open(self):
+    if self.closed:
+      raise ValueError('I/O operation on closed file')
+
+  def seek(self, offset, whence=os.SEEK_SET):
+    """Move to a new position in the object.
+
+    :type offset: int
+    :param offset: The offset, relative to ``whence``.
+
+    :type whence: int
+    :param whence: ``os.SEEK_SET``, ``os.SEEK_CUR`` or ``os.SEEK_END``.
+    """
+
+    self._check_open()
+    if whence == os.SEEK_CUR:
+      offset += self._position
+    elif whence == os.SEEK_END:
+      offset += self.size
+    elif whence != os.SEEK_SET:
+      raise ValueError('Invalid whence: %r' % whence)
+
+    if offset < 0:
+      raise IOError('Invalid offset: %d' % offset)
+    self._position = offset
+
+  def tell(self):
+    self._check_open()
+    return self._position
+
+  def read(self, size=-1):
+    """Read up to ``size`` bytes (or the rest of the object).
+
+    :type size: int
+    :param size: The number of bytes to read.
+                 If negative, read to the end of the object.
+
+    :rtype: string
+    :returns: The data read (an empty string at the end of the object).
+    """
+
+    self._check_open()
+    end = self.size if size is None or size < 0 else self._position + size
+    end = min(end, self.size)
+
+    chunks = []
+    while self._position < end:
+      block, offset = self._get_block_at(self._position)
+      chunk = block[offset:offset + end - self._position]
+      chunks.append(chunk)
+      self._position += len(chunk)
+    return ''.join(chunks)
+
+  def readline(self, size=-1):
+    """Read up to and including the next newline.
+
+    :type size: int
+    :param size: (optional) The most bytes to read.
+
+    :rtype: string
+    :returns: The line read (an empty string at the end of the object).
+    """
+
+    self._check_open()
+    end = self.size if size is None or size < 0 else self._position + size
+    end = min(end, self.size)
+
+    chunks = []
+    while self._position < end:
+      block, offset = self._get_block_at(self._position)
+      limit = min(len(block), offset + end - self._position)
+      newline = block.find('\n', offset, limit)
+      if newline != -1:
+        limit = newline + 1
+      chunks.append(block[offset:limit])
+      self._position += limit - offset
+      if newline != -1:
+        break
+    return ''.join(chunks)
+
+  def readlines(self, hint=-1):
+    lines = []
+    total = 0
+    for line in self:
+      lines.append(line)
+      total += len(line)
+      if 0 < hint <= total:
+        break
+    return lines
+
+  def _get_block_at(self, position):
+    index, offset = divmod(position, self.block_size)
+    block = self._blocks.get(index)
+    if block is None:
+      self._fetch_blocks(index)
+      block = self._blocks[index]
+    else:
+      # Most recently used blocks go last.
+      del self._blocks[index]
+      self._blocks[index] = block
+    self._last_block = index
+    return block, offset
+
+  def _fetch_blocks(self, index):
+    # Only read ahead while reading sequentially:
+    # random access (ie, zipfile jumping between members)
+    # would just throw the extra blocks away.
+    count = 1
+    if index == self._last_block + 1:
+      count += self.read_ahead
+
+    num_blocks = (self.size + self.block_size - 1) // self.block_size
+    last = min(index + count, num_blocks) - 1
+    while last > index and last in self._blocks:
+      last -= 1
+
+    start = index * self.block_size
+    end = min((last + 1) * self.block_size, self.size) - 1
+    data = self.get_range(start, end)
+
+    for block_index in xrange(index, last + 1):
+      offset = (block_index - index) * self.block_size
+      self._blocks.pop(block_index, None)
+      self._blocks[block_index] = data[offset:offset + self.block_size]
+
+    while len(self._blocks) > self.max_blocks:
+      self._blocks.popitem(last=False)
+
+  def get_range(self, start, end):
+    """Fetch a single (inclusive) byte range of the object.
+
+    :type start: int
+    :param start: The offset of the first byte to fetch.
+
+    :type end: int
+    :param end: The offset of the last byte to fetch.
+
+    :rtype: string
+    :returns: The data in the range.
+    :raises: :class:`gcloud.storage.exceptions.NotFoundError`
+             if the object (or the generation being read) is gone.
+    """
+
+    headers = {'Range': 'bytes=%d-%d' % (start, end)}
+    url = self.key.get_media_url(self.generation)
+    connection = self.key.connection
+
+    if self.content_encoding == 'gzip':
+      # httplib2 would try to decompress each range on its own,
+      # so read the stored bytes from a raw response.
+      headers['Accept-Encoding'] = 'gzip'
+      response, content = connection.retry_policy.call(
+          self._get_raw_range, url, headers)
+    else:
+      response, content = connection.make_retried_request(
+          method='GET', url=url, headers=headers)
+    self.num_requests += 1
+
+    if response.status == 404:
+      raise exceptions.NotFoundError(response, content)
+    elif response.status == 200:
+      # The server ignored the Range header and sent everything.
+      content = content[start:end + 1]
+    elif response.status != 206:
+      raise exceptions.ConnectionError(response, content)
+
+    if len(content) != end - start + 1:
+      raise exceptions.StorageDataError(
+          'Expected %d bytes at offset %d, got %d.' % (
+              end - start + 1, start, len(content)))
+    return content
+
+  def _get_raw_range(self, url, headers):
+    connection = self.key.connection
+    raw_response = connection.make_streaming_request(
+        method='GET', url=url, headers=dict(headers))
+    try:
+      content = raw_response.read()
+      response = httplib2.Response(
+          dict(raw_response.getheaders(), status=raw_response.status))
+    finally:
+      raw_response.close()
+
+    if response.status in connection.retry_policy.retryable_statuses:
+      raise exceptions.ConnectionError(response, content)
+    return response, content
+
+
+class GzipKeyReader(gzip.GzipFile):
+  """A file object decompressing a gzip encoded key as it is read.
+
+  The compressed data is read through a :class:`KeyReader`,
+  so only the blocks being decompressed are held in memory.
+  Seeking forward decompresses (and skips) the data in between,
+  and seeking backward starts again from the beginning,
+  so this is best read sequentially.
+
+  :type reader: :class:`KeyReader`
+  :param reader: A reader over the compressed data.
+  """
+
+  def __init__(self, reader):
+    gzip.GzipFile.__init__(self, fileobj=reader, mode='rb')
+    self.reader = reader
+
+  def close(self):
+    # GzipFile leaves file objects it didn't open alone.
+    try:
+      gzip.GzipFile.close(self)
+    finally:
+      self.reader.close()
@@ -0,0 +1,196 @@
+"""Retrying requests that fail for reasons that might go away.
+
+A single ``503`` (or a dropped connection)
+shouldn't kill a transfer that has been running for hours.
+Every :class:`gcloud.storage.connection.Connection`
+has a :class:`RetryPolicy`
+which is used for requests that are safe to send again:
+
+* API requests with an idempotent method (``GET``, ``PUT``, ``DELETE``...),
+* each Range request of a download,
+* each chunk of a resumable upload
+  (after asking the server how much of the chunk it kept).
+
+Retries wait longer and longer between attempts
+(exponential backoff)
+by a random amount
+(jitter, so that many clients failing at once
+don't all come back at once)::
+
+  >>> from gcloud.storage.retry import RetryPolicy
+  >>> policy = RetryPolicy(max_attempts=10, deadline=600)
+  >>> connection = Connection(project, credentials=credentials,
+  ...                         retry_policy=policy)
+  >>> ...
+  >>> print policy.get_stats()
+  {'calls': 5120, 'retries': 3, 'exhausted': 0}
+"""
+
+import httplib
+import random
+import socket
+import threading
+import time
+
+import httplib2
+
+from gcloud.storage import exceptions
+
+
+NETWORK_ERRORS = (socket.error, httplib.HTTPException, httplib2.HttpLib2Error)
+"""Errors raised by the transport (resets, timeouts, bad responses...)."""
+
+
+class RetryPolicy(object):
+  """When and how often to retry a failed request.
+
+  :type max_attempts: int
+  :param max_attempts: The most times to try a request (including the first).
+                       1 means never retry.
+
+  :type initial_delay: float
+  :param initial_delay: The number of seconds to wait before the first retry.
+
+  :type max_delay: float
+  :param max_delay: The longest to wait between two attempts, in seconds.
+
+  :type multiplier: float
+  :param multiplier: How much longer to wait before each further retry.
+
+  :type jitter: float
+  :param jitter: The fraction of each delay that is random
+                 (0 for fixed delays, 1 for anywhere from 0 to the delay).
+
+  :type deadline: float
+  :param deadline: (optional) The most seconds to spend on a request,
+                   including retries.
+                   No retry is started that would wait past it.
+
+  :type retryable_statuses: iterable of ints
+  :param retryable_statuses: (optional) The HTTP statuses worth retrying.
+                             Defaults to :attr:`RETRYABLE_STATUSES`.
+
+  :type idempotent_methods: iterable of strings
+  :param idempotent_methods: (optional) The HTTP methods of API requests
+                             that are safe to retry.
+                             Defaults to :attr:`IDEMPOTENT_METHODS`.
+  """
+
+  RETRYABLE_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+  """Timeouts, rate limiting and server errors."""
+
+  IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE'])
+  """API request methods retried by default.
+
+  ``POST`` and ``PATCH`` requests aren't retried,
+  since the first attempt might have been applied.
+  """
+
+  def __init__(self, max_attempts=5, initial_delay=1.0, max_delay=32.0,
+               multiplier=2.0, jitter=0.5, deadline=None,
+               retryable_statuses=None, idempotent_methods=None):
+    if max_attempts < 1:
+      raise ValueError('max_attempts must be at least 1.')
+    if not 0 <= jitter <= 1:
+      raise ValueError('jitter must be between 0 and 1.')
+
+    self.max_attempts = max_attempts
+    self.initial_delay = initial_delay
+    self.max_delay = max_delay
+    self.multiplier = multiplier
+    self.jitter = jitter
+    self.deadline = deadline
+    self.retryable_statuses = frozenset(
+        retryable_statuses or self.RETRYABLE_STATUSES)
+    self.idempotent_methods = frozenset(
+        idempotent_methods or self.IDEMPOTENT_METHODS)
+
+    # Overridable, mostly so tests don't have to wait.
+    self.sleep = time.sleep
+    self.time = time.time
+    self.random = random.random
+
+    self.calls = 0
+    self.retries = 0
+    self.exhausted = 0
+    self._stats_lock = threading.Lock()
+
+  def get_delay(self, retry):
+    """How long to wait before a retry.
+
+    :type retry: int
+    :param retry: The number of the retry (1 for the first one).
+
+    :rtype: float
+    :returns: The number of seconds to wait.
+    """
+
+    delay = min(self.max_delay,
+                self.initial_delay * self.multiplier ** (retry - 1))
+    return delay * (1 - self.jitter * self.random())
+
+  def is_retryable(self, error):
+    """Whether an error is worth retrying.
+
+    :type error: Exception
+    :param error: The error raised by an attempt.
+
+    :rtype: bool
+    :returns: True for retryable HTTP statuses
+              and for network errors (resets, timeouts, ...).
+    """
+
+    if isinstance(error, exceptions.ConnectionError):
+      return error.status in self.retryable_statuses
+    return isinstance(error, NETWORK_ERRORS)
+
+  def call(self, function, *args, **kwargs):
+    """Call a function, retrying it while it fails with retryable errors.
+
+    :type function: callable
+    :param function: The function making the request.
+                     It must be safe to call again after a failure.
+
+    :rtype: anything
+    :returns: What ``function`` returned.
+    :raises: The last error, if no attempt succeeded.
+    """
+
+    self._record('calls')
+    started = self.time()
+    retry = 0
+    while True:
+      try:
+        return function(*args, **kwargs)
+      except Exception, e:
+        if not self.is_retryable(e):
+          raise
+
+        retry += 1
+        delay = self.get_delay(retry)
+        if (retry >= self.max_attempts or
+            (self.deadline is not None and
+             self.time() + delay - started > self.deadline)):
+          self._record('exhausted')
+          raise
+
+        self._record('retries')
+        self.sleep(delay)
+
+  def _record(self, outcome):
+    with self._stats_lock:
+      setattr(self, outcome, getattr(self, outcome) + 1)
+
+  def get_stats(self):
+    """Get the retry counters.
+
+    :rtype: dict
+    :returns: The number of ``calls`` made under this policy,
+              the number of ``retries``
+              and the number of calls that failed after all their retries
+              (``exhausted``).
+    """
+
+    with self._stats_lock:
+      return {'calls': self.calls, 'retries': self.retries,
+              'exhausted': self.exhausted}
@@ -0,0 +1,429 @@
+"""Synchronizing a local directory with a "directory" in a bucket.
+
+Like ``rsync``,
+this lists both sides,
+compares them,
+and only transfers the files that differ::
+
+  >>> from gcloud.storage import sync
+  >>> result = sync.sync_to_bucket('/var/www', bucket, prefix='www/')
+  >>> print result
+  <SyncResult: 12 transferred, 0 deleted, 99988 unchanged, 0 errors>
+  >>> sync.sync_from_bucket(bucket, '/var/www', prefix='www/', delete=True)
+
+The bucket side is read with a single listing
+(see :class:`gcloud.storage.listing.KeyListing`),
+and the local side with ``os.stat``,
+so checking an unchanged tree costs
+one request per thousand keys.
+
+A file is transferred if its size differs
+or if it was modified after the other copy.
+Downloaded files get the object's update time as their mtime,
+so they don't look modified on the next sync.
+With ``checksum=True``,
+files of the same size are compared by MD5 hash instead
+(reading every local file).
+"""
+
+import base64
+import hashlib
+import os
+import sys
+import tempfile
+
+from gcloud.storage import workers
+from gcloud.storage.listing import KeyListing
+
+
+class SyncResult(object):
+  """The outcome of a sync.
+
+  :type transferred: list of strings
+  :param transferred: The relative paths of the files copied.
+
+  :type deleted: list of strings
+  :param deleted: The relative paths of the extra files deleted.
+
+  :type unchanged: int
+  :param unchanged: The number of files that were already up to date.
+
+  :type errors: list of tuples of ``(path, exception)``
+  :param errors: The relative paths that couldn't be synced, and why.
+  """
+
+  def __init__(self, transferred=None, deleted=None, unchanged=0,
+               errors=None):
+    self.transferred = transferred or []
+    self.deleted = deleted or []
+    self.unchanged = unchanged
+    self.errors = errors or []
+
+  def __repr__(self):
+    return ('<SyncResult: %d transferred, %d deleted, %d unchanged, '
+            '%d errors>' % (len(self.transferred), len(self.deleted),
+                            self.unchanged, len(self.errors)))
+
+
+class FileInfo(object):
+  """What a sync knows about one side of a file.
+
+  :type size: int
+  :param size: The size of the file in bytes.
+
+  :type mtime: float
+  :param mtime: When the file was last modified (seconds since the epoch).
+
+  :type md5_hash: string
+  :param md5_hash: (optional) The base64 encoded MD5 hash of the file,
+                   if known without reading it.
+  """
+
+  __slots__ = ('size', 'mtime', 'md5_hash')
+
+  def __init__(self, size, mtime, md5_hash=None):
+    self.size = size
+    self.mtime = mtime
+    self.md5_hash = md5_hash
+
+
+def get_local_files(directory):
+  """List the files under a directory.
+
+  :type directory: string
+  :param directory: The directory to list.
+
+  :rtype: dict
+  :returns: A dictionary mapping each relative path
+            (with ``/`` separators)
+            to a :class:`FileInfo`.
+  """
+
+  files = {}
+  for root, _, filenames in os.walk(directory):
+    for filename in filenames:
+      path = os.path.join(root, filename)
+      stat = os.stat(path)
+      name = os.path.relpath(path, directory).replace(os.sep, '/')
+      # Key names come back from the API as unicode.
+      if isinstance(name, str):
+        name = name.decode(sys.getfilesystemencoding() or 'utf-8')
+      files[name] = FileInfo(stat.st_size, stat.st_mtime)
+  return files
+
+
+def get_remote_files(bucket, prefix=''):
+  """List the keys under a prefix in a bucket.
+
+  :type bucket: :class:`gcloud.storage.bucket.Bucket`
+  :param bucket: The bucket to list.
+
+  :type prefix: string
+  :param prefix: Only list keys under this "directory"
+                 (a ``/`` is added if missing).
+
+  :rtype: dict
+  :returns: A dictionary mapping each key name (without the prefix)
+            to a :class:`FileInfo`.
+  """
+
+  prefix = _normalize_prefix(prefix)
+  listing = KeyListing.from_bucket(bucket, prefix=prefix or None)
+
+  files = {}
+  for index in xrange(len(listing)):
+    metadata = listing.get_metadata(index)
+    name = metadata['name'][len(prefix):]
+    # "Directory" placeholders (ie, ``www/``) aren't files.
+    if not name or name.endswith('/'):
+      continue
+    files[name] = FileInfo(listing.get_size(index),
+                           listing.get_updated(index),
+                           metadata.get('md5Hash'))
+  return files
+
+
+def get_local_path(directory, name):
+  """Map a key name (without the prefix) to a path under a directory.
+
+  Key names come from the bucket,
+  so they mustn't be able to point outside the directory
+  (ie, ``../../.bashrc``).
+
+  :type directory: string
+  :param directory: The local directory.
+
+  :type name: string
+  :param name: The relative name, with ``/`` separators.
+
+  :rtype: string
+  :returns: The absolute path of the file.
+  :raises: :class:`ValueError` if the name has empty, ``.`` or ``..``
+           segments, or would resolve to a path outside ``directory``.
+  """
+
+  segments = name.split('/')
+  if any(segment in ('', '.', '..') for segment in segments):
+    raise ValueError('Unsafe name for a local file: %r' % (name,))
+
+  root = os.path.abspath(directory)
+  path = os.path.abspath(os.path.join(root, *segments))
+  # Joining an empty segment adds exactly one trailing separator,
+  # even to ``/``.
+  if not path.startswith(os.path.join(root, '')):
+    raise ValueError('Name resolves outside %s: %r' % (root, name))
+  return path
+
+
+def _normalize_prefix(prefix):
+  # ``www`` means the "directory" ``www/``, not every key starting with it.
+  if prefix and not prefix.endswith('/'):
+    prefix += '/'
+  return prefix or ''
+
+
+def get_md5_hash(filename):
+  """Compute the base64 encoded MD5 hash of a file.
+
+  :type filename: string
+  :param filename: The path of the file.
+
+  :rtype: string
+  :returns: The hash, as Cloud Storage reports it.
+  """
+
+  md5 = hashlib.md5()
+  with open(filename, 'rb') as fh:
+    for chunk in iter(lambda: fh.read(1024 * 1024), ''):
+      md5.update(chunk)
+  return base64.b64encode(md5.digest())
+
+
+def is_changed(source, target, local_path=None, checksum=False):
+  """Whether a file needs to be copied from ``source`` to ``target``.
+
+  :type source: :class:`FileInfo`
+  :param source: The file being copied.
+
+  :type target: :class:`FileInfo` or None
+  :param target: The existing copy, if any.
+
+  :type local_path: string
+  :param local_path: (optional) The path of whichever side is local,
+                     used to hash it when comparing checksums.
+
+  :type checksum: bool
+  :param checksum: Whether to compare MD5 hashes instead of times.
+
+  :rtype: bool
+  :returns: True if the file should be copied.
+  """
+
+  if target is None or source.size != target.size:
+    return True
+
+  if checksum:
+    remote_hash = source.md5_hash or target.md5_hash
+    if remote_hash:
+      return get_md5_hash(local_path) != remote_hash
+
+  # Whole seconds, since not every filesystem keeps fractions.
+  return int(source.mtime) > int(target.mtime)
+
+
+def sync_to_bucket(directory, bucket, prefix='', delete=False,
+                   checksum=False, num_workers=8, dry_run=False):
+  """Upload the files under a local directory that differ in the bucket.
+
+  :type directory: string
+  :param directory: The local directory to upload.
+
+  :type bucket: :class:`gcloud.storage.bucket.Bucket`
+  :param bucket: The bucket to upload to.
+
+  :type prefix: string
+  :param prefix: The prefix for the key names (ie, ``'www/'``).
+
+  :type delete: bool
+  :param delete: If True, delete the keys under the prefix
+                 that don't exist locally.
+
+  :type checksum: bool
+  :param checksum: If True, compare files of the same size by MD5 hash
+                   instead of by modification time.
+
+  :type num_workers: int
+  :param num_workers: The number of files to upload at the same time.
+
+  :type dry_run: bool
+  :param dry_run: If True, only report what would be done.
+
+  :rtype: :class:`SyncResult`
+  :returns: What was (or would be) transferred and deleted.
+  """
+
+  prefix = _normalize_prefix(prefix)
+  local_files = get_local_files(directory)
+  remote_files = get_remote_files(bucket, prefix)
+
+  def local_path(name):
+    return get_local_path(directory, name)
+
+  def upload(name):
+    key = bucket.new_key(prefix + name)
+    key.set_contents_from_filename(local_path(name))
+
+  def delete_keys(names):
+    keys = [prefix + name for name in names]
+    for key, error in bucket.iter_delete_keys(keys, num_workers=num_workers):
+      yield key.name[len(prefix):], error
+
+  return _sync(local_files, remote_files, local_path, upload, delete_keys,
+               delete=delete, checksum=checksum, num_workers=num_workers,
+               dry_run=dry_run)
+
+
+def sync_from_bucket(bucket, directory, prefix='', delete=False,
+                     checksum=False, num_workers=8, dry_run=False):
+  """Download the keys under a prefix that differ in a local directory.
+
+  :type bucket: :class:`gcloud.storage.bucket.Bucket`
+  :param bucket: The bucket to download from.
+
+  :type directory: string
+  :param directory: The local directory to download to.
+
+  :type prefix: string
+  :param prefix: The prefix of the key names to download (ie, ``'www/'``).
+
+  :type delete: bool
+  :param delete: If True, delete the local files
+                 that don't exist in the bucket.
+
+  :type checksum: bool
+  :param checksum: If True, compare files of the same size by MD5 hash
+                   instead of by modification time.
+
+  :type num_workers: int
+  :param num_workers: The number of files to download at the same time.
+
+  :type dry_run: bool
+  :param dry_run: If True, only report what would be done.
+
+  :rtype: :class:`SyncResult`
+  :returns: What was (or would be) transferred and deleted.
+  """
+
+  if not dry_run and not os.path.isdir(directory):
+    os.makedirs(directory)
+
+  prefix = _normalize_prefix(prefix)
+  local_files = get_local_files(directory)
+  remote_files = get_remote_files(bucket, prefix)
+
+  # Never write (or delete) outside the directory
+  # because of a hostile key name.
+  unsafe = []
+  for name in sorted(remote_files):
+    try:
+      get_local_path(directory, name)
+    except ValueError, e:
+      unsafe.append((name, e))
+      del remote_files[name]
+
+  def local_path(name):
+    return get_local_path(directory, name)
+
+  def download(name):
+    path = local_path(name)
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+      try:
+        os.makedirs(parent)
+      except OSError:
+        # Another worker might have just created it.
+        if not os.path.isdir(parent):
+          raise
+
+    # Download next to the file, so a failure never leaves half a file.
+    fd, temp_path = tempfile.mkstemp(dir=parent, prefix='.sync-')
+    os.close(fd)
+    try:
+      bucket.new_key(prefix + name).get_contents_to_filename(temp_path)
+      mtime = remote_files[name].mtime
+      os.utime(temp_path, (mtime, mtime))
+      os.rename(temp_path, path)
+    except:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+      raise
+
+  def delete_files(names):
+    for name in names:
+      try:
+        os.remove(local_path(name))
+      except OSError, e:
+        yield name, e
+      else:
+        yield name, None
+
+  result = _sync(remote_files, local_files, local_path, download,
+                 delete_files, delete=delete, checksum=checksum,
+                 num_workers=num_workers, dry_run=dry_run)
+  result.errors.extend(unsafe)
+  return result
+
+
+def _sync(source_files, target_files, local_path, transfer, delete_extras,
+          delete, checksum, num_workers, dry_run):
+  result = SyncResult()
+
+  def compare(name):
+    return name, is_changed(source_files[name], target_files.get(name),
+                            local_path(name), checksum=checksum)
+
+  def run_transfer(name):
+    try:
+      transfer(name)
+    except Exception, e:
+      return name, e
+    return name, None
+
+  # Hashing reads files, so spread it over the workers too.
+  if checksum:
+    comparisons = workers.imap_unordered(compare, source_files, num_workers)
+  else:
+    comparisons = (compare(name) for name in source_files)
+
+  changed = []
+  for name, is_different in comparisons:
+    if is_different:
+      changed.append(name)
+    else:
+      result.unchanged += 1
+  changed.sort()
+
+  extras = sorted(name for name in target_files if name not in source_files)
+
+  if dry_run:
+    result.transferred = changed
+    result.deleted = extras if delete else []
+    return result
+
+  for name, error in workers.imap_unordered(run_transfer, changed,
+                                            num_workers):
+    if error is None:
+      result.transferred.append(name)
+    else:
+      result.errors.append((name, error))
+
+  if delete and extras:
+    for name, error in delete_extras(extras):
+      if error is None:
+        result.deleted.append(name)
+      else:
+        result.errors.append((name, error))
+
+  result.transferred.sort()
+  result.deleted.sort()
+  return result
@@ -0,0 +1,263 @@
+import email.parser
+import errno
+import json
+import socket
+import threading
+import urlparse
+
+import httplib2
+import unittest2
+
+from gcloud.storage import exceptions
+from gcloud.storage.batch import Batch
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.connection import Connection
+
+
+class BatchHttp(object):
+  """Answers batch requests against a set of object names (and lists them)."""
+
+  def __init__(self, names, fail_batches=False, error=None):
+    self.names = set(names)
+    self.fail_batches = fail_batches
+    self.error = error
+    self.batch_sizes = []
+    self.public = set()
+    self.list_params = []
+    self._lock = threading.Lock()
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    if self.error is not None:
+      raise self.error
+    if self.fail_batches:
+      return httplib2.Response({'status': 500}), 'Backend Error'
+
+    parsed = urlparse.urlparse(uri)
+    if parsed.path.endswith('/o'):
+      self.list_params.append(urlparse.parse_qs(parsed.query))
+      response = httplib2.Response({'status': 200,
+                                    'content-type': 'application/json'})
+      items = [{'name': name} for name in sorted(self.names)]
+      return response, json.dumps({'items': items})
+
+    message = email.parser.Parser().parsestr(
+        'Content-Type: %s\r\n\r\n%s' % (headers['Content-Type'], body))
+
+    lines = ['--batch_response']
+    for part in message.get_payload():
+      method, path, _ = part.get_payload().split('\r\n', 1)[0].split(' ')
+      name = path.split('?')[0].rsplit('/o/', 1)[1]
+      body = ''
+      with self._lock:
+        if name.endswith('/acl'):
+          name = name[:-len('/acl')]
+          if name in self.names:
+            self.public.add(name)
+            status = '200 OK'
+          else:
+            status = '404 Not Found'
+        elif name not in self.names:
+          status = '404 Not Found'
+        elif method == 'DELETE':
+          self.names.remove(name)
+          status = '204 No Content'
+        else:
+          status = '200 OK'
+          body = json.dumps({'name': name, 'bucket': 'bucket'})
+
+      lines.extend([
+          'Content-Type: application/http',
+          'Content-ID: <response-%s>' % part['Content-ID'].strip('<>'),
+          '',
+          'HTTP/1.1 ' + status,
+          'Content-Type: application/json',
+          'Content-Length: %d' % len(body),
+          '',
+          body,
+          '--batch_response',
+          ])
+
+    with self._lock:
+      self.batch_sizes.append(len(message.get_payload()))
+    lines[-1] += '--'
+    response = httplib2.Response({
+        'status': 200,
+        'content-type': 'multipart/mixed; boundary=batch_response'})
+    return response, '\r\n'.join(lines)
+
+
+class TestBatch(unittest2.TestCase):
+
+  def _make_bucket(self, http):
+    connection = Connection('project-name', http=http)
+    return Bucket(connection=connection, name='bucket')
+
+  def test_build_body(self):
+    batch = Batch(Connection('project-name'))
+    batch.add('DELETE', '/b/bucket/o/key')
+    batch.add('PATCH', '/b/bucket', data='{}', content_type='application/json')
+    body = batch.build_body(batch._requests, 'BOUNDARY')
+
+    self.assertEqual([
+        '--BOUNDARY',
+        'Content-Type: application/http',
+        'Content-Transfer-Encoding: binary',
+        'Content-ID: <0>',
+        '',
+        'DELETE /storage/v1beta2/b/bucket/o/key?project=project-name HTTP/1.1',
+        '',
+        '',
+        '--BOUNDARY',
+        'Content-Type: application/http',
+        'Content-Transfer-Encoding: binary',
+        'Content-ID: <1>',
+        '',
+        'PATCH /storage/v1beta2/b/bucket?project=project-name HTTP/1.1',
+        'Content-Type: application/json',
+        'Content-Length: 2',
+        '',
+        '{}',
+        '--BOUNDARY--',
+        ], body.split('\r\n'))
+
+  def test_context_manager_defers_requests(self):
+    http = BatchHttp(['a', 'b'])
+    bucket = self._make_bucket(http)
+
+    with bucket.connection.batch() as batch:
+      deleted = bucket.delete_key('a')
+      found = bucket.get_key('b')
+      missing = bucket.get_key('c')
+      failed = bucket.delete_key('c')
+      self.assertEqual(4, len(batch))
+      self.assertFalse(deleted.done())
+      self.assertRaises(RuntimeError, deleted.result)
+
+    self.assertEqual([4], http.batch_sizes)
+    self.assertIsNone(bucket.connection.current_batch)
+    self.assertEqual('a', deleted.result().name)
+    self.assertEqual('b', found.result().name)
+    self.assertIsNone(missing.result())
+    self.assertRaises(exceptions.NotFoundError, failed.result)
+    self.assertEqual(set(['b']), http.names)
+
+  def test_context_manager_splits_batches(self):
+    names = ['key-%d' % i for i in xrange(Batch.MAX_REQUESTS + 1)]
+    http = BatchHttp(names)
+    bucket = self._make_bucket(http)
+
+    with bucket.connection.batch():
+      keys = [bucket.get_key(name) for name in names]
+
+    self.assertEqual([Batch.MAX_REQUESTS, 1], http.batch_sizes)
+    self.assertEqual(names, [key.result().name for key in keys])
+
+  def test_metadata_is_set_when_the_batch_is_sent(self):
+    bucket = self._make_bucket(BatchHttp(['a']))
+    key = bucket.new_key('a')
+
+    with bucket.connection.batch():
+      result = key.reload_metadata()
+      self.assertFalse(key.metadata)
+
+    self.assertIs(key, result.result())
+    self.assertEqual('a', key.metadata['name'])
+
+  def test_failed_batch_fails_every_future(self):
+    bucket = self._make_bucket(BatchHttp(['a'], fail_batches=True))
+
+    future = []
+    with self.assertRaises(exceptions.ConnectionError):
+      with bucket.connection.batch():
+        future.append(bucket.get_key('a'))
+    self.assertRaises(exceptions.ConnectionError, future[0].result)
+
+  def test_transport_error_fails_every_future(self):
+    names = ['key-%d' % i for i in xrange(Batch.MAX_REQUESTS + 1)]
+    error = socket.error(errno.ECONNRESET, 'Connection reset by peer')
+    bucket = self._make_bucket(BatchHttp(names, error=error))
+
+    keys = []
+    with self.assertRaises(socket.error):
+      with bucket.connection.batch():
+        keys.extend(bucket.get_key(name) for name in names)
+
+    self.assertEqual([error] * len(names),
+                     [key.exception() for key in keys])
+
+  def test_nothing_is_sent_if_the_block_fails(self):
+    http = BatchHttp(['a'])
+    bucket = self._make_bucket(http)
+
+    with self.assertRaises(KeyError):
+      with bucket.connection.batch():
+        bucket.delete_key('a')
+        raise KeyError('a')
+
+    self.assertEqual([], http.batch_sizes)
+    self.assertIsNone(bucket.connection.current_batch)
+
+  def test_aborted_batch_fails_its_futures(self):
+    bucket = self._make_bucket(BatchHttp(['a']))
+
+    futures = []
+    error = KeyError('a')
+    with self.assertRaises(KeyError):
+      with bucket.connection.batch():
+        futures.append(bucket.get_key('a'))
+        raise error
+
+    aborted = futures[0].exception()
+    self.assertTrue(isinstance(aborted, exceptions.BatchAbortedError))
+    self.assertIs(error, aborted.cause)
+    self.assertRaises(exceptions.BatchAbortedError, futures[0].result)
+
+  def test_delete_keys(self):
+    names = ['key-%d' % i for i in xrange(250)]
+    http = BatchHttp(names)
+    bucket = self._make_bucket(http)
+
+    result = bucket.delete_keys(names + ['missing'], num_workers=3)
+    self.assertEqual(set(), http.names)
+    self.assertEqual([100, 100, 51], sorted(http.batch_sizes, reverse=True))
+    self.assertEqual(set(names), set(key.name for key in result.deleted))
+    self.assertEqual(1, len(result.errors))
+    key, error = result.errors[0]
+    self.assertEqual('missing', key.name)
+    self.assertTrue(isinstance(error, exceptions.NotFoundError))
+
+  def test_failed_batch_reports_every_key(self):
+    bucket = self._make_bucket(BatchHttp(['a', 'b'], fail_batches=True))
+    result = bucket.delete_keys(['a', 'b'])
+    self.assertEqual([], result.deleted)
+    self.assertEqual(['a', 'b'], sorted(key.name for key, _ in result.errors))
+
+  def test_network_error_reports_every_key(self):
+    error = socket.error(errno.ECONNRESET, 'Connection reset by peer')
+    bucket = self._make_bucket(BatchHttp(['a', 'b'], error=error))
+    result = bucket.make_keys_public(['a', 'b'])
+    self.assertEqual([], result.succeeded)
+    self.assertEqual([('a', error), ('b', error)],
+                     sorted((key.name, e) for key, e in result.errors))
+
+  def test_make_every_key_public(self):
+    http = BatchHttp(['a', 'b'])
+    result = self._make_bucket(http).make_keys_public()
+    self.assertEqual(set(['a', 'b']), http.public)
+    self.assertEqual(2, len(result.succeeded))
+    self.assertEqual(['nextPageToken,prefixes,items(name)'],
+                     http.list_params[0]['fields'])
+
+  def test_make_keys_public(self):
+    names = ['key-%d' % i for i in xrange(150)]
+    http = BatchHttp(names)
+    bucket = self._make_bucket(http)
+
+    progress = []
+    result = bucket.make_keys_public(
+        names + ['missing'], num_workers=2,
+        progress=lambda key, error: progress.append(key))
+    self.assertEqual(set(names), http.public)
+    self.assertEqual(151, len(progress))
+    self.assertEqual(150, len(result.succeeded))
+    self.assertEqual(['missing'], [key.name for key in result.failed_keys])
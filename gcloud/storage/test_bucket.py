@@ -0,0 +1,123 @@
+import json
+import re
+import threading
+import urlparse
+
+import httplib2
+import unittest2
+
+from gcloud.storage import exceptions
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.connection import Connection
+
+
+class RewriteHttp(object):
+  """Serves rewriteTo and DELETE requests over a dictionary of objects."""
+
+  REWRITE_URL = re.compile(
+      r'/storage/v1/b/([^/]+)/o/(.+)/rewriteTo/b/([^/]+)/o/(.+)$')
+  OBJECT_URL = re.compile(r'/storage/v1beta2/b/([^/]+)/o/(.+)$')
+
+  def __init__(self, objects):
+    self.objects = objects
+    self.requests = []
+    self._lock = threading.Lock()
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    parts = urlparse.urlparse(uri)
+    query = dict(urlparse.parse_qsl(parts.query))
+    with self._lock:
+      self.requests.append((method, parts.path, query))
+
+      rewrite = self.REWRITE_URL.search(parts.path)
+      if method == 'POST' and rewrite:
+        return self.rewrite(rewrite.groups(), query)
+
+      match = self.OBJECT_URL.search(parts.path)
+      if method == 'DELETE' and match and match.groups() in self.objects:
+        del self.objects[match.groups()]
+        return httplib2.Response({'status': 204}), ''
+
+    return httplib2.Response({'status': 404}), 'Not Found'
+
+  def rewrite(self, (bucket, name, new_bucket, new_name), query):
+    if (bucket, name) not in self.objects:
+      return httplib2.Response({'status': 404}), 'Not Found'
+
+    data = self.objects[bucket, name]
+    done = int(query.get('rewriteToken', 0))
+    done += int(query.get('maxBytesRewrittenPerCall', len(data)))
+
+    if done < len(data):
+      body = {'done': False, 'rewriteToken': str(done),
+              'totalBytesRewritten': str(done), 'objectSize': str(len(data))}
+    else:
+      self.objects[new_bucket, new_name] = data
+      body = {'done': True, 'resource': {
+          'name': new_name, 'bucket': new_bucket, 'size': str(len(data))}}
+
+    response = httplib2.Response({'status': 200,
+                                  'content-type': 'application/json'})
+    return response, json.dumps(body)
+
+
+class TestCopyKeys(unittest2.TestCase):
+
+  def setUp(self):
+    self.http = RewriteHttp({('bucket', 'a'): 'aaa',
+                             ('bucket', 'b'): 'bbbbbbbbbb'})
+    connection = Connection('project-name', http=self.http)
+    self.bucket = Bucket(connection=connection, name='bucket')
+    self.backups = Bucket(connection=connection, name='backups')
+
+  def test_copy_key(self):
+    new_key = self.bucket.copy_key('a', self.backups, 'a.bak')
+
+    self.assertEqual('a.bak', new_key.name)
+    self.assertIs(self.backups, new_key.bucket)
+    self.assertEqual('3', new_key.metadata['size'])
+    self.assertEqual('aaa', self.http.objects['backups', 'a.bak'])
+    self.assertEqual('aaa', self.http.objects['bucket', 'a'])
+
+  def test_copy_key_follows_rewrite_tokens(self):
+    self.bucket.copy_key('b', new_name='c', max_bytes_per_call=4)
+
+    self.assertEqual('bbbbbbbbbb', self.http.objects['bucket', 'c'])
+    self.assertEqual([None, '4', '8'], [query.get('rewriteToken')
+                                        for _, _, query in self.http.requests])
+
+  def test_copy_key_not_found(self):
+    self.assertRaises(exceptions.NotFoundError,
+                      self.bucket.copy_key, 'missing', self.backups)
+
+  def test_copy_key_in_batch(self):
+    with self.bucket.connection.batch():
+      self.assertRaises(ValueError, self.bucket.copy_key, 'a')
+
+  def test_copy_keys(self):
+    progress = []
+    result = self.bucket.copy_keys(
+        ['a', 'b', 'missing'], self.backups,
+        rename=lambda name: 'old/' + name,
+        progress=lambda key, error: progress.append(key.name))
+
+    self.assertEqual(['old/a', 'old/b'],
+                     sorted(key.name for key in result.succeeded))
+    self.assertEqual(['missing'], [key.name for key in result.failed_keys])
+    self.assertIsInstance(result.errors[0][1], exceptions.NotFoundError)
+    self.assertEqual(['a', 'b', 'missing'], sorted(progress))
+    self.assertEqual('bbbbbbbbbb', self.http.objects['backups', 'old/b'])
+
+  def test_move_keys(self):
+    result = self.bucket.move_keys(['a', 'b'], self.backups)
+
+    self.assertEqual([], result.errors)
+    self.assertEqual({('backups', 'a'): 'aaa',
+                      ('backups', 'b'): 'bbbbbbbbbb'}, self.http.objects)
+
+  def test_move_key_onto_itself(self):
+    result = self.bucket.move_keys(['a'])
+
+    self.assertEqual(['a'], [key.name for key in result.failed_keys])
+    self.assertIsInstance(result.errors[0][1], ValueError)
+    self.assertEqual('aaa', self.http.objects['bucket', 'a'])
@@ -0,0 +1,215 @@
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+import httplib2
+import unittest2
+
+from gcloud.storage._testing import StreamingResponse
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.cache import ContentCache
+from gcloud.storage.cache import MemoryMetadataCache
+from gcloud.storage.cache import SqliteMetadataCache
+from gcloud.storage.connection import Connection
+from gcloud.storage.transfer import AdaptiveChunkSize
+
+
+class ObjectHttp(object):
+  """Serves one object's metadata, honoring If-None-Match."""
+
+  def __init__(self):
+    self.requests = []
+    self.metadata = {'name': 'key', 'size': '3', 'etag': 'CAE='}
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    self.requests.append((method, headers.get('If-None-Match')))
+
+    if self.metadata is None:
+      return httplib2.Response({'status': 404}), 'Not Found'
+    elif method == 'PATCH':
+      self.metadata = dict(self.metadata, etag='CAI=', **json.loads(body))
+    elif headers.get('If-None-Match') == self.metadata['etag']:
+      return httplib2.Response({'status': 304}), ''
+
+    response = httplib2.Response({'status': 200,
+                                  'content-type': 'application/json',
+                                  'etag': self.metadata['etag']})
+    return response, json.dumps(self.metadata)
+
+
+class TestMetadataCache(unittest2.TestCase):
+
+  def _make_bucket(self, cache):
+    self.http = ObjectHttp()
+    connection = Connection('project-name', http=self.http,
+                            metadata_cache=cache)
+    return Bucket(connection=connection, name='bucket')
+
+  def test_hits_and_misses(self):
+    cache = MemoryMetadataCache()
+    bucket = self._make_bucket(cache)
+
+    self.assertEqual('3', bucket.get_key('key').get_metadata('size'))
+    key = bucket.get_key('key')
+    key.metadata['size'] = 'modified locally'
+    self.assertEqual('3', bucket.get_key('key').get_metadata('size'))
+
+    self.assertEqual(1, len(self.http.requests))
+    self.assertEqual({'hits': 2, 'misses': 1, 'revalidations': 0},
+                     cache.get_stats())
+
+  def test_revalidates_stale_entries(self):
+    cache = MemoryMetadataCache(ttl=0)
+    bucket = self._make_bucket(cache)
+
+    bucket.get_key('key')
+    self.assertEqual('key', bucket.get_key('key').name)
+    self.assertEqual([('GET', None), ('GET', 'CAE=')], self.http.requests)
+    self.assertEqual(1, cache.revalidations)
+
+  def test_deleted_keys_are_dropped_on_revalidation(self):
+    cache = MemoryMetadataCache(ttl=0)
+    bucket = self._make_bucket(cache)
+
+    bucket.get_key('key')
+    self.http.metadata = None
+    self.assertIsNone(bucket.get_key('key'))
+    self.assertIsNone(cache.get('bucket', 'key', ''))
+
+  def test_own_writes_invalidate(self):
+    cache = MemoryMetadataCache()
+    bucket = self._make_bucket(cache)
+
+    key = bucket.get_key('key')
+    key.patch_metadata({'contentType': 'text/plain'})
+    self.assertEqual('text/plain',
+                     bucket.get_key('key').get_metadata('contentType'))
+    self.assertEqual(2, cache.misses)
+
+  def test_least_recently_used_entries_are_evicted(self):
+    cache = MemoryMetadataCache(max_entries=2)
+    cache.set('bucket', 'a', '', {'name': 'a'})
+    cache.set('bucket', 'b', '', {'name': 'b'})
+    cache.get('bucket', 'a', '')
+    cache.set('bucket', 'c', '', {'name': 'c'})
+
+    self.assertEqual(2, len(cache))
+    self.assertIsNone(cache.get('bucket', 'b', ''))
+    self.assertEqual({'name': 'a'}, cache.get('bucket', 'a', '').metadata)
+
+  def test_revalidated_entries_are_recently_used(self):
+    cache = MemoryMetadataCache(max_entries=2)
+    cache.set('bucket', 'a', '', {'name': 'a'})
+    cache.set('bucket', 'b', '', {'name': 'b'})
+    cache.touch('bucket', 'a', '')
+    cache.set('bucket', 'c', '', {'name': 'c'})
+
+    self.assertIsNone(cache.get('bucket', 'b', ''))
+    self.assertEqual({'name': 'a'}, cache.get('bucket', 'a', '').metadata)
+
+  def test_sqlite_cache_is_shared(self):
+    directory = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(directory, 'metadata.db')
+      self._make_bucket(SqliteMetadataCache(filename)).get_key('key')
+
+      cache = SqliteMetadataCache(filename)
+      bucket = self._make_bucket(cache)
+      self.assertEqual('3', bucket.get_key('key').get_metadata('size'))
+      self.assertEqual([], self.http.requests)
+      self.assertEqual(1, cache.hits)
+
+      bucket.delete_key('key')
+      self.assertIsNone(cache.get('bucket', 'key', ''))
+    finally:
+      shutil.rmtree(directory)
+
+
+class TestContentCache(unittest2.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _make_key(self, cache, generation='1', data='data'):
+    connection = Connection('project-name', content_cache=cache)
+    connection.make_streaming_request = self._make_streaming_request
+    self.data = data
+    self.urls = []
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    key.metadata = {'generation': generation}
+    return key
+
+  def _make_streaming_request(self, method, url, headers=None):
+    self.urls.append(url)
+    return StreamingResponse(200, self.data)
+
+  def test_reads_through_the_cache(self):
+    cache = ContentCache(self.directory)
+    self.assertEqual('data', self._make_key(cache).get_contents_as_string())
+    self.assertEqual(1, len(self.urls))
+    self.assertTrue('generation=1' in self.urls[0])
+
+    # Another process sharing the directory doesn't download it again.
+    cache = ContentCache(self.directory)
+    self.assertEqual('data', self._make_key(cache).get_contents_as_string())
+    self.assertEqual([], self.urls)
+    self.assertEqual({'hits': 1, 'misses': 0}, cache.get_stats())
+
+  def test_new_generations_are_downloaded(self):
+    cache = ContentCache(self.directory)
+    self._make_key(cache, '1', 'old').get_contents_as_string()
+    key = self._make_key(cache, '2', 'new')
+    self.assertEqual('new', key.get_contents_as_string())
+    self.assertEqual(1, len(self.urls))
+
+  def test_evicts_least_recently_used(self):
+    cache = ContentCache(self.directory, max_size=10)
+    for generation in ('1', '2', '3'):
+      self._make_key(cache, generation, 'abcd').get_contents_as_string()
+      # Make sure each file has a distinct modification time.
+      filename = cache.get_filename('bucket', 'key', generation)
+      os.utime(filename, (int(generation), int(generation)))
+    cache.evict()
+
+    self.assertEqual(2, len(os.listdir(self.directory)))
+    self.assertFalse(os.path.exists(cache.get_filename('bucket', 'key', '1')))
+
+  def test_object_larger_than_the_cache(self):
+    cache = ContentCache(self.directory, max_size=10)
+    self._make_key(cache, '1', 'abcd').get_contents_as_string()
+    key = self._make_key(cache, '2', 'more than ten bytes')
+    self.assertEqual('more than ten bytes', key.get_contents_as_string())
+
+    # Everything else made way for it.
+    self.assertEqual([os.path.basename(cache.get_filename('bucket', 'key',
+                                                          '2'))],
+                     os.listdir(self.directory))
+
+  def test_checksum_verifies_cached_data(self):
+    cache = ContentCache(self.directory)
+    md5_hash = base64.b64encode(hashlib.md5('data').digest())
+    key = self._make_key(cache)
+    key.metadata['md5Hash'] = md5_hash
+    key.get_contents_as_string()
+
+    # Corrupt the cached copy: it is noticed and downloaded again.
+    with open(cache.get_filename('bucket', 'key', '1'), 'wb') as fh:
+      fh.write('dat!')
+    key = self._make_key(cache)
+    key.metadata['md5Hash'] = md5_hash
+    self.assertEqual('data', key.get_contents_as_string(checksum='md5'))
+    self.assertEqual(1, len(self.urls))
+
+  def test_options_the_cache_cannot_honor(self):
+    key = self._make_key(ContentCache(self.directory))
+    self.assertRaises(ValueError, key.get_contents_to_file, StringIO(),
+                      num_workers=4)
+    self.assertRaises(ValueError, key.get_contents_to_file, StringIO(),
+                      chunk_sizer=AdaptiveChunkSize())
@@ -1,10 +1,102 @@
+import base64
+import urlparse
+
 import unittest2
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from OpenSSL import crypto
 
 from gcloud.storage.connection import Connection
 
 
+def make_private_key():
+  key = crypto.PKey()
+  key.generate_key(crypto.TYPE_RSA, 1024)
+  pkcs12 = crypto.PKCS12()
+  pkcs12.set_privatekey(key)
+  public_key = RSA.importKey(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+  return base64.b64encode(pkcs12.export('notasecret')), public_key
+
+
+PRIVATE_KEY, PUBLIC_KEY = make_private_key()
+
+
+class Credentials(object):
+
+  def __init__(self, private_key=PRIVATE_KEY):
+    self.private_key = private_key
+    self.service_account_name = 'account@example.com'
+
+
 class TestConnection(unittest2.TestCase):
 
   def test_init(self):
     connection = Connection('project-name')
     self.assertEqual('project-name', connection.project)
+
+  def test_streaming_connections_time_out(self):
+    connection = Connection('project-name')
+    http_connection = connection.get_http_connection(
+        'https://storage.googleapis.com/b/bucket/o/key?alt=media')
+    self.assertEqual('storage.googleapis.com', http_connection.host)
+    self.assertEqual(Connection.STREAMING_TIMEOUT, http_connection.timeout)
+
+
+class TestSignedUrls(unittest2.TestCase):
+
+  def setUp(self):
+    self.connection = Connection('project-name', credentials=Credentials())
+
+  def assertSigned(self, url, resource, expiration, method='GET'):
+    parts = urlparse.urlparse(url)
+    self.assertEqual(resource, parts.path)
+    query = urlparse.parse_qs(parts.query)
+    self.assertEqual(['account@example.com'], query['GoogleAccessId'])
+    self.assertEqual([str(expiration)], query['Expires'])
+
+    signature_string = '%s\n\n\n%d\n%s' % (method, expiration, resource)
+    verifier = PKCS1_v1_5.new(PUBLIC_KEY)
+    self.assertTrue(verifier.verify(SHA256.new(signature_string),
+                                    base64.b64decode(query['Signature'][0])))
+
+  def test_generate_signed_url(self):
+    url = self.connection.generate_signed_url('/bucket/key.txt', 1400000000)
+    self.assertSigned(url, '/bucket/key.txt', 1400000000)
+
+  def test_signer_cached_per_credentials(self):
+    signer = self.connection.get_signer()
+    self.assertIs(signer, self.connection.get_signer())
+
+    # Another connection with the same credentials shares it...
+    other = Connection('project-name', credentials=self.connection.credentials)
+    self.assertIs(signer, other.get_signer())
+
+    # ...but not other credentials, or a changed key.
+    other = Connection('project-name', credentials=Credentials())
+    self.assertIsNot(signer, other.get_signer())
+
+    self.connection.credentials.private_key = make_private_key()[0]
+    self.assertIsNot(signer, self.connection.get_signer())
+
+  def test_generate_signed_urls(self):
+    resources = ['/bucket/key-%d.txt' % i for i in range(5)]
+    urls = self.connection.generate_signed_urls(resources, 1400000000,
+                                                method='PUT')
+
+    self.assertEqual(5, len(urls))
+    for resource, url in zip(resources, urls):
+      self.assertSigned(url, resource, 1400000000, method='PUT')
+
+  def test_generate_signed_urls_in_processes(self):
+    self.connection.SIGNING_POOL_THRESHOLD = 2
+    resources = ['/bucket/key-%d.txt' % i for i in range(10)]
+    urls = self.connection.generate_signed_urls(resources, 1400000000,
+                                                num_processes=2)
+
+    # Signatures are deterministic, so they match the in-process ones.
+    self.assertEqual(urls, [
+        self.connection.generate_signed_url(resource, 1400000000)
+        for resource in resources])
+    for resource, url in zip(resources, urls):
+      self.assertSigned(url, resource, 1400000000)
@@ -0,0 +1,198 @@
+import json
+import threading
+import time
+import urllib
+import urlparse
+
+import httplib2
+import unittest2
+
+from gcloud.storage import exceptions
+from gcloud.storage._testing import StreamingResponse
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.connection import Connection
+from gcloud.storage.executor import AsyncConnection
+from gcloud.storage.executor import Task
+
+
+class MemoryHttp(object):
+  """Serves the metadata and listing of objects held in a dictionary."""
+
+  def __init__(self, objects, page_size=5):
+    self.objects = objects
+    self.page_size = page_size
+    self.listing_threads = set()
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    parsed = urlparse.urlparse(uri)
+    path = urllib.unquote(parsed.path).split('/b/', 1)[1]
+    if path == 'bucket':
+      return self._json({'name': 'bucket'})
+    elif path == 'bucket/o':
+      self.listing_threads.add(threading.current_thread())
+      start = int(urlparse.parse_qs(parsed.query).get('pageToken', ['0'])[0])
+      names = sorted(self.objects)
+      page = {'items': [{'name': name}
+                        for name in names[start:start + self.page_size]]}
+      if start + self.page_size < len(names):
+        page['nextPageToken'] = str(start + self.page_size)
+      return self._json(page)
+
+    name = path[len('bucket/o/'):]
+    if name not in self.objects:
+      return httplib2.Response({'status': 404}), 'Not Found'
+    return self._json({'name': name, 'size': str(len(self.objects[name]))})
+
+  @staticmethod
+  def _json(value):
+    response = httplib2.Response({'status': 200,
+                                  'content-type': 'application/json'})
+    return response, json.dumps(value)
+
+
+class MemoryConnection(Connection):
+  """Streams objects held in a dictionary, counting concurrent downloads."""
+
+  def __init__(self, objects):
+    super(MemoryConnection, self).__init__('project-name',
+                                           http=MemoryHttp(objects))
+    self.objects = objects
+    self.lock = threading.Lock()
+    self.running = 0
+    self.most_running = 0
+    self.release = threading.Event()
+    self.release.set()
+
+  def make_streaming_request(self, method, url, headers=None):
+    with self.lock:
+      self.running += 1
+      self.most_running = max(self.most_running, self.running)
+    try:
+      self.release.wait(5)
+    finally:
+      with self.lock:
+        self.running -= 1
+
+    path = urllib.unquote(urlparse.urlparse(url).path)
+    name = path.split('/b/bucket/o/', 1)[1]
+    if name not in self.objects:
+      return StreamingResponse(404, 'Not Found')
+    return StreamingResponse(200, self.objects[name])
+
+
+class TestTask(unittest2.TestCase):
+
+  def test_result_waits(self):
+    task = Task()
+    threading.Timer(0.01, task.set_result, ('done',)).start()
+    self.assertEqual('done', task.result(timeout=5))
+    self.assertTrue(task.done())
+
+  def test_timeout(self):
+    task = Task()
+    self.assertFalse(task.wait(0.001))
+    self.assertRaises(RuntimeError, task.result, 0.001)
+
+  def test_then_returns_task(self):
+    task = Task()
+    chained = task.then(lambda value: value * 2)
+    self.assertTrue(isinstance(chained, Task))
+    threading.Timer(0.01, task.set_result, (21,)).start()
+    self.assertEqual(42, chained.result(timeout=5))
+
+
+class TestAsyncConnection(unittest2.TestCase):
+
+  def setUp(self):
+    self.objects = dict(('key-%d' % i, 'data-%d' % i) for i in xrange(20))
+    self.connection = MemoryConnection(self.objects)
+    self.bucket = Bucket(connection=self.connection, name='bucket')
+
+  def _client(self, **kwargs):
+    client = AsyncConnection(self.connection, **kwargs)
+    self.addCleanup(client.close)
+    return client
+
+  def test_get_key_and_contents(self):
+    bucket = self._client().wrap_bucket(self.bucket)
+    key = bucket.get_key('key-3').result(timeout=5)
+    self.assertEqual('key-3', key.name)
+    self.assertEqual('data-3', key.get_contents_as_string().result(timeout=5))
+    self.assertEqual(None, bucket.get_key('missing').result(timeout=5))
+
+  def test_get_bucket(self):
+    bucket = self._client().get_bucket('bucket').result(timeout=5)
+    self.assertEqual('bucket', bucket.name)
+
+  def test_errors_are_kept_in_tasks(self):
+    bucket = self._client().wrap_bucket(self.bucket)
+    task = bucket.new_key('missing').get_contents_as_string()
+    self.assertTrue(isinstance(task.exception(timeout=5),
+                               exceptions.NotFoundError))
+    self.assertRaises(exceptions.NotFoundError, task.result)
+
+  def test_limits_calls_in_flight(self):
+    client = self._client(max_in_flight=3)
+    bucket = client.wrap_bucket(self.bucket)
+    self.connection.release.clear()
+    tasks = [bucket.new_key(name).get_contents_as_string()
+             for name in self.objects]
+    time.sleep(0.05)
+    self.connection.release.set()
+
+    results = [task.result(timeout=5) for task in client.as_completed(tasks)]
+    self.assertEqual(sorted(self.objects.values()), sorted(results))
+    self.assertEqual(3, self.connection.most_running)
+
+  def test_shared_semaphore(self):
+    semaphore = threading.Semaphore(2)
+    first = self._client(max_in_flight=4, semaphore=semaphore)
+    second = self._client(max_in_flight=4, semaphore=semaphore)
+    self.connection.release.clear()
+    tasks = []
+    for name in self.objects:
+      for client in (first, second):
+        tasks.append(client.wrap_bucket(self.bucket).new_key(name)
+                     .get_contents_as_string())
+    time.sleep(0.05)
+    self.connection.release.set()
+
+    for task in tasks:
+      task.result(timeout=5)
+    self.assertEqual(2, self.connection.most_running)
+
+  def test_map_unordered_reads_lazily(self):
+    client = self._client(max_in_flight=2)
+    read = []
+
+    def items():
+      for i in xrange(10):
+        read.append(i)
+        yield i
+
+    results = client.map_unordered(lambda i: i * i, items(), window=3)
+    first = next(results)
+    self.assertTrue(len(read) <= 4)
+    rest = [task.result() for task in results]
+    self.assertEqual(sorted(i * i for i in xrange(10)),
+                     sorted([first.result()] + rest))
+
+  def test_iter_keys_and_contents(self):
+    bucket = self._client().wrap_bucket(self.bucket)
+    names = [key.name for key in bucket.iter_keys()]
+    self.assertEqual(sorted(self.objects), names)
+    names = [key.name for key in bucket.iter_keys(prefetch=False)]
+    self.assertEqual(sorted(self.objects), names)
+
+    # Pages are requested by the client's threads, within its limits.
+    self.assertFalse(threading.current_thread() in
+                     self.connection.http.listing_threads)
+
+    contents = dict((key.name, task.result())
+                    for key, task in bucket.iter_keys().iter_contents())
+    self.assertEqual(self.objects, contents)
+
+  def test_closed(self):
+    client = AsyncConnection(self.connection)
+    client.close()
+    self.assertRaises(ValueError, client.submit, len, 'abc')
@@ -0,0 +1,391 @@
+from StringIO import StringIO
+import base64
+import hashlib
+import threading
+import time
+import zlib
+
+import unittest2
+
+from gcloud.storage import exceptions
+from gcloud.storage._testing import StreamingResponse
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.connection import Connection
+from gcloud.storage.iterator import KeyDataIterator
+from gcloud.storage.iterator import KeyIterator
+from gcloud.storage.iterator import ShardedKeyIterator
+from gcloud.storage.iterator import KeyStreamIterator
+from gcloud.storage.key import Key
+from gcloud.storage.transfer import AdaptiveChunkSize
+
+
+class StreamingConnection(Connection):
+
+  def __init__(self, response):
+    super(StreamingConnection, self).__init__('project-name')
+    self.response = response
+    self.requests = []
+
+  def make_streaming_request(self, method, url, headers=None):
+    self.requests.append((method, url))
+    return self.response
+
+
+class MetadataStreamingConnection(StreamingConnection):
+  """Also serves a key's metadata from ``api_request``."""
+
+  def __init__(self, response, metadata):
+    super(MetadataStreamingConnection, self).__init__(response)
+    self.metadata = metadata
+
+  def api_request(self, method, path=None, query_params=None, **kwargs):
+    return dict(self.metadata)
+
+
+class PagingConnection(Connection):
+  """Serves numbered pages of keys, failing on ``fail_on_page``."""
+
+  def __init__(self, num_pages, fail_on_page=None):
+    super(PagingConnection, self).__init__('project-name')
+    self.num_pages = num_pages
+    self.fail_on_page = fail_on_page
+    self.pages_served = 0
+    self.fetching_thread = None
+    self._served = threading.Condition()
+
+  def wait_for_pages(self, count, timeout=5):
+    deadline = time.time() + timeout
+    with self._served:
+      while self.pages_served < count and time.time() < deadline:
+        self._served.wait(deadline - time.time())
+      return self.pages_served
+
+  def api_request(self, method, path=None, query_params=None, **kwargs):
+    page = int((query_params or {}).get('pageToken', 0))
+    if page == self.fail_on_page:
+      raise exceptions.ConnectionError(None, 'Backend Error')
+
+    with self._served:
+      self.fetching_thread = threading.current_thread()
+      self.pages_served += 1
+      self._served.notify_all()
+    items = [{'name': 'key-%d-%d' % (page, i)} for i in xrange(2)]
+    response = {'items': items}
+    if page + 1 < self.num_pages:
+      response['nextPageToken'] = str(page + 1)
+    return response
+
+
+class TestIteratorPrefetch(unittest2.TestCase):
+
+  def _make_iterator(self, connection, prefetch):
+    bucket = Bucket(connection=connection, name='bucket')
+    return KeyIterator(bucket, prefetch=prefetch)
+
+  def test_same_items_as_without_prefetch(self):
+    expected = [key.name for key in
+                self._make_iterator(PagingConnection(5), prefetch=0)]
+    self.assertEqual(10, len(expected))
+    self.assertEqual(expected, [key.name for key in
+                                self._make_iterator(PagingConnection(5), 2)])
+
+  def test_read_ahead_is_bounded(self):
+    connection = PagingConnection(20)
+    keys = iter(self._make_iterator(connection, prefetch=2))
+    keys.next()
+
+    # The current page, two queued pages and one waiting to be queued.
+    self.assertEqual(4, connection.wait_for_pages(4))
+
+    # Once stopped, the fetching thread exits without asking for more.
+    keys.close()
+    connection.fetching_thread.join(5)
+    self.assertFalse(connection.fetching_thread.is_alive())
+    self.assertEqual(4, connection.pages_served)
+
+  def test_errors_are_raised_in_the_caller(self):
+    keys = iter(self._make_iterator(PagingConnection(5, fail_on_page=2), 1))
+    self.assertEqual(4, len([keys.next() for _ in xrange(4)]))
+    self.assertRaises(exceptions.ConnectionError, keys.next)
+
+
+class ListingConnection(Connection):
+  """Lists a sorted set of names, honoring prefix, delimiter and paging."""
+
+  def __init__(self, names, page_size=3):
+    super(ListingConnection, self).__init__('project-name')
+    self.names = sorted(names)
+    self.page_size = page_size
+    self.requests = []
+
+  def api_request(self, method, path=None, query_params=None, **kwargs):
+    query_params = query_params or {}
+    self.requests.append(query_params)
+    prefix = query_params.get('prefix', '')
+    delimiter = query_params.get('delimiter')
+
+    results = []
+    for name in self.names:
+      if not name.startswith(prefix):
+        continue
+      rest = name[len(prefix):]
+      if delimiter and delimiter in rest:
+        sub_prefix = prefix + rest[:rest.index(delimiter) + 1]
+        if (sub_prefix, True) not in results:
+          results.append((sub_prefix, True))
+      else:
+        results.append((name, False))
+
+    start = int(query_params.get('pageToken', 0))
+    page = results[start:start + self.page_size]
+    response = {
+        'items': [{'name': name} for name, is_prefix in page
+                  if not is_prefix],
+        'prefixes': [name for name, is_prefix in page if is_prefix],
+        }
+    if start + self.page_size < len(results):
+      response['nextPageToken'] = str(start + self.page_size)
+    return response
+
+
+class TestShardedKeyIterator(unittest2.TestCase):
+
+  NAMES = ['a.txt', 'b/1', 'b/2', 'b/c/3', 'c.txt', 'd/1', 'd/2', 'd/3',
+           'd/4', 'e/1', 'f']
+
+  def _make_bucket(self, names=NAMES):
+    connection = ListingConnection(names)
+    return Bucket(connection=connection, name='bucket')
+
+  def test_query_params(self):
+    bucket = self._make_bucket()
+    iterator = KeyIterator(bucket, prefix='b/', delimiter='/', max_results=2,
+                           fields=['name', 'size'])
+    self.assertEqual(['b/1', 'b/2'], [key.name for key in iterator])
+    self.assertEqual(set(['b/c/']), iterator.prefixes)
+    self.assertEqual({
+        'prefix': 'b/',
+        'delimiter': '/',
+        'maxResults': 2,
+        'fields': 'nextPageToken,prefixes,items(name,size)',
+        }, bucket.connection.requests[0])
+
+  def test_ordered(self):
+    bucket = self._make_bucket()
+    keys = ShardedKeyIterator(bucket, num_workers=3, ordered=True)
+    self.assertEqual(self.NAMES, [key.name for key in keys])
+
+    # One delimited listing, then one listing for each of b/, d/ and e/.
+    prefixes = [params.get('prefix') for params in bucket.connection.requests
+                if 'pageToken' not in params]
+    self.assertEqual([None, 'b/', 'd/', 'e/'], sorted(prefixes))
+
+  def test_unordered(self):
+    bucket = self._make_bucket()
+    keys = bucket.iter_keys(num_workers=2)
+    self.assertEqual(self.NAMES, sorted(key.name for key in keys))
+
+  def test_flat_bucket_is_streamed(self):
+    names = ['key-%02d' % i for i in xrange(30)]
+    for ordered in (True, False):
+      bucket = self._make_bucket(names)
+      keys = iter(ShardedKeyIterator(bucket, num_workers=2, ordered=ordered))
+      self.assertEqual('key-00', keys.next().name)
+      # Only the first page of the top level has been listed.
+      self.assertEqual(1, len(bucket.connection.requests))
+      self.assertEqual(names[1:], [key.name for key in keys])
+
+  def test_errors_are_raised_in_the_caller(self):
+    bucket = self._make_bucket()
+
+    def api_request(method, path=None, query_params=None, **kwargs):
+      if query_params.get('prefix') == 'd/':
+        raise exceptions.ConnectionError(None, 'Backend Error')
+      return ListingConnection.api_request(bucket.connection, method, path,
+                                           query_params)
+
+    bucket.connection.api_request = api_request
+    keys = ShardedKeyIterator(bucket, num_workers=2, ordered=True)
+    self.assertRaises(exceptions.ConnectionError, list, keys)
+
+
+class MetadataConnection(Connection):
+  """Serves objects and buckets, honoring the fields projection."""
+
+  RESOURCE = {'name': 'key', 'size': '10', 'contentType': 'text/plain'}
+
+  def __init__(self):
+    super(MetadataConnection, self).__init__('project-name')
+    self.requests = []
+
+  def api_request(self, method, path=None, query_params=None, **kwargs):
+    query_params = query_params or {}
+    self.requests.append((path, query_params))
+    fields = query_params.get('fields')
+
+    if path in ('/b', '/b/bucket/o'):
+      item_fields = fields and fields.split('items(')[1].rstrip(')')
+      return {'items': [self._project(self.RESOURCE, item_fields)]}
+    return self._project(self.RESOURCE, fields)
+
+  @staticmethod
+  def _project(resource, fields):
+    if not fields:
+      return dict(resource)
+    return dict((name, value) for name, value in resource.items()
+                if name in fields.split(','))
+
+
+class TestFieldProjection(unittest2.TestCase):
+
+  def test_listing_fields(self):
+    connection = MetadataConnection()
+    bucket = Bucket(connection=connection, name='bucket')
+    key, = bucket.iter_keys(fields=['name', 'size'])
+    self.assertEqual({'name': 'key', 'size': '10'}, key.metadata)
+    self.assertEqual('nextPageToken,prefixes,items(name,size)',
+                     connection.requests[0][1]['fields'])
+
+    bucket, = connection.iter_buckets(fields=['name'])
+    self.assertEqual({'name': 'key'}, bucket.metadata)
+
+  def test_get_metadata_fetches_only_missing_fields(self):
+    connection = MetadataConnection()
+    bucket = Bucket(connection=connection, name='bucket')
+    key = Key(bucket=bucket, name='key', metadata={'name': 'key'})
+
+    self.assertEqual('10', key.get_metadata('size'))
+    self.assertEqual(('/b/bucket/o/key',
+                      {'projection': 'noAcl', 'fields': 'size'}),
+                     connection.requests[-1])
+    self.assertEqual({'name': 'key', 'size': '10'}, key.metadata)
+
+    # Unset fields are remembered too.
+    self.assertEqual(None, key.get_metadata('contentEncoding'))
+    self.assertEqual(None, key.get_metadata('contentEncoding'))
+    self.assertEqual(2, len(connection.requests))
+
+  def test_full_reload_without_metadata(self):
+    connection = MetadataConnection()
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    self.assertEqual('text/plain', key.get_metadata('contentType'))
+    self.assertEqual({'projection': 'noAcl'}, connection.requests[0][1])
+    self.assertEqual(MetadataConnection.RESOURCE, key.metadata)
+
+
+class TestKeyStreamIterator(unittest2.TestCase):
+
+  def _make_key(self, response, metadata=None):
+    connection = StreamingConnection(response)
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    key.metadata = metadata or {}
+    return key
+
+  def test_yields_buffers_from_one_request(self):
+    response = StreamingResponse(200, 'abcdefghij')
+    key = self._make_key(response)
+    self.assertEqual(['abcd', 'efgh', 'ij'],
+                     list(KeyStreamIterator(key, buffer_size=4)))
+    self.assertEqual(1, len(key.connection.requests))
+    self.assertTrue('alt=media' in key.connection.requests[0][1])
+    self.assertEqual([4, 4, 4, 4], response.reads)
+    self.assertTrue(response.closed)
+
+  def test_not_found(self):
+    response = StreamingResponse(404, 'Not Found')
+    key = self._make_key(response)
+    self.assertRaises(exceptions.NotFoundError, list, KeyStreamIterator(key))
+    self.assertTrue(response.closed)
+
+  def test_truncated_body(self):
+    response = StreamingResponse(200, 'abcdef', {'Content-Length': '10'})
+    key = self._make_key(response)
+    self.assertRaises(exceptions.StorageDataError, list,
+                      KeyStreamIterator(key, buffer_size=4))
+    self.assertTrue(response.closed)
+
+    response = StreamingResponse(200, 'abcdef', {'Content-Length': '6'})
+    key = self._make_key(response)
+    self.assertEqual('abcdef', ''.join(KeyStreamIterator(key)))
+
+  def test_verifies_checksum_from_header(self):
+    md5_header = {'X-Goog-Hash': 'md5=kAFQmDzST7DWlj99KOF/cg=='}
+    key = self._make_key(StreamingResponse(200, 'abc', md5_header))
+    self.assertEqual('abc', key.get_contents_as_string(checksum='md5'))
+
+    key = self._make_key(StreamingResponse(200, 'abd', md5_header))
+    self.assertRaises(exceptions.StorageDataError, key.get_contents_as_string,
+                      checksum='md5')
+
+  def test_key_streams_small_objects(self):
+    key = self._make_key(StreamingResponse(200, 'data'), {'size': '4'})
+    self.assertTrue(isinstance(key._get_data_iterator(), KeyStreamIterator))
+    self.assertEqual('data', key.get_contents_as_string())
+
+  def test_key_uses_ranges_for_big_objects(self):
+    key = self._make_key(None, {'size': str(Key.STREAM_SIZE_LIMIT + 1)})
+    self.assertTrue(isinstance(key._get_data_iterator(), KeyDataIterator))
+
+  def test_decompresses_gzip_encoded_data(self):
+    data = 'log line\n' * 1000
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+    headers = {
+        'Content-Encoding': 'gzip',
+        'X-Goog-Hash': 'md5=' + base64.b64encode(
+            hashlib.md5(compressed).digest()),
+        }
+
+    key = self._make_key(StreamingResponse(200, compressed, headers),
+                         {'contentEncoding': 'gzip', 'size': '1'})
+    iterator = key._get_data_iterator()
+    self.assertTrue(isinstance(iterator, KeyStreamIterator))
+    iterator.buffer_size = 100
+    chunks = list(iterator)
+    self.assertEqual(data, ''.join(chunks))
+    self.assertTrue(max(len(chunk) for chunk in chunks) <= 100)
+
+    # The checksum covers the data as it is stored.
+    key = self._make_key(StreamingResponse(200, compressed, headers))
+    self.assertEqual(data, key.get_contents_as_string(checksum='md5'))
+
+    key = self._make_key(StreamingResponse(200, compressed, headers))
+    self.assertEqual(compressed,
+                     ''.join(KeyStreamIterator(key, decompress=False)))
+
+  def test_bare_gzip_key_is_not_downloaded_in_ranges(self):
+    data = 'log line\n' * 1000
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+    response = StreamingResponse(200, compressed,
+                                 {'Content-Encoding': 'gzip'})
+
+    for kwargs in ({'num_workers': 4}, {'chunk_sizer': AdaptiveChunkSize()}):
+      connection = MetadataStreamingConnection(
+          response, {'name': 'key', 'size': str(len(compressed)),
+                     'contentEncoding': 'gzip'})
+      key = Bucket(connection=connection, name='bucket').new_key('key')
+      response.fp.seek(0)
+
+      fh = StringIO()
+      key.get_contents_to_file(fh, **kwargs)
+      self.assertEqual(data, fh.getvalue())
+      self.assertEqual(1, len(connection.requests))
+
+  def test_projected_gzip_key_is_not_downloaded_in_ranges(self):
+    connection = MetadataStreamingConnection(
+        None, {'name': 'key', 'size': '100', 'contentEncoding': 'gzip'})
+    bucket = Bucket(connection=connection, name='bucket')
+
+    # A listing that only asked for names and sizes
+    # says nothing about the encoding, so it is loaded.
+    key = Key.from_dict({'name': 'key', 'size': '100'}, bucket=bucket,
+                        fields=['name', 'size'])
+    iterator = key._get_data_iterator(chunk_sizer=AdaptiveChunkSize())
+    self.assertTrue(isinstance(iterator, KeyStreamIterator))
+    self.assertEqual('gzip', key.metadata['contentEncoding'])
+
+    # Full metadata without an encoding means there isn't one.
+    key = Key.from_dict({'name': 'key', 'size': '100'}, bucket=bucket)
+    iterator = key._get_data_iterator(chunk_sizer=AdaptiveChunkSize())
+    self.assertTrue(isinstance(iterator, KeyDataIterator))
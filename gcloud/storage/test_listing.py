@@ -0,0 +1,70 @@
+import unittest2
+
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.connection import Connection
+from gcloud.storage.listing import KeyListing
+
+
+class PagedConnection(Connection):
+
+  def __init__(self, items, page_size=2):
+    super(PagedConnection, self).__init__('project-name')
+    self.items = items
+    self.page_size = page_size
+    self.requests = []
+
+  def api_request(self, method, path=None, query_params=None, **kwargs):
+    self.requests.append(query_params)
+    start = int(query_params.get('pageToken', 0))
+    response = {'items': self.items[start:start + self.page_size]}
+    if start + self.page_size < len(self.items):
+      response['nextPageToken'] = str(start + self.page_size)
+    return response
+
+
+class TestKeyListing(unittest2.TestCase):
+
+  ITEMS = [
+      {'name': u'a.txt', 'size': '10', 'generation': '1394452800123000',
+       'md5Hash': 'kAFQmDzST7DWlj99KOF/cg==', 'contentType': u'text/plain',
+       'updated': '2014-03-10T12:00:00.123Z'},
+      {'name': u'caf\xe9.txt', 'size': '5', 'generation': '2',
+       'contentType': u'text/plain', 'updated': '2014-03-10T12:00:01.000Z'},
+      {'name': u'c', 'size': '7000000000', 'generation': '3',
+       'md5Hash': 'AAAAAAAAAAAAAAAAAAAAAA==',
+       'updated': '2014-03-10T12:00:02.500Z'},
+      ]
+
+  def _make_listing(self):
+    connection = PagedConnection(self.ITEMS)
+    bucket = Bucket(connection=connection, name='bucket')
+    return bucket.get_key_listing(prefetch=0)
+
+  def test_round_trips_metadata(self):
+    listing = self._make_listing()
+    self.assertEqual(3, len(listing))
+    for index, item in enumerate(self.ITEMS):
+      self.assertEqual(item, listing.get_metadata(index))
+
+    self.assertEqual(u'caf\xe9.txt', listing.get_name(1))
+    self.assertEqual(7000000015, listing.total_size())
+    self.assertEqual([item['name'] for item in self.ITEMS],
+                     list(listing.iter_names()))
+
+  def test_builds_keys_on_access(self):
+    listing = self._make_listing()
+    key = listing[-1]
+    self.assertEqual(u'c', key.name)
+    self.assertEqual('bucket', key.bucket.name)
+    self.assertEqual('7000000000', key.get_metadata('size'))
+    self.assertEqual([u'a.txt', u'caf\xe9.txt', u'c'],
+                     [key.name for key in listing])
+    self.assertRaises(IndexError, listing.__getitem__, 3)
+
+  def test_requests_only_the_listed_fields(self):
+    listing = self._make_listing()
+    requests = listing.bucket.connection.requests
+    self.assertEqual(2, len(requests))
+    self.assertEqual(
+        'nextPageToken,prefixes,items(%s)' % ','.join(KeyListing.FIELDS),
+        requests[0]['fields'])
@@ -0,0 +1,178 @@
+import csv
+import os
+import pickle
+import re
+import zipfile
+import zlib
+from StringIO import StringIO
+
+import unittest2
+
+from gcloud.storage._testing import RangeHttp
+from gcloud.storage._testing import StreamingResponse
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.connection import Connection
+from gcloud.storage.reader import GzipKeyReader
+
+
+class GenerationRangeHttp(RangeHttp):
+  """Serves Range requests, remembering the URLs requested."""
+
+  def __init__(self, data, status=206):
+    super(GenerationRangeHttp, self).__init__(data, status=status)
+    self.uris = []
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    self.uris.append(uri)
+    return super(GenerationRangeHttp, self).request(
+        uri, method=method, body=body, headers=headers, **kwargs)
+
+
+class TestKeyReader(unittest2.TestCase):
+
+  def _open(self, data, **kwargs):
+    self.http = GenerationRangeHttp(data)
+    connection = Connection('project-name', http=self.http)
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    key.metadata = {'name': 'key', 'size': str(len(data)), 'generation': '7'}
+    return key.open(**kwargs)
+
+  def test_read_seek_tell(self):
+    data = ''.join(chr(i % 256) for i in xrange(1000))
+    fh = self._open(data, block_size=64)
+
+    self.assertEqual(data[:100], fh.read(100))
+    self.assertEqual(100, fh.tell())
+    fh.seek(500)
+    self.assertEqual(data[500:530], fh.read(30))
+    fh.seek(-10, os.SEEK_CUR)
+    self.assertEqual(data[520:540], fh.read(20))
+    fh.seek(-5, os.SEEK_END)
+    self.assertEqual(data[-5:], fh.read())
+    self.assertEqual('', fh.read(10))
+
+    fh.seek(990)
+    self.assertEqual(data[990:], fh.read(100))
+
+  def test_reads_ahead_only_sequentially(self):
+    fh = self._open('x' * 100, block_size=10, read_ahead=2)
+
+    while fh.read(5):
+      pass
+    self.assertEqual([(0, 29), (30, 59), (60, 89), (90, 99)],
+                     self.http.ranges)
+
+    fh = self._open('x' * 100, block_size=10, read_ahead=2)
+    fh.seek(50)
+    fh.read(1)
+    self.assertEqual([(50, 59)], self.http.ranges)
+
+  def test_recent_blocks_are_kept(self):
+    data = ''.join(chr(i % 256) for i in xrange(100))
+    fh = self._open(data, block_size=10, read_ahead=0, max_blocks=2)
+
+    for offset in (80, 0, 85, 5):
+      fh.seek(offset)
+      self.assertEqual(data[offset:offset + 3], fh.read(3))
+    self.assertEqual([(80, 89), (0, 9)], self.http.ranges)
+
+    # Reading a third block evicts the least recently used one.
+    fh.seek(40)
+    fh.read(1)
+    fh.seek(80)
+    fh.read(1)
+    self.assertEqual([(80, 89), (0, 9), (40, 49), (80, 89)],
+                     self.http.ranges)
+
+  def test_reads_pinned_generation(self):
+    fh = self._open('abc')
+    fh.read()
+    self.assertIn('generation=7', self.http.uris[0])
+    self.assertIn('alt=media', self.http.uris[0])
+
+  def test_empty_object(self):
+    fh = self._open('')
+    self.assertEqual('', fh.read())
+    self.assertEqual('', fh.readline())
+    self.assertEqual([], self.http.ranges)
+
+  def test_readline_and_iteration(self):
+    data = 'first line\nsecond, longer line\n\nno newline at the end'
+    fh = self._open(data, block_size=4)
+
+    self.assertEqual('first line\n', fh.readline())
+    self.assertEqual('second', fh.readline(6))
+    self.assertEqual(', longer line\n', fh.readline())
+    self.assertEqual(['\n', 'no newline at the end'], list(fh))
+
+    fh.seek(0)
+    self.assertEqual(data.splitlines(True), fh.readlines())
+
+  def test_closed(self):
+    with self._open('abc') as fh:
+      fh.read(1)
+    self.assertTrue(fh.closed)
+    self.assertRaises(ValueError, fh.read)
+
+  def test_file_modules(self):
+    rows = [['name', 'size'], ['a', '1'], ['b, c', '2']]
+    output = StringIO()
+    csv.writer(output).writerows(rows)
+    self.assertEqual(rows, list(csv.reader(self._open(output.getvalue(),
+                                                      block_size=8))))
+
+    value = {'a': range(100), 'b': 'x' * 500}
+    self.assertEqual(value, pickle.load(self._open(
+        pickle.dumps(value, pickle.HIGHEST_PROTOCOL), block_size=16)))
+
+    output = StringIO()
+    with zipfile.ZipFile(output, 'w') as archive:
+      archive.writestr('README', 'Read me.')
+      archive.writestr('data/part-0.csv', 'a,b\n' * 1000)
+    archive = zipfile.ZipFile(self._open(output.getvalue(), block_size=256))
+    self.assertEqual(['README', 'data/part-0.csv'], archive.namelist())
+    self.assertEqual('Read me.', archive.read('README'))
+
+
+class GzipRangeConnection(Connection):
+  """Serves raw Range responses over gzip encoded data."""
+
+  def __init__(self, data):
+    super(GzipRangeConnection, self).__init__('project-name')
+    self.data = data
+    self.ranges = []
+
+  def make_request(self, *args, **kwargs):
+    raise AssertionError('Encoded ranges must not go through httplib2.')
+
+  def make_streaming_request(self, method, url, headers=None):
+    start, end = re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups()
+    start, end = int(start), int(end)
+    self.ranges.append((start, end))
+    return StreamingResponse(206, self.data[start:end + 1], {
+        'content-encoding': 'gzip',
+        'content-range': 'bytes %d-%d/%d' % (start, end, len(self.data))})
+
+
+class TestGzipKeyReader(unittest2.TestCase):
+
+  def test_decompresses_as_it_reads(self):
+    data = ''.join('line %d\n' % i for i in xrange(5000))
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+
+    connection = GzipRangeConnection(compressed)
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    key.metadata = {'name': 'key', 'size': str(len(compressed)),
+                    'generation': '1', 'contentEncoding': 'gzip'}
+
+    with key.open(block_size=256) as fh:
+      self.assertTrue(isinstance(fh, GzipKeyReader))
+      self.assertEqual('line 0\n', fh.readline())
+      fh.seek(len('line 0\nline 1\n'))
+      self.assertEqual('line 2\n', next(fh))
+      self.assertEqual(data.splitlines(True)[3:], list(fh))
+    self.assertTrue(fh.reader.closed)
+
+    raw = key.open(decompress=False)
+    self.assertEqual(compressed, raw.read())
@@ -0,0 +1,192 @@
+import json
+import socket
+
+import httplib2
+import unittest2
+
+from gcloud.storage import exceptions
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.connection import Connection
+from gcloud.storage.iterator import KeyDataIterator
+from gcloud.storage.retry import RetryPolicy
+
+
+def make_policy(**kwargs):
+  policy = RetryPolicy(**kwargs)
+  policy.delays = []
+  policy.random = lambda: 1.0
+  policy.time = lambda: sum(policy.delays)
+  policy.sleep = policy.delays.append
+  return policy
+
+
+def error(status):
+  return exceptions.ConnectionError(httplib2.Response({'status': status}), '')
+
+
+class ScriptedHttp(object):
+  """Replies with a list of ``(status, content)`` pairs, in order."""
+
+  def __init__(self, *responses):
+    self.responses = list(responses)
+    self.requests = []
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    self.requests.append((method, headers))
+    status, content = self.responses.pop(0)
+    if isinstance(status, Exception):
+      raise status
+    response = httplib2.Response({'status': status,
+                                  'content-type': 'application/json'})
+    if 'Range' in (headers or {}) and status == 206:
+      response['content-range'] = 'bytes 0-%d/%d' % (len(content) - 1,
+                                                     len(content))
+    return response, content
+
+
+class TestRetryPolicy(unittest2.TestCase):
+
+  def test_delays(self):
+    policy = make_policy(initial_delay=1, max_delay=5, jitter=0)
+    self.assertEqual([1, 2, 4, 5, 5],
+                     [policy.get_delay(retry) for retry in range(1, 6)])
+
+    policy = make_policy(initial_delay=1, jitter=0.5)
+    self.assertEqual(0.5, policy.get_delay(1))
+
+  def test_retries_until_success(self):
+    results = [error(503), socket.error('reset'), 'done']
+
+    def attempt():
+      result = results.pop(0)
+      if isinstance(result, Exception):
+        raise result
+      return result
+
+    policy = make_policy(jitter=0)
+    self.assertEqual('done', policy.call(attempt))
+    self.assertEqual([1, 2], policy.delays)
+    self.assertEqual({'calls': 1, 'retries': 2, 'exhausted': 0},
+                     policy.get_stats())
+
+  def test_gives_up(self):
+    def attempt():
+      raise error(500)
+
+    policy = make_policy(max_attempts=3)
+    self.assertRaises(exceptions.ConnectionError, policy.call, attempt)
+    self.assertEqual({'calls': 1, 'retries': 2, 'exhausted': 1},
+                     policy.get_stats())
+
+    # A deadline stops retries that would wait past it.
+    policy = make_policy(max_attempts=10, initial_delay=2, jitter=0,
+                         deadline=5)
+    self.assertRaises(exceptions.ConnectionError, policy.call, attempt)
+    self.assertEqual([2], policy.delays)
+
+  def test_only_retries_retryable_errors(self):
+    policy = make_policy()
+    for exception in (error(403), ValueError('bad'), IOError('disk full'),
+                      exceptions.NotFoundError(httplib2.Response({}), '')):
+      def attempt():
+        raise exception
+      self.assertRaises(type(exception), policy.call, attempt)
+    self.assertEqual(0, policy.retries)
+
+
+class TestConnectionRetries(unittest2.TestCase):
+
+  def _make_connection(self, *responses):
+    self.http = ScriptedHttp(*responses)
+    self.policy = make_policy()
+    return Connection('project-name', http=self.http,
+                      retry_policy=self.policy)
+
+  def test_idempotent_api_requests(self):
+    connection = self._make_connection((503, ''), (200, '{"name": "b"}'))
+    self.assertEqual({'name': 'b'},
+                     connection.api_request(method='GET', path='/b/b'))
+    self.assertEqual(1, self.policy.retries)
+
+  def test_post_is_not_retried(self):
+    connection = self._make_connection((503, ''), (200, '{}'))
+    self.assertRaises(exceptions.ConnectionError, connection.api_request,
+                      method='POST', path='/b')
+    self.assertEqual(1, len(self.http.requests))
+
+  def test_download_chunks(self):
+    connection = self._make_connection((502, ''), (206, 'abc'))
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    self.assertEqual(['abc'], list(KeyDataIterator(key)))
+    self.assertEqual(1, self.policy.retries)
+
+    connection = self._make_connection((403, 'Forbidden'))
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    self.assertRaises(exceptions.ConnectionError, list, KeyDataIterator(key))
+
+
+class FlakyUploadHttp(object):
+  """A resumable upload session that keeps only part of a failed chunk."""
+
+  def __init__(self, keep_on_failure):
+    self.keep_on_failure = keep_on_failure
+    self.chunks = []
+    self.data = ''
+    self.failed = False
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    if 'uploadType=resumable' in uri:
+      return httplib2.Response({'status': 200, 'location': 'https://up/1'}), ''
+
+    if method == 'PUT':
+      self.chunks.append(('query', headers['Content-Range']))
+      response = {'status': 308}
+      if self.data:
+        response['range'] = 'bytes=0-%d' % (len(self.data) - 1)
+      return httplib2.Response(response), ''
+
+    body = str(bytearray(body))
+    self.chunks.append(('send', headers['Content-Range']))
+    if not self.failed:
+      self.failed = True
+      self.data += body[:self.keep_on_failure]
+      return httplib2.Response({'status': 503}), 'Service Unavailable'
+
+    self.data += body
+    if headers['Content-Range'].endswith('/*'):
+      return httplib2.Response({
+          'status': 308, 'range': 'bytes=0-%d' % (len(self.data) - 1)}), ''
+    return httplib2.Response({'status': 200}), json.dumps({'name': 'key'})
+
+
+class TestUploadRetries(unittest2.TestCase):
+
+  def _make_key(self, http):
+    self.policy = make_policy()
+    connection = Connection('project-name', http=http,
+                            retry_policy=self.policy)
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    key.CHUNK_SIZE = 4
+    return key
+
+  def test_resends_only_what_was_lost(self):
+    http = FlakyUploadHttp(keep_on_failure=2)
+    key = self._make_key(http)
+    key.set_contents_from_string('abcdefghij')
+
+    self.assertEqual('abcdefghij', http.data)
+    self.assertEqual([('send', 'bytes 0-3/10'), ('query', 'bytes */10'),
+                      ('send', 'bytes 2-3/10'), ('send', 'bytes 4-7/10'),
+                      ('send', 'bytes 8-9/10')], http.chunks)
+    self.assertEqual(1, self.policy.retries)
+    self.assertEqual('key', key.metadata['name'])
+
+  def test_streaming_upload(self):
+    http = FlakyUploadHttp(keep_on_failure=0)
+    key = self._make_key(http)
+    key.set_contents_from_stream(['abcde', 'f'])
+
+    self.assertEqual('abcdef', http.data)
+    self.assertEqual([('send', 'bytes 0-3/*'), ('query', 'bytes */*'),
+                      ('send', 'bytes 0-3/*'), ('send', 'bytes 4-5/6')],
+                     http.chunks)
@@ -0,0 +1,185 @@
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import unittest2
+
+from gcloud.storage import sync
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.connection import Connection
+from gcloud.storage.key import Key
+
+
+class MemoryConnection(Connection):
+  """Lists objects held in a dictionary of name -> (data, updated)."""
+
+  def __init__(self):
+    super(MemoryConnection, self).__init__('project-name')
+    self.objects = {}
+
+  def api_request(self, method, path=None, query_params=None, **kwargs):
+    prefix = query_params.get('prefix', '')
+    items = []
+    for name, (data, updated) in sorted(self.objects.items()):
+      if name.startswith(prefix):
+        items.append({
+            'name': name,
+            'size': str(len(data)),
+            'md5Hash': base64.b64encode(hashlib.md5(data).digest()),
+            'updated': time.strftime('%Y-%m-%dT%H:%M:%S.000Z',
+                                     time.gmtime(updated)),
+            })
+    return {'items': items}
+
+
+class MemoryKey(Key):
+
+  def set_contents_from_filename(self, filename):
+    with open(filename, 'rb') as fh:
+      self.connection.objects[self.name] = (fh.read(), time.time())
+
+  def get_contents_to_filename(self, filename):
+    with open(filename, 'wb') as fh:
+      fh.write(self.connection.objects[self.name][0])
+
+
+class MemoryBucket(Bucket):
+
+  def new_key(self, key):
+    return MemoryKey(bucket=self, name=key)
+
+  def iter_delete_keys(self, keys, num_workers=4):
+    for name in keys:
+      del self.connection.objects[name]
+      yield self.new_key(name), None
+
+
+class TestSync(unittest2.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.bucket = MemoryBucket(connection=MemoryConnection(), name='bucket')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _write(self, name, data, mtime=None):
+    path = os.path.join(self.directory, *name.split('/'))
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as fh:
+      fh.write(data)
+    if mtime is not None:
+      os.utime(path, (mtime, mtime))
+
+  def test_sync_to_bucket(self):
+    self._write('a.txt', 'a', mtime=1000)
+    self._write('dir/b.txt', 'bb', mtime=1000)
+
+    result = sync.sync_to_bucket(self.directory, self.bucket, prefix='www/')
+    self.assertEqual([u'a.txt', u'dir/b.txt'], result.transferred)
+    self.assertEqual(['www/a.txt', 'www/dir/b.txt'],
+                     sorted(self.bucket.connection.objects))
+
+    result = sync.sync_to_bucket(self.directory, self.bucket, prefix='www/')
+    self.assertEqual(([], 2), (result.transferred, result.unchanged))
+
+    self._write('dir/b.txt', 'bbb', mtime=1000)
+    os.remove(os.path.join(self.directory, 'a.txt'))
+    result = sync.sync_to_bucket(self.directory, self.bucket, prefix='www/',
+                                 delete=True)
+    self.assertEqual([u'dir/b.txt'], result.transferred)
+    self.assertEqual([u'a.txt'], result.deleted)
+    self.assertEqual({'www/dir/b.txt': 'bbb'},
+                     dict((name, data) for name, (data, _)
+                          in self.bucket.connection.objects.items()))
+
+  def test_sync_from_bucket(self):
+    now = int(time.time())
+    self.bucket.connection.objects.update({
+        'www/a.txt': ('a', now - 10),
+        'www/dir/b.txt': ('bb', now - 10),
+        'other/c.txt': ('c', now - 10),
+        })
+    self._write('extra.txt', 'x')
+
+    result = sync.sync_from_bucket(self.bucket, self.directory,
+                                   prefix='www/', delete=True)
+    self.assertEqual([u'a.txt', u'dir/b.txt'], result.transferred)
+    self.assertEqual([u'extra.txt'], result.deleted)
+    with open(os.path.join(self.directory, 'dir', 'b.txt')) as fh:
+      self.assertEqual('bb', fh.read())
+    self.assertEqual(now - 10,
+                     os.path.getmtime(os.path.join(self.directory, 'a.txt')))
+    self.assertEqual(['a.txt', 'dir'], sorted(os.listdir(self.directory)))
+
+    result = sync.sync_from_bucket(self.bucket, self.directory, prefix='www/')
+    self.assertEqual(([], 2), (result.transferred, result.unchanged))
+
+  def test_dry_run_leaves_the_directory_alone(self):
+    self.bucket.connection.objects['www/dir/a.txt'] = ('a', 1000)
+    target = os.path.join(self.directory, 'target')
+    result = sync.sync_from_bucket(self.bucket, target, prefix='www/',
+                                   dry_run=True)
+    self.assertEqual([u'dir/a.txt'], result.transferred)
+    self.assertFalse(os.path.exists(target))
+
+  def test_hostile_names_stay_in_directory(self):
+    outside = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, outside)
+    target = os.path.join(self.directory, 'target')
+    escape = os.path.relpath(outside, target).replace(os.sep, '/')
+    self.bucket.connection.objects.update({
+        'www/ok.txt': ('ok', 1000),
+        'www/../../%s/evil.txt' % escape: ('evil', 1000),
+        'www/a//b.txt': ('b', 1000),
+        })
+
+    result = sync.sync_from_bucket(self.bucket, target, prefix='www/',
+                                   delete=True)
+    self.assertEqual([u'ok.txt'], result.transferred)
+    self.assertEqual(2, len(result.errors))
+    self.assertTrue(all(isinstance(error, ValueError)
+                        for _, error in result.errors))
+    self.assertEqual([], os.listdir(outside))
+    self.assertEqual(['ok.txt'], os.listdir(target))
+
+  def test_get_local_path(self):
+    path = sync.get_local_path(self.directory, 'dir/a.txt')
+    self.assertEqual(os.path.join(self.directory, 'dir', 'a.txt'), path)
+    for name in ('../a.txt', 'dir/../../a.txt', 'dir//a.txt', './a.txt',
+                 'dir/'):
+      self.assertRaises(ValueError, sync.get_local_path, self.directory,
+                        name)
+
+    root = os.path.abspath(os.sep)
+    self.assertEqual(os.path.join(root, 'dir', 'a.txt'),
+                     sync.get_local_path(root, 'dir/a.txt'))
+    self.assertEqual(path, sync.get_local_path(self.directory + os.sep,
+                                               'dir/a.txt'))
+
+  def test_prefix_without_slash(self):
+    self.bucket.connection.objects.update({
+        'www/a.txt': ('a', 1000),
+        'wwwx/b.txt': ('b', 1000),
+        })
+    files = sync.get_remote_files(self.bucket, prefix='www')
+    self.assertEqual([u'a.txt'], files.keys())
+
+    self._write('c.txt', 'c')
+    sync.sync_to_bucket(self.directory, self.bucket, prefix='www')
+    self.assertTrue('www/c.txt' in self.bucket.connection.objects)
+
+  def test_checksum_catches_same_size_changes(self):
+    self._write('a.txt', 'a', mtime=1000)
+    sync.sync_to_bucket(self.directory, self.bucket)
+    self._write('a.txt', 'b', mtime=1000)
+
+    result = sync.sync_to_bucket(self.directory, self.bucket, dry_run=True)
+    self.assertEqual([], result.transferred)
+    result = sync.sync_to_bucket(self.directory, self.bucket, checksum=True)
+    self.assertEqual([u'a.txt'], result.transferred)
+    self.assertEqual('b', self.bucket.connection.objects['a.txt'][0])
@@ -0,0 +1,648 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import urlparse
+import zlib
+from StringIO import StringIO
+
+import httplib2
+import unittest2
+
+from gcloud.storage import exceptions
+from gcloud.storage._testing import RangeHttp
+from gcloud.storage.bucket import Bucket
+from gcloud.storage.connection import Connection
+from gcloud.storage.transfer import AdaptiveChunkSize
+from gcloud.storage.transfer import BufferReader
+from gcloud.storage.transfer import Checksum
+from gcloud.storage.transfer import Crc32c
+from gcloud.storage.transfer import ParallelDownload
+from gcloud.storage.transfer import ParallelUpload
+from gcloud.storage.transfer import ResumableUploadStateStore
+from gcloud.storage.transfer import get_file_fingerprint
+from gcloud.storage.transfer import iter_gunzip
+from gcloud.storage.transfer import iter_gzip
+
+
+class BrokenRangeHttp(RangeHttp):
+  """Answers the first range properly, then misbehaves."""
+
+  def __init__(self, data, later_status=206, truncate=0):
+    super(BrokenRangeHttp, self).__init__(data)
+    self.later_status = later_status
+    self.truncate = truncate
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    response, content = super(BrokenRangeHttp, self).request(
+        uri, method=method, body=body, headers=headers, **kwargs)
+    if headers['Range'].startswith('bytes=0-'):
+      return response, content
+    elif self.later_status == 200:
+      return httplib2.Response({'status': 200}), self.data
+    return response, content[:len(content) - self.truncate]
+
+
+class OverwrittenHttp(RangeHttp):
+  """Replaces the object with a new generation after the first range."""
+
+  def __init__(self, old_data, new_data):
+    super(OverwrittenHttp, self).__init__(old_data)
+    self.generations = {'1': old_data, '2': new_data}
+    self.generation = '1'
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    query = urlparse.parse_qs(urlparse.urlparse(uri).query)
+    generation = query.get('generation', [self.generation])[0]
+    self.data = self.generations[generation]
+    response, content = super(OverwrittenHttp, self).request(
+        uri, method=method, body=body, headers=headers, **kwargs)
+    response['x-goog-generation'] = generation
+    self.generation = '2'
+    return response, content
+
+
+class TestParallelDownload(unittest2.TestCase):
+
+  def _make_key(self, http):
+    connection = Connection('project-name', http=http)
+    return Bucket(connection=connection, name='bucket').new_key('key')
+
+  def test_download_in_ranges(self):
+    data = ''.join(chr(i % 256) for i in xrange(10000))
+    http = RangeHttp(data)
+    key = self._make_key(http)
+
+    fh = StringIO()
+    download = ParallelDownload(key, num_workers=3, chunk_size=1024)
+    self.assertEqual(len(data), download.download_to_file(fh))
+    self.assertEqual(data, fh.getvalue())
+    self.assertEqual(len(data), fh.tell())
+    self.assertEqual(10, len(http.ranges))
+    self.assertEqual((9216, 9999), max(http.ranges))
+
+  def test_writes_after_current_position(self):
+    http = RangeHttp('abcdefghij')
+    fh = StringIO()
+    fh.write('header:')
+    key = self._make_key(http)
+    key.get_contents_to_file(fh, num_workers=2)
+    self.assertEqual('header:abcdefghij', fh.getvalue())
+
+  def test_ranges_come_from_one_generation(self):
+    http = OverwrittenHttp('a' * 10, 'b' * 10)
+    fh = StringIO()
+    ParallelDownload(self._make_key(http), chunk_size=4).download_to_file(fh)
+    self.assertEqual('a' * 10, fh.getvalue())
+    self.assertEqual(3, len(http.ranges))
+
+  def test_range_ignored(self):
+    http = RangeHttp('abcdefghij', status=200)
+    fh = StringIO()
+    ParallelDownload(self._make_key(http), chunk_size=4).download_to_file(fh)
+    self.assertEqual('abcdefghij', fh.getvalue())
+    self.assertEqual(1, len(http.ranges))
+
+  def test_short_range(self):
+    download = ParallelDownload(
+        self._make_key(BrokenRangeHttp('abcdefghij', truncate=1)),
+        chunk_size=4)
+    self.assertRaises(exceptions.StorageDataError, download.download_to_file,
+                      StringIO())
+
+  def test_range_ignored_past_the_first(self):
+    download = ParallelDownload(
+        self._make_key(BrokenRangeHttp('abcdefghij', later_status=200)),
+        chunk_size=4)
+    self.assertRaises(exceptions.ConnectionError, download.download_to_file,
+                      StringIO())
+
+  def test_empty_object(self):
+    fh = StringIO()
+    download = ParallelDownload(self._make_key(RangeHttp('', status=416)))
+    self.assertEqual(0, download.download_to_file(fh))
+    self.assertEqual('', fh.getvalue())
+
+  def test_not_found(self):
+    http = RangeHttp('', status=404)
+    download = ParallelDownload(self._make_key(http))
+    self.assertRaises(exceptions.NotFoundError, download.download_to_file,
+                      StringIO())
+
+
+class UploadHttp(object):
+  """Fakes resumable uploads, compose and delete, from any thread."""
+
+  def __init__(self):
+    self.objects = {}
+    self.deleted = []
+    self.composed = []
+    self.delete_status = 204
+    self.compose_status = 200
+    self._sessions = {}
+    self._lock = threading.Lock()
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    with self._lock:
+      if 'uploadType=resumable' in uri:
+        name = re.search(r'name=([^&]+)', uri).group(1)
+        location = 'https://upload/%d' % len(self._sessions)
+        self._sessions[location] = name
+        self.objects[name] = ''
+        return httplib2.Response({'status': 200, 'location': location}), ''
+
+      if uri in self._sessions:
+        self.objects[self._sessions[uri]] += str(bytearray(body))
+        return httplib2.Response({'status': 200}), ''
+
+      name = re.search(r'/o/([^/?]+)', uri).group(1)
+      if method == 'DELETE':
+        self.deleted.append(name)
+        if self.delete_status != 204:
+          return httplib2.Response({'status': self.delete_status}), 'Delete'
+        del self.objects[name]
+        return httplib2.Response({'status': 204}), ''
+      elif self.compose_status != 200:
+        return httplib2.Response({'status': self.compose_status}), 'Compose'
+
+      sources = [source['name']
+                 for source in json.loads(body)['sourceObjects']]
+      self.composed.append(sources)
+      self.objects[name] = ''.join(self.objects[source] for source in sources)
+      response = httplib2.Response({'status': 200,
+                                    'content-type': 'application/json'})
+      return response, json.dumps({'name': name})
+
+
+class TestParallelUpload(unittest2.TestCase):
+
+  def _make_key(self, http):
+    connection = Connection('project-name', http=http)
+    return Bucket(connection=connection, name='bucket').new_key('key')
+
+  def test_upload_in_parts(self):
+    http = UploadHttp()
+    key = self._make_key(http)
+    data = 'abcdefghijklmnopqrstuvwxyz'
+
+    key.set_contents_from_file(StringIO(data), size=len(data),
+                               num_workers=3, part_size=10)
+    self.assertEqual({'key': data}, http.objects)
+    self.assertEqual({'name': 'key'}, key.metadata)
+    self.assertEqual(1, len(http.composed))
+    self.assertEqual(3, len(http.composed[0]))
+    self.assertEqual(sorted(http.composed[0]), sorted(http.deleted))
+
+  def test_compose_in_rounds(self):
+    http = UploadHttp()
+    key = self._make_key(http)
+    data = 'abcdefghijklmnopqrstuvwxyz'
+
+    upload = ParallelUpload(key, num_workers=4, part_size=2)
+    upload.MAX_COMPOSE_SOURCES = 4
+    upload.upload_from_file(StringIO(data), len(data))
+    self.assertEqual({'key': data}, http.objects)
+    self.assertTrue(all(len(sources) <= 4 for sources in http.composed))
+
+  def test_failed_cleanup_is_not_raised(self):
+    http = UploadHttp()
+    http.delete_status = 403
+    key = self._make_key(http)
+    data = 'abcdefghijklmnopqrstuvwxyz'
+
+    key.set_contents_from_file(StringIO(data), size=len(data),
+                               num_workers=3, part_size=10)
+    self.assertEqual(data, http.objects['key'])
+    # Every part was still tried.
+    self.assertEqual(sorted(http.composed[0]), sorted(http.deleted))
+
+    http.compose_status = 400
+    with self.assertRaises(exceptions.ConnectionError) as context:
+      key.set_contents_from_file(StringIO(data), size=len(data),
+                                 num_workers=3, part_size=10)
+    self.assertEqual('Compose', context.exception.content)
+
+  def test_small_files_use_a_single_upload(self):
+    http = UploadHttp()
+    key = self._make_key(http)
+    key.set_contents_from_file(StringIO('abc'), size=3, num_workers=3,
+                               part_size=10)
+    self.assertEqual({'key': 'abc'}, http.objects)
+    self.assertEqual([], http.composed)
+
+
+class ResumableHttp(object):
+  """Fakes a single resumable upload session that can be interrupted."""
+
+  def __init__(self, fail_after_chunks=None, md5_hash=None, max_commit=None):
+    self.fail_after_chunks = fail_after_chunks
+    self.md5_hash = md5_hash
+    self.max_commit = max_commit
+    self.sessions_started = 0
+    self.chunks = []
+    self.data = ''
+    self.start_headers = None
+    self.start_body = None
+    self.finished = False
+
+  def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+    if 'uploadType=resumable' in uri:
+      self.sessions_started += 1
+      self.start_headers = headers
+      self.start_body = body
+      self.data = ''
+      self.finished = False
+      return httplib2.Response({'status': 200, 'location': 'https://up/1'}), ''
+
+    if method == 'PUT':
+      if self.finished:
+        return self._complete()
+      return self._incomplete()
+
+    if len(self.chunks) == self.fail_after_chunks:
+      raise IOError('Connection reset.')
+    self.chunks.append(headers['Content-Range'])
+    body = str(bytearray(body or ''))
+    if self.max_commit is not None and len(body) > self.max_commit:
+      # Keep only part of the chunk, as a server may.
+      self.data += body[:self.max_commit]
+      return self._incomplete()
+    self.data += body
+
+    if not headers['Content-Range'].endswith(('-%d/%d' % (
+        len(self.data) - 1, len(self.data)), '*/%d' % len(self.data))):
+      return self._incomplete()
+
+    self.finished = True
+    return self._complete()
+
+  def _complete(self):
+    md5_hash = (self.md5_hash or
+                base64.b64encode(hashlib.md5(self.data).digest()))
+    metadata = {'name': 'key', 'md5Hash': md5_hash}
+    return httplib2.Response({'status': 200}), json.dumps(metadata)
+
+  def _incomplete(self):
+    # 308 "Resume Incomplete", with the range committed so far.
+    response = {'status': 308}
+    if self.data:
+      response['range'] = 'bytes=0-%d' % (len(self.data) - 1)
+    return httplib2.Response(response), ''
+
+
+class TestResumableUpload(unittest2.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.tempdir, 'data')
+    with open(self.filename, 'wb') as fh:
+      fh.write('abcdefghij')
+    self.store = ResumableUploadStateStore(
+        os.path.join(self.tempdir, 'state.json'))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _make_key(self, http):
+    connection = Connection('project-name', http=http)
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    key.CHUNK_SIZE = 4
+    return key
+
+  def test_resume_after_failure(self):
+    http = ResumableHttp(fail_after_chunks=2)
+    key = self._make_key(http)
+    self.assertRaises(IOError, key.set_contents_from_filename, self.filename,
+                      resume_store=self.store)
+
+    with open(self.filename, 'rb') as fh:
+      fingerprint = get_file_fingerprint(fh)
+    state = self.store.get(key, fingerprint)
+    self.assertEqual({'fingerprint': fingerprint, 'upload_url': 'https://up/1',
+                      'offset': 8}, state)
+
+    http.fail_after_chunks = None
+    key.set_contents_from_filename(self.filename, resume_store=self.store)
+    self.assertEqual(1, http.sessions_started)
+    self.assertEqual('abcdefghij', http.data)
+    self.assertEqual('bytes 8-9/10', http.chunks[-1])
+    self.assertEqual(None, self.store.get(key, fingerprint))
+
+  def test_resume_finished_session(self):
+    http = ResumableHttp()
+    key = self._make_key(http)
+    key.set_contents_from_filename(self.filename)
+
+    # The upload finished, but we never heard back about the last chunk.
+    with open(self.filename, 'rb') as fh:
+      fingerprint = get_file_fingerprint(fh)
+    self.store.set(key, fingerprint, 'https://up/1', 8)
+    key.metadata = {}
+    key.set_contents_from_filename(self.filename, resume_store=self.store,
+                                   checksum='md5')
+    self.assertEqual(1, http.sessions_started)
+    self.assertEqual(3, len(http.chunks))
+    self.assertEqual('key', key.metadata['name'])
+
+    # The whole file is still checked against the object.
+    self.store.set(key, fingerprint, 'https://up/1', 8)
+    http.md5_hash = 'bad'
+    self.assertRaises(exceptions.StorageDataError,
+                      key.set_contents_from_filename, self.filename,
+                      resume_store=self.store, checksum='md5')
+
+  def test_changed_file_starts_over(self):
+    http = ResumableHttp(fail_after_chunks=1)
+    key = self._make_key(http)
+    self.assertRaises(IOError, key.set_contents_from_filename, self.filename,
+                      resume_store=self.store)
+
+    with open(self.filename, 'ab') as fh:
+      fh.write('klm')
+
+    http.fail_after_chunks = None
+    key.set_contents_from_filename(self.filename, resume_store=self.store)
+    self.assertEqual(2, http.sessions_started)
+    self.assertEqual('abcdefghijklm', http.data)
+
+  def test_without_store(self):
+    http = ResumableHttp()
+    key = self._make_key(http)
+    key.set_contents_from_file(StringIO('abcdef'), size=6)
+    self.assertEqual(['bytes 0-3/6', 'bytes 4-5/6'], http.chunks)
+
+  def test_partially_committed_chunks(self):
+    http = ResumableHttp(max_commit=3)
+    key = self._make_key(http)
+    key.set_contents_from_file(StringIO('abcdef'), size=6)
+    self.assertEqual('abcdef', http.data)
+    self.assertEqual(['bytes 0-3/6', 'bytes 3-3/6', 'bytes 4-5/6'],
+                     http.chunks)
+
+  def test_short_file(self):
+    key = self._make_key(ResumableHttp())
+    self.assertRaises(exceptions.StorageDataError, key.set_contents_from_file,
+                      StringIO('abcdef'), size=10)
+
+  def test_store_writes_its_own_temporary_file(self):
+    key = self._make_key(ResumableHttp())
+    self.store.set(key, 'fingerprint', 'https://up/1', 4)
+    other = ResumableUploadStateStore(self.store.filename)
+    other.set(key, 'fingerprint', 'https://up/1', 8)
+    self.assertEqual(['data', 'state.json'], sorted(os.listdir(self.tempdir)))
+    self.assertEqual(8, self.store.get(key, 'fingerprint')['offset'])
+
+
+class TestStreamingUpload(unittest2.TestCase):
+
+  def _make_key(self, http):
+    connection = Connection('project-name', http=http)
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    key.CHUNK_SIZE = 4
+    return key
+
+  def test_generator(self):
+    http = ResumableHttp()
+    key = self._make_key(http)
+    key.set_contents_from_stream(iter(['ab', 'cdefg', '', 'h', 'ijk']),
+                                 checksum='md5')
+
+    self.assertEqual('abcdefghijk', http.data)
+    self.assertEqual(['bytes 0-3/*', 'bytes 4-7/*', 'bytes 8-10/11'],
+                     http.chunks)
+    self.assertNotIn('X-Upload-Content-Length', http.start_headers)
+    self.assertEqual('key', key.metadata['name'])
+
+  def test_exact_chunks(self):
+    http = ResumableHttp()
+    key = self._make_key(http)
+    key.set_contents_from_stream(['abcd', 'efgh'])
+    self.assertEqual(['bytes 0-3/*', 'bytes 4-7/8'], http.chunks)
+
+  def test_empty(self):
+    http = ResumableHttp()
+    key = self._make_key(http)
+    key.set_contents_from_stream([])
+    self.assertEqual(['bytes */0'], http.chunks)
+
+  def test_checksum_mismatch(self):
+    http = ResumableHttp(md5_hash='bad')
+    key = self._make_key(http)
+    self.assertRaises(exceptions.StorageDataError,
+                      key.set_contents_from_stream, ['abc'], checksum='md5')
+
+  def test_pipe(self):
+    read_fd, write_fd = os.pipe()
+
+    def write():
+      with os.fdopen(write_fd, 'wb') as fh:
+        for _ in xrange(3):
+          fh.write('abc')
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    http = ResumableHttp()
+    key = self._make_key(http)
+    with os.fdopen(read_fd, 'rb') as fh:
+      key.set_contents_from_file(fh)
+    writer.join()
+
+    self.assertEqual('abcabcabc', http.data)
+    self.assertEqual('bytes 8-8/9', http.chunks[-1])
+
+  def test_pipe_cannot_be_split_or_resumed(self):
+    read_fd, write_fd = os.pipe()
+    os.close(write_fd)
+    key = self._make_key(ResumableHttp())
+    store = ResumableUploadStateStore(os.devnull)
+    with os.fdopen(read_fd, 'rb') as fh:
+      for kwargs in ({'num_workers': 2}, {'part_size': 1024},
+                     {'resume_store': store}):
+        self.assertRaises(ValueError, key.set_contents_from_file, fh,
+                          **kwargs)
+
+
+class TestGzip(unittest2.TestCase):
+
+  def test_round_trip(self):
+    data = ''.join('line %d\n' % i for i in xrange(1000))
+    chunks = [data[i:i + 100] for i in xrange(0, len(data), 100)]
+    compressed = ''.join(iter_gzip(chunks))
+    self.assertEqual(data, zlib.decompress(compressed, 16 + zlib.MAX_WBITS))
+
+    pieces = list(iter_gunzip([compressed[:10], compressed[10:]], 64))
+    self.assertEqual(data, ''.join(pieces))
+    self.assertTrue(max(len(piece) for piece in pieces) <= 64)
+
+  def test_invalid_data(self):
+    self.assertRaises(exceptions.StorageDataError, list,
+                      iter_gunzip(['not gzip'], 64))
+
+  def _make_key(self, http):
+    connection = Connection('project-name', http=http)
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    key.CHUNK_SIZE = 64
+    return key
+
+  def test_compressed_upload(self):
+    data = 'log line\n' * 1000
+    http = ResumableHttp()
+    key = self._make_key(http)
+    key.set_contents_from_string(data, gzip=True)
+
+    self.assertEqual(data, zlib.decompress(http.data, 16 + zlib.MAX_WBITS))
+    self.assertTrue(len(http.data) < len(data) / 10)
+    self.assertEqual({'contentEncoding': 'gzip'}, json.loads(http.start_body))
+    self.assertNotIn('X-Upload-Content-Length', http.start_headers)
+    self.assertTrue(http.chunks[0].endswith('/*'))
+
+  def test_compressed_upload_from_file(self):
+    http = ResumableHttp()
+    key = self._make_key(http)
+    fh = StringIO('skip me|upload me|and not me')
+    fh.seek(8)
+    key.set_contents_from_file(fh, size=9, gzip=True, checksum='md5')
+    self.assertEqual('upload me',
+                     zlib.decompress(http.data, 16 + zlib.MAX_WBITS))
+
+  def test_compressed_upload_cannot_be_split(self):
+    key = self._make_key(ResumableHttp())
+    self.assertRaises(ValueError, key.set_contents_from_file, StringIO('a'),
+                      num_workers=2, gzip=True)
+
+
+class TestAdaptiveChunkSize(unittest2.TestCase):
+
+  KB = 1024
+  MB = 1024 * 1024
+
+  def test_grows_on_fast_links(self):
+    stats = []
+    sizer = AdaptiveChunkSize(initial=self.MB, maximum=8 * self.MB,
+                              target_seconds=1.0, stats_hook=stats.append)
+    self.assertEqual(2 * self.MB, sizer.record(self.MB, 0.01))
+    self.assertEqual(4 * self.MB, sizer.record(2 * self.MB, 0.01))
+    self.assertEqual(8 * self.MB, sizer.record(4 * self.MB, 0.01))
+    self.assertEqual(8 * self.MB, sizer.record(8 * self.MB, 0.01))
+    self.assertEqual(4, len(stats))
+    self.assertEqual(8 * self.MB, stats[-1]['chunk_size'])
+
+  def test_shrinks_on_slow_links(self):
+    sizer = AdaptiveChunkSize(initial=4 * self.MB, target_seconds=1.0)
+    self.assertEqual(2 * self.MB, sizer.record(4 * self.MB, 100))
+    self.assertEqual(self.MB, sizer.record(2 * self.MB, 100))
+
+  def test_sizes_stay_on_256kb_multiples(self):
+    sizer = AdaptiveChunkSize(initial=self.MB, target_seconds=1.0)
+    sizer.record(self.MB, 1.0 / 1.3)
+    self.assertEqual(0, sizer.size % (256 * self.KB))
+    self.assertEqual(1280 * self.KB, sizer.size)
+
+  def test_short_chunks_are_ignored(self):
+    sizer = AdaptiveChunkSize(initial=self.MB)
+    self.assertEqual(self.MB, sizer.record(10, 100))
+    self.assertEqual(None, sizer.throughput)
+
+  def test_bounds_must_be_256kb_multiples(self):
+    self.assertRaises(ValueError, AdaptiveChunkSize, minimum=1000)
+
+  def test_upload_uses_chunk_sizes(self):
+    http = ResumableHttp()
+    connection = Connection('project-name', http=http)
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    sizer = AdaptiveChunkSize(initial=256 * self.KB)
+    data = 'x' * (self.MB + 10)
+
+    key.set_contents_from_file(StringIO(data), size=len(data),
+                               chunk_sizer=sizer)
+    self.assertEqual(data, http.data)
+    self.assertEqual('bytes 0-262143/1048586', http.chunks[0])
+    self.assertEqual('bytes 262144-786431/1048586', http.chunks[1])
+
+
+class TestBufferReader(unittest2.TestCase):
+
+  def test_reads_slices_without_copying(self):
+    data = bytearray('abcdefghij')
+    reader = BufferReader(data)
+    chunk = reader.read(4)
+    self.assertTrue(isinstance(chunk, memoryview))
+    data[0:4] = 'ABCD'
+    self.assertEqual('ABCD', chunk.tobytes())
+    self.assertEqual('efghij', reader.read().tobytes())
+    self.assertEqual(0, len(reader.read(4)))
+
+  def test_seek(self):
+    reader = BufferReader('abcdefghij')
+    reader.seek(-3, os.SEEK_END)
+    self.assertEqual(7, reader.tell())
+    self.assertEqual('hij', reader.read(10).tobytes())
+
+  def test_upload_from_mapped_file(self):
+    tempdir = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(tempdir, 'data')
+      with open(filename, 'wb') as fh:
+        fh.write('abcdefghij')
+
+      http = ResumableHttp()
+      connection = Connection('project-name', http=http)
+      key = Bucket(connection=connection, name='bucket').new_key('key')
+      key.CHUNK_SIZE = 4
+      key.set_contents_from_filename(filename)
+      self.assertEqual('abcdefghij', http.data)
+      self.assertEqual(3, len(http.chunks))
+    finally:
+      shutil.rmtree(tempdir)
+
+  def test_upload_from_buffer(self):
+    http = ResumableHttp()
+    connection = Connection('project-name', http=http)
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    key.set_contents_from_buffer(bytearray('abcdef'))
+    key.set_contents_from_string(u'caf\xe9')
+    self.assertEqual('caf\xc3\xa9', http.data)
+
+
+class TestChecksum(unittest2.TestCase):
+
+  def test_crc32c(self):
+    crc = Crc32c()
+    crc.update('1234')
+    crc.update(memoryview('56789'))
+    self.assertEqual('\xe3\x06\x92\x83', crc.digest())
+
+  def test_md5(self):
+    checksum = Checksum('md5')
+    checksum.update('abc')
+    self.assertEqual('kAFQmDzST7DWlj99KOF/cg==', checksum.b64digest())
+
+  def test_expected_from_header(self):
+    checksum = Checksum('crc32c')
+    response = {'x-goog-hash': 'crc32c=n03x6A==, md5=Ojk9c3dhfxgoKVVHYwFbHQ=='}
+    self.assertEqual('n03x6A==', checksum.get_expected(
+        response=response, metadata={'crc32c': 'other'}))
+    self.assertEqual('other', checksum.get_expected(
+        metadata={'crc32c': 'other'}))
+
+  def test_verify(self):
+    checksum = Checksum('md5')
+    checksum.update('abc')
+    checksum.verify(None)
+    checksum.verify('kAFQmDzST7DWlj99KOF/cg==')
+    self.assertRaises(exceptions.StorageDataError, checksum.verify, 'nope')
+
+  def test_upload_verifies_md5(self):
+    http = ResumableHttp()
+    connection = Connection('project-name', http=http)
+    key = Bucket(connection=connection, name='bucket').new_key('key')
+    key.set_contents_from_file(StringIO('abc'), size=3, checksum='md5')
+    self.assertEqual('kAFQmDzST7DWlj99KOF/cg==', key.metadata['md5Hash'])
+
+    http.md5_hash = 'corrupted'
+    self.assertRaises(exceptions.StorageDataError, key.set_contents_from_file,
+                      StringIO('abc'), size=3, checksum='md5')
@@ -0,0 +1,47 @@
+import threading
+
+import unittest2
+
+from gcloud.storage import workers
+
+
+class TestWorkers(unittest2.TestCase):
+
+  def test_imap_unordered(self):
+    results = workers.imap_unordered(lambda x: x * 2, xrange(10), 3)
+    self.assertEqual(range(0, 20, 2), sorted(results))
+
+  def test_imap_unordered_reads_ahead_a_little(self):
+    read = []
+    release = threading.Event()
+
+    def items():
+      for i in xrange(100):
+        read.append(i)
+        yield i
+
+    def work(item):
+      release.wait()
+      return item
+
+    results = workers.imap_unordered(work, items(), 2, max_pending=4)
+    first = []
+    thread = threading.Thread(target=lambda: first.append(next(results)))
+    thread.start()
+    thread.join(0.1)
+    self.assertEqual(range(4), read)
+
+    release.set()
+    thread.join(1)
+    self.assertEqual(range(100), sorted(first + list(results)))
+
+  def test_imap_unordered_reraises(self):
+    def work(item):
+      raise KeyError(item)
+
+    results = workers.imap_unordered(work, [1], 1)
+    self.assertRaises(KeyError, list, results)
+
+  def test_iter_groups(self):
+    self.assertEqual([[0, 1, 2], [3, 4]],
+                     list(workers.iter_groups(xrange(5), 3)))
@@ -0,0 +1,1307 @@
+"""Engines for moving large amounts of data in and out of Cloud Storage.
+
+The simple transfer methods on :class:`gcloud.storage.key.Key`
+move data one chunk at a time, waiting for each round trip.
+The classes here spread a single transfer
+over a pool of worker threads.
+
+You shouldn't have to use these directly,
+instead pass ``num_workers`` to methods like
+:func:`gcloud.storage.key.Key.get_contents_to_file`
+and :func:`gcloud.storage.key.Key.set_contents_from_file`.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import mmap
+import os
+import stat
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from gcloud.storage import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+
+def _make_crc32c_table():
+  table = []
+  for byte in xrange(256):
+    crc = byte
+    for _ in xrange(8):
+      if crc & 1:
+        crc = (crc >> 1) ^ 0x82F63B78
+      else:
+        crc >>= 1
+    table.append(crc)
+  return table
+
+
+class Crc32c(object):
+  """A pure Python CRC32C (Castagnoli) hash with a :mod:`hashlib` interface.
+
+  This is only used when the much faster ``crcmod`` package
+  (with its C extension) isn't installed.
+  """
+
+  _TABLE = _make_crc32c_table()
+
+  def __init__(self):
+    self.crc = 0xffffffff
+
+  def update(self, data):
+    crc = self.crc
+    table = self._TABLE
+    for byte in bytearray(data):
+      crc = table[(crc ^ byte) & 0xff] ^ (crc >> 8)
+    self.crc = crc
+
+  def digest(self):
+    return struct.pack('>I', self.crc ^ 0xffffffff)
+
+
+class Checksum(object):
+  """A checksum computed as data passes through a transfer.
+
+  Feed every chunk to :func:`Checksum.update` as it is sent or received,
+  then call :func:`Checksum.verify` with what Cloud Storage reports
+  once the transfer is done.
+  No second pass over the data is needed.
+
+  :type algorithm: string
+  :param algorithm: Either ``'md5'`` or ``'crc32c'``.
+  """
+
+  METADATA_FIELDS = {'md5': 'md5Hash', 'crc32c': 'crc32c'}
+  """The object metadata field holding each checksum."""
+
+  def __init__(self, algorithm='md5'):
+    if algorithm not in self.METADATA_FIELDS:
+      raise ValueError('Unknown checksum algorithm: %s' % algorithm)
+
+    self.algorithm = algorithm
+    if algorithm == 'md5':
+      self._hash = hashlib.md5()
+    else:
+      try:
+        from crcmod.predefined import Crc
+        self._hash = Crc('crc-32c')
+      except ImportError:
+        self._hash = Crc32c()
+
+  def update(self, data):
+    self._hash.update(data)
+
+  def b64digest(self):
+    """The checksum in the (base64) format used by Cloud Storage.
+
+    :rtype: string
+    :returns: The base64 encoded digest.
+    """
+
+    return base64.b64encode(self._hash.digest())
+
+  def get_expected(self, response=None, metadata=None):
+    """Find the checksum Cloud Storage reports for an object.
+
+    Media downloads report it in the ``x-goog-hash`` header
+    (ie, ``crc32c=n03x6A==,md5=Ojk9c3dhfxgoKVVHYwFbHQ==``),
+    otherwise it comes from the object's metadata.
+
+    :type response: dict
+    :param response: (optional) The headers of a response.
+
+    :type metadata: dict
+    :param metadata: (optional) The object's metadata.
+
+    :rtype: string or None
+    :returns: The base64 encoded digest, or None if it isn't known.
+    """
+
+    for value in (response or {}).get('x-goog-hash', '').split(','):
+      algorithm, _, digest = value.strip().partition('=')
+      if algorithm == self.algorithm:
+        return digest
+
+    return (metadata or {}).get(self.METADATA_FIELDS[self.algorithm])
+
+  def verify(self, expected):
+    """Make sure the computed checksum matches what was expected.
+
+    :type expected: string or None
+    :param expected: The base64 encoded digest reported by Cloud Storage.
+                     If None, there is nothing to check against.
+
+    :raises: :class:`gcloud.storage.exceptions.StorageDataError`
+    """
+
+    if expected is not None and expected != self.b64digest():
+      raise exceptions.StorageDataError(
+          '%s mismatch: expected %s, got %s.' % (
+              self.algorithm, expected, self.b64digest()))
+
+
+class ParallelDownload(object):
+  """Downloads a key by fetching several byte ranges at once.
+
+  The first range request tells us the total size of the object
+  (from the ``content-range`` header).
+  The rest of the object is then split into ``chunk_size`` ranges
+  which are fetched by a pool of ``num_workers`` threads.
+  Each range is written at its own offset in the file handle,
+  so ranges can finish in any order.
+  Every range after the first asks for the generation
+the first one came from,
+so an object overwritten mid-download isn't stitched together
+from two different versions.
+
+  :type key: :class:`gcloud.storage.key.Key`
+  :param key: The key to download.
+
+  :type num_workers: int
+  :param num_workers: The number of ranges to fetch at the same time.
+
+  :type chunk_size: int
+  :param chunk_size: The size of each range.
+                     Defaults to :attr:`gcloud.storage.key.Key.CHUNK_SIZE`.
+
+  :type generation: int or string
+  :param generation: (optional) Download this generation of the object.
+                     Defaults to the one the first range comes from.
+  """
+
+  def __init__(self, key, num_workers=4, chunk_size=None, generation=None):
+    self.key = key
+    self.num_workers = num_workers
+    self.chunk_size = chunk_size or key.CHUNK_SIZE
+    self.generation = generation
+    self._write_lock = threading.Lock()
+
+  def get_url(self):
+    return self.key.get_media_url(generation=self.generation)
+
+  def get_range(self, start, end):
+    """Fetch a single (inclusive) byte range of the key's data.
+
+    :type start: int
+    :param start: The offset of the first byte to fetch.
+
+    :type end: int
+    :param end: The offset of the last byte to fetch.
+
+    :rtype: tuple of ``content`` (a string) and ``total_bytes`` (an int)
+    :returns: The data in the range and the total size of the object.
+    :raises: :class:`gcloud.storage.exceptions.NotFoundError`,
+             :class:`gcloud.storage.exceptions.StorageDataError`
+             if the server sent less (or more) than the range.
+    """
+
+    headers = {'Range': 'bytes=%d-%d' % (start, end)}
+    response, content = self.key.connection.make_retried_request(
+        method='GET', url=self.get_url(), headers=headers)
+
+    if start == 0 and self.generation is None:
+      # The first range is fetched alone, before any of the others.
+      self.generation = response.get('x-goog-generation')
+
+    content_range = response.get('content-range')
+    if response.status == 404:
+      raise exceptions.NotFoundError(response, content)
+    elif (response.status == 416 and start == 0 and
+          (content_range or 'bytes */0').endswith('/0')):
+      # An empty object has no first byte to send.
+      return '', 0
+    elif response.status == 200 and start == 0:
+      # The server ignored the Range header and sent everything.
+      return content, len(content)
+    elif response.status != 206 or not content_range:
+      # A 200 past the first range would be the whole object,
+      # which doesn't belong at this offset.
+      raise exceptions.ConnectionError(response, content)
+
+    total_bytes = int(content_range.rsplit('/', 1)[1])
+    expected = min(end, total_bytes - 1) - start + 1
+    if len(content) != expected:
+      raise exceptions.StorageDataError(
+          'Expected %d bytes at offset %d, got %d.' % (
+              expected, start, len(content)))
+    return content, total_bytes
+
+  def get_ranges(self, start, total_bytes):
+    """Split the bytes from ``start`` to the end of the object into ranges.
+
+    :rtype: generator of tuples of ``(start, end)``
+    :returns: Inclusive byte ranges of at most ``chunk_size`` bytes.
+    """
+
+    for offset in xrange(start, total_bytes, self.chunk_size):
+      yield offset, min(offset + self.chunk_size, total_bytes) - 1
+
+  def write_at(self, fh, offset, data):
+    """Write data at a particular offset of a (shared) file handle."""
+
+    with self._write_lock:
+      fh.seek(offset)
+      fh.write(data)
+
+  def download_to_file(self, fh):
+    """Download the key's data into a file handle.
+
+    Data is written starting at the current position of ``fh``,
+    which is left at the end of the written data.
+
+    :type fh: file
+    :param fh: A seekable file handle to which to write the key's data.
+
+    :rtype: int
+    :returns: The number of bytes downloaded.
+    :raises: :class:`gcloud.storage.exceptions.NotFoundError`
+    """
+
+    base = fh.tell()
+    content, total_bytes = self.get_range(0, self.chunk_size - 1)
+    self.write_at(fh, base, content)
+
+    def fetch(byte_range):
+      start, end = byte_range
+      content, _ = self.get_range(start, end)
+      self.write_at(fh, base + start, content)
+
+    if len(content) < total_bytes:
+      pool = ThreadPool(self.num_workers)
+      try:
+        for _ in pool.imap_unordered(
+            fetch, self.get_ranges(len(content), total_bytes)):
+          pass
+      finally:
+        pool.terminate()
+        pool.join()
+
+    fh.seek(base + total_bytes)
+    return total_bytes
+
+
+class AdaptiveChunkSize(object):
+  """Picks transfer chunk sizes from the measured throughput.
+
+  A fixed chunk size is either too small to fill a fast link
+  or too big to retry cheaply on a slow one.
+  This aims for each request to take about ``target_seconds``:
+  after every chunk, the observed bytes per second
+  (smoothed over recent chunks)
+  decide the size of the next one.
+  Sizes always stay on 256 KB multiples
+  (as the API requires for resumable uploads),
+  never more than double or halve in one step,
+  and stay between ``minimum`` and ``maximum``.
+
+  Pass one to :func:`gcloud.storage.key.Key.set_contents_from_file`
+  or :func:`gcloud.storage.key.Key.get_contents_to_file`::
+
+    >>> sizer = AdaptiveChunkSize(maximum=64 * 1024 * 1024)
+    >>> key.set_contents_from_filename('big.tar', chunk_sizer=sizer)
+
+  :type initial: int
+  :param initial: The size of the first chunk.
+
+  :type minimum: int
+  :param minimum: The smallest chunk size to use.
+
+  :type maximum: int
+  :param maximum: The largest chunk size to use.
+
+  :type target_seconds: float
+  :param target_seconds: How long each request should take.
+
+  :type stats_hook: callable
+  :param stats_hook: (optional) Called after every chunk
+                     with a dictionary holding the ``bytes`` transferred,
+                     the ``seconds`` taken, the smoothed ``throughput``
+                     (in bytes per second) and the next ``chunk_size``.
+  """
+
+  GRANULARITY = 256 * 1024  # 256 KB.
+  """Every chunk size is a multiple of this (256 KB)."""
+
+  SMOOTHING = 0.5
+  """The weight given to the newest throughput measurement."""
+
+  def __init__(self, initial=1024 * 1024, minimum=GRANULARITY,
+               maximum=32 * 1024 * 1024, target_seconds=2.0,
+               stats_hook=None):
+    if minimum % self.GRANULARITY or maximum % self.GRANULARITY:
+      raise ValueError('Chunk size bounds must be multiples of 256 KB.')
+    if not 0 < minimum <= maximum:
+      raise ValueError('Expected 0 < minimum <= maximum.')
+
+    self.minimum = minimum
+    self.maximum = maximum
+    self.target_seconds = target_seconds
+    self.stats_hook = stats_hook
+    self.throughput = None
+    self.size = self._clamp(initial)
+
+  def _clamp(self, size):
+    size -= size % self.GRANULARITY
+    return max(self.minimum, min(self.maximum, size))
+
+  def record(self, num_bytes, seconds):
+    """Record how long a chunk took and pick the next chunk size.
+
+    :type num_bytes: int
+    :param num_bytes: The number of bytes transferred.
+
+    :type seconds: float
+    :param seconds: How long the transfer took.
+
+    :rtype: int
+    :returns: The size to use for the next chunk.
+    """
+
+    # A short final chunk tells us nothing about the link.
+    if num_bytes < self.size or seconds <= 0:
+      return self.size
+
+    measured = num_bytes / float(seconds)
+    if self.throughput is None:
+      self.throughput = measured
+    else:
+      self.throughput = (self.SMOOTHING * measured +
+                         (1 - self.SMOOTHING) * self.throughput)
+
+    wanted = int(self.throughput * self.target_seconds)
+    wanted = max(self.size // 2, min(self.size * 2, wanted))
+    self.size = self._clamp(wanted)
+
+    if self.stats_hook:
+      self.stats_hook({
+          'bytes': num_bytes,
+          'seconds': seconds,
+          'throughput': self.throughput,
+          'chunk_size': self.size,
+          })
+
+    return self.size
+
+
+def get_file_fingerprint(fh):
+  """Identify the contents of a file handle cheaply.
+
+  This is used to make sure a saved upload session
+  belongs to the same file (and the same version of that file).
+
+  :type fh: file
+  :param fh: A file handle.
+
+  :rtype: string or None
+  :returns: A string built from the file's size, modification time and inode,
+            or None if ``fh`` isn't backed by a real file.
+  """
+
+  try:
+    stat = os.fstat(fh.fileno())
+  except (AttributeError, IOError, OSError):
+    return None
+
+  return '%d-%d-%d' % (stat.st_size, int(stat.st_mtime), stat.st_ino)
+
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+"""The :mod:`zlib` window size selecting the gzip format."""
+
+
+def iter_file(fh, chunk_size, size=None):
+  """Read a file handle in chunks.
+
+  :type fh: file
+  :param fh: A file handle open for reading.
+
+  :type chunk_size: int
+  :param chunk_size: The most bytes to read at a time.
+
+  :type size: int
+  :param size: (optional) The most bytes to read in total.
+               Defaults to reading until ``fh`` runs out.
+
+  :rtype: generator of strings
+  :returns: The data, one chunk at a time.
+  """
+
+  remaining = size
+  while remaining is None or remaining > 0:
+    if remaining is None:
+      data = fh.read(chunk_size)
+    else:
+      data = fh.read(min(chunk_size, remaining))
+      remaining -= len(data)
+    if not data:
+      break
+    yield data
+
+
+def iter_gzip(chunks, level=6):
+  """Compress data into the gzip format as it is read.
+
+  :type chunks: iterable of strings
+  :param chunks: The data to compress.
+
+  :type level: int
+  :param level: The compression level, from 1 (fastest) to 9 (smallest).
+
+  :rtype: generator of strings
+  :returns: The compressed data, a piece at a time.
+  """
+
+  compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+  for data in chunks:
+    # zlib takes strings and buffers, but not memoryviews.
+    if isinstance(data, memoryview):
+      data = data.tobytes()
+    compressed = compressor.compress(data)
+    if compressed:
+      yield compressed
+  yield compressor.flush()
+
+
+def iter_gunzip(chunks, buffer_size):
+  """Decompress gzip data as it is read.
+
+  :type chunks: iterable of strings
+  :param chunks: The compressed data.
+
+  :type buffer_size: int
+  :param buffer_size: The most decompressed bytes to yield at a time
+                      (so a small, highly compressed chunk
+                      doesn't expand into a huge string).
+
+  :rtype: generator of strings
+  :returns: The decompressed data, a piece at a time.
+  :raises: :class:`gcloud.storage.exceptions.StorageDataError`
+           if the data isn't valid gzip.
+  """
+
+  decompressor = zlib.decompressobj(GZIP_WBITS)
+  try:
+    for data in chunks:
+      while data:
+        decompressed = decompressor.decompress(data, buffer_size)
+        if decompressed:
+          yield decompressed
+        data = decompressor.unconsumed_tail
+    decompressed = decompressor.flush()
+  except zlib.error, e:
+    raise exceptions.StorageDataError('Invalid gzip data: %s' % e)
+  if decompressed:
+    yield decompressed
+
+
+def get_file_size(fh):
+  """Get the size of the file behind a file handle, if it has one.
+
+  :type fh: file
+  :param fh: A file handle.
+
+  :rtype: int or None
+  :returns: The size of the file,
+            or None if ``fh`` isn't a regular file
+            (like a pipe, a socket or an in-memory buffer).
+  """
+
+  try:
+    file_stat = os.fstat(fh.fileno())
+  except (AttributeError, IOError, OSError):
+    return None
+
+  if not stat.S_ISREG(file_stat.st_mode):
+    return None
+  return file_stat.st_size
+
+
+class ResumableUploadStateStore(object):
+  """Persists resumable upload sessions in a small JSON file.
+
+  If an upload dies half way through,
+  the session URL and the number of bytes committed so far
+  are still on disk,
+  so the next attempt can pick up where the last one stopped::
+
+    >>> store = ResumableUploadStateStore('/var/tmp/uploads.json')
+    >>> key.set_contents_from_filename('export.csv', resume_store=store)
+
+  States are keyed by bucket name, key name and file fingerprint
+  (see :func:`get_file_fingerprint`).
+
+  :type filename: string
+  :param filename: The path of the JSON file to keep state in.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def get_state_key(key):
+    return '%s/%s' % (key.bucket.name, key.name)
+
+  def get(self, key, fingerprint):
+    """Get the saved state of an upload.
+
+    :type key: :class:`gcloud.storage.key.Key`
+    :param key: The key being uploaded to.
+
+    :type fingerprint: string
+    :param fingerprint: The fingerprint of the file being uploaded.
+
+    :rtype: dict or None
+    :returns: A dictionary with ``upload_url`` and ``offset``,
+              or None if there is no state for this upload.
+    """
+
+    with self._lock:
+      state = self._load().get(self.get_state_key(key))
+
+    if state and state['fingerprint'] == fingerprint:
+      return state
+
+  def set(self, key, fingerprint, upload_url, offset):
+    """Save the state of an upload.
+
+    :type key: :class:`gcloud.storage.key.Key`
+    :param key: The key being uploaded to.
+
+    :type fingerprint: string
+    :param fingerprint: The fingerprint of the file being uploaded.
+
+    :type upload_url: string
+    :param upload_url: The URL of the resumable upload session.
+
+    :type offset: int
+    :param offset: The number of bytes committed so far.
+    """
+
+    with self._lock:
+      states = self._load()
+      states[self.get_state_key(key)] = {
+          'fingerprint': fingerprint,
+          'upload_url': upload_url,
+          'offset': offset,
+          }
+      self._save(states)
+
+  def delete(self, key):
+    """Forget the state of an upload.
+
+    :type key: :class:`gcloud.storage.key.Key`
+    :param key: The key that was being uploaded to.
+    """
+
+    with self._lock:
+      states = self._load()
+      if states.pop(self.get_state_key(key), None) is not None:
+        self._save(states)
+
+  def _load(self):
+    try:
+      with open(self.filename) as fh:
+        return json.load(fh)
+    except (IOError, ValueError):
+      return {}
+
+  def _save(self, states):
+    # Write a new file and rename it over the old one,
+    # so a crash never leaves a half written file behind.
+    # Each writer gets its own file, in case several processes share a store.
+    fd, temporary_filename = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(self.filename)),
+        prefix=os.path.basename(self.filename) + '.')
+    with os.fdopen(fd, 'w') as fh:
+      json.dump(states, fh)
+
+    try:
+      os.rename(temporary_filename, self.filename)
+    except OSError:
+      # Windows won't rename over an existing file.
+      os.remove(self.filename)
+      os.rename(temporary_filename, self.filename)
+
+
+class ResumableUpload(object):
+  """Uploads data from a file handle using a resumable upload session.
+
+  The data is sent one chunk at a time.
+  If a ``resume_store`` is provided,
+  the session is saved after every chunk
+  and an interrupted upload of the same file
+  continues from the last byte the server committed.
+
+  You shouldn't have to use this directly,
+  instead use :func:`gcloud.storage.key.Key.set_contents_from_file`.
+
+  :type key: :class:`gcloud.storage.key.Key`
+  :param key: The key to upload to.
+
+  :type fh: file
+  :param fh: A file handle open for reading,
+             positioned at the start of the data.
+
+  :type total_bytes: int
+  :param total_bytes: The number of bytes to upload.
+
+  :type content_type: string
+  :param content_type: The content type of the object.
+
+  :type resume_store: :class:`ResumableUploadStateStore`
+  :param resume_store: (optional) Where to save the session state.
+                       Only used if ``fh`` is seekable
+                       and backed by a real file.
+
+  :type chunk_sizer: :class:`AdaptiveChunkSize`
+  :param chunk_sizer: (optional) Picks the size of each chunk.
+                      If not provided, every chunk is
+                      :attr:`gcloud.storage.key.Key.CHUNK_SIZE` bytes.
+
+  :type checksum: :class:`Checksum`
+  :param checksum: (optional) Updated with every chunk sent
+                   and checked against the uploaded object's metadata.
+
+  :type metadata: dict
+  :param metadata: (optional) Metadata to set on the new object
+                   (ie, ``{'contentEncoding': 'gzip'}``).
+  """
+
+  def __init__(self, key, fh, total_bytes, content_type=None,
+               resume_store=None, chunk_sizer=None, checksum=None,
+               metadata=None):
+    self.key = key
+    self.metadata = metadata
+    self.fh = fh
+    self.total_bytes = total_bytes
+    self.content_type = content_type or 'application/unknown'
+    self.chunk_sizer = chunk_sizer
+    self.checksum = checksum
+    self.upload_url = None
+    self.bytes_uploaded = 0
+    # The final response of a resumed session that had already finished.
+    self._finished = None
+
+    self.resume_store = resume_store
+    self.fingerprint = None
+    if resume_store is not None:
+      self.fingerprint = get_file_fingerprint(fh)
+      if self.fingerprint is None:
+        self.resume_store = None
+
+  def start(self):
+    """Start a new resumable upload session.
+
+    :rtype: string
+    :returns: The URL of the new session.
+    """
+
+    headers = {'X-Upload-Content-Type': self.content_type}
+    if self.total_bytes is not None:
+      headers['X-Upload-Content-Length'] = str(self.total_bytes)
+
+    upload_url = self.key.connection.build_api_url(
+        path=self.key.bucket.path + '/o',
+        query_params={'uploadType': 'resumable', 'name': self.key.name},
+        api_base_url=self.key.connection.API_BASE_URL + '/upload')
+
+    data = None
+    content_type = None
+    if self.metadata:
+      data = json.dumps(self.metadata)
+      content_type = 'application/json'
+
+    response, content = self.key.connection.make_request(
+        method='POST', url=upload_url, data=data, content_type=content_type,
+        headers=headers)
+    self._check_response(response, content)
+
+    # Get the resumable upload URL.
+    return response['location']
+
+  def get_committed_bytes(self):
+    """Ask the server how much of the current session it has committed.
+
+    :rtype: int or None
+    :returns: The number of bytes committed,
+              or None if the session has expired.
+    """
+
+    return self.query_session()[0]
+
+  def query_session(self):
+    """Ask the server about the current session.
+
+    :rtype: tuple of ``committed_bytes`` (an int or None),
+            ``response`` (a dictionary of sorts) and ``content`` (a string).
+    :returns: The number of bytes committed
+              (None if the session has expired)
+              and the HTTP response they were read from.
+    """
+
+    headers = {'Content-Range': self.get_content_range(0)}
+    response, content = self.key.connection.make_retried_request(
+        method='PUT', url=self.upload_url, headers=headers)
+
+    if response.status in (200, 201):
+      # The upload finished, we just never heard about it.
+      return self.total_bytes, response, content
+    elif response.status != 308:
+      return None, response, content
+
+    return self._get_committed(response), response, content
+
+  @staticmethod
+  def _get_committed(response):
+    # The Range header of a 308 ("Resume Incomplete")
+    # holds the bytes the server kept;
+    # no header means nothing has been committed yet.
+    committed_range = response.get('range')
+    if not committed_range:
+      return 0
+    return int(committed_range.rsplit('-', 1)[1]) + 1
+
+  def resume(self):
+    """Pick up the session saved in the resume store, if there is one.
+
+    :rtype: bool
+    :returns: Whether a saved session was resumed.
+    """
+
+    state = self.resume_store.get(self.key, self.fingerprint)
+    if not state:
+      return False
+
+    self.upload_url = state['upload_url']
+    committed_bytes, response, content = self.query_session()
+    if committed_bytes is None:
+      self.upload_url = None
+      self.resume_store.delete(self.key)
+      return False
+
+    self.bytes_uploaded = committed_bytes
+    if response.status in (200, 201):
+      # It holds the new object's metadata, which there is no other way to get.
+      self._finished = (response, content)
+    return True
+
+  def upload(self):
+    """Upload all the data.
+
+    :rtype: tuple of ``response`` (a dictionary of sorts)
+            and ``content`` (a string).
+    :returns: The HTTP response object and the content of the final request.
+    """
+
+    base = self.fh.tell()
+
+    if not (self.resume_store and self.resume()):
+      self.upload_url = self.start()
+      self.bytes_uploaded = 0
+
+    if self.bytes_uploaded:
+      if self.checksum:
+        # The bytes sent before we resumed still count towards the checksum.
+        self.fh.seek(base, os.SEEK_SET)
+        remaining = self.bytes_uploaded
+        while remaining:
+          data = self.fh.read(min(remaining, self.key.CHUNK_SIZE))
+          self.checksum.update(data)
+          remaining -= len(data)
+      self.fh.seek(base + self.bytes_uploaded, os.SEEK_SET)
+
+    response, content = self._finished or (None, None)
+    while self.bytes_uploaded < self.total_bytes:
+      data = self.fh.read(self.get_chunk_size())
+      if not data:
+        raise exceptions.StorageDataError(
+            'The file ended after %d of %d bytes.' % (
+                self.bytes_uploaded, self.total_bytes))
+      if self.checksum:
+        self.checksum.update(data)
+      started = time.time()
+      response, content = self.upload_chunk(data)
+      if self.chunk_sizer:
+        self.chunk_sizer.record(len(data), time.time() - started)
+
+      if self.resume_store:
+        self.resume_store.set(self.key, self.fingerprint, self.upload_url,
+                              self.bytes_uploaded)
+
+    if self.resume_store:
+      self.resume_store.delete(self.key)
+
+    self._finish(response, content)
+    return response, content
+
+  def _finish(self, response, content):
+    # The final response holds the new object's metadata.
+    if content and response.status in (200, 201):
+      self.key.metadata = json.loads(content)
+      if self.checksum:
+        self.checksum.verify(self.checksum.get_expected(
+            metadata=self.key.metadata))
+
+  def get_chunk_size(self):
+    if self.chunk_sizer:
+      return self.chunk_sizer.size
+    return self.key.CHUNK_SIZE
+
+  def upload_chunk(self, data):
+    """Upload the next chunk of data in the session.
+
+    Failures are retried according to the connection's
+    :class:`gcloud.storage.retry.RetryPolicy`.
+    Before each retry the server is asked how much of the chunk
+    it committed, and only the rest is sent again.
+    The same goes for a ``308`` committing only part of the chunk.
+
+    :type data: string
+    :param data: The data to upload.
+
+    :rtype: tuple of ``response`` (a dictionary of sorts)
+            and ``content`` (a string).
+    :returns: The HTTP response object and the content of the response.
+    """
+
+    start = self.bytes_uploaded
+    end = start + len(data)
+    attempts = []
+
+    def send():
+      if attempts:
+        committed, response, content = self.query_session()
+        if committed is None:
+          # The session has expired (or is gone), so give up.
+          raise exceptions.ConnectionError(response, content)
+        elif response.status in (200, 201):
+          return response, content
+        elif not start <= committed <= end:
+          raise exceptions.StorageDataError(
+              'The server committed %d bytes, expected %d to %d.' % (
+                  committed, start, end))
+        self.bytes_uploaded = committed
+      attempts.append(self.bytes_uploaded)
+
+      remaining = data[self.bytes_uploaded - start:]
+      headers = {'Content-Range': self.get_content_range(len(remaining))}
+      response, content = self.key.connection.make_request(
+          content_type='text/plain', method='POST', url=self.upload_url,
+          headers=headers, data=remaining)
+      self._check_response(response, content)
+      return response, content
+
+    while True:
+      response, content = self.key.connection.retry_policy.call(send)
+      if response.status != 308:
+        self.bytes_uploaded = end
+        return response, content
+
+      sent_from = self.bytes_uploaded
+      committed = self._get_committed(response)
+      if not start <= committed <= end:
+        raise exceptions.StorageDataError(
+            'The server committed %d bytes, expected %d to %d.' % (
+                committed, start, end))
+      self.bytes_uploaded = committed
+      if committed == end:
+        return response, content
+      elif committed <= sent_from:
+        raise exceptions.StorageDataError(
+            'The server committed none of the %d bytes sent at %d.' % (
+                end - sent_from, sent_from))
+      # The server kept only part of the chunk, so send the rest.
+      del attempts[:]
+
+  def get_content_range(self, chunk_size):
+    """The ``Content-Range`` header for the next chunk.
+
+    :type chunk_size: int
+    :param chunk_size: The size of the chunk (0 to send no data).
+
+    :rtype: string
+    :returns: The header value, with ``*`` as the total
+              while the size of the data isn't known yet.
+    """
+
+    if self.total_bytes is None:
+      total = '*'
+    else:
+      total = str(self.total_bytes)
+
+    if not chunk_size:
+      return 'bytes */%s' % total
+    return 'bytes %d-%d/%s' % (
+        self.bytes_uploaded, self.bytes_uploaded + chunk_size - 1, total)
+
+  @staticmethod
+  def _check_response(response, content):
+    # 308 means "Resume Incomplete": the chunk was accepted.
+    if response.status == 404:
+      raise exceptions.NotFoundError(response, content)
+    elif not (200 <= response.status < 300 or response.status == 308):
+      raise exceptions.ConnectionError(response, content)
+
+
+class StreamingUpload(ResumableUpload):
+  """Uploads data of unknown length using a resumable upload session.
+
+  The data can come from a file handle that can't be sized or seeked
+  (like a pipe, a socket or a subprocess' output)
+  or from any iterable of strings (like a generator).
+  Exactly one chunk is buffered at a time:
+  chunks are sent with an unknown total (``bytes a-b/*``)
+  until the source runs out,
+  and the last chunk sent gives the final size.
+
+  You shouldn't have to use this directly,
+  instead use :func:`gcloud.storage.key.Key.set_contents_from_stream`.
+
+  :type key: :class:`gcloud.storage.key.Key`
+  :param key: The key to upload to.
+
+  :type source: file or iterable of strings
+  :param source: Where to read the data from.
+
+  :type content_type: string
+  :param content_type: The content type of the object.
+
+  :type chunk_sizer: :class:`AdaptiveChunkSize`
+  :param chunk_sizer: (optional) Picks the size of each chunk.
+
+  :type checksum: :class:`Checksum`
+  :param checksum: (optional) Updated with every chunk sent
+                   and checked against the uploaded object's metadata.
+
+  :type metadata: dict
+  :param metadata: (optional) Metadata to set on the new object.
+  """
+
+  def __init__(self, key, source, content_type=None, chunk_sizer=None,
+               checksum=None, metadata=None):
+    super(StreamingUpload, self).__init__(
+        key, None, None, content_type=content_type, chunk_sizer=chunk_sizer,
+        checksum=checksum, metadata=metadata)
+
+    if hasattr(source, 'read'):
+      self.source = iter(lambda: source.read(self.get_chunk_size()), '')
+    else:
+      self.source = iter(source)
+
+  def upload(self):
+    """Upload all the data, until the source is exhausted.
+
+    :rtype: tuple of ``response`` (a dictionary of sorts)
+            and ``content`` (a string).
+    :returns: The HTTP response object and the content of the final request.
+    """
+
+    self.upload_url = self.start()
+    self.bytes_uploaded = 0
+
+    buffered = ''
+    exhausted = False
+    while True:
+      chunk_size = self.get_chunk_size()
+
+      # Read one byte past the chunk (or to the end of the source)
+      # to know whether this is the last chunk.
+      pieces = [buffered]
+      buffered_bytes = len(buffered)
+      while not exhausted and buffered_bytes <= chunk_size:
+        try:
+          piece = next(self.source)
+        except StopIteration:
+          exhausted = True
+        else:
+          pieces.append(piece)
+          buffered_bytes += len(piece)
+      buffered = ''.join(pieces)
+
+      if exhausted and len(buffered) <= chunk_size:
+        break
+
+      data, buffered = buffered[:chunk_size], buffered[chunk_size:]
+      self._send(data)
+
+    self.total_bytes = self.bytes_uploaded + len(buffered)
+    response, content = self._send(buffered)
+    self._finish(response, content)
+    return response, content
+
+  def _send(self, data):
+    if self.checksum:
+      self.checksum.update(data)
+    started = time.time()
+    response, content = self.upload_chunk(data)
+    if self.chunk_sizer and data:
+      self.chunk_sizer.record(len(data), time.time() - started)
+    return response, content
+
+
+class BufferReader(object):
+  """A read-only, seekable file-like object over a buffer.
+
+  Reading returns slices of the underlying data
+  (a :class:`memoryview`, or a :func:`buffer` for objects like
+  :class:`mmap.mmap` that only support the old buffer interface)
+  rather than copying it into new strings.
+  The slices can be sent as request bodies as they are.
+
+  :type data: string, bytearray, mmap.mmap or anything supporting
+              the buffer interface
+  :param data: The data to read.
+  """
+
+  def __init__(self, data):
+    self.data = data
+    self.length = len(data)
+    self.position = 0
+
+    try:
+      self._view = memoryview(data)
+    except TypeError:
+      self._view = None
+
+  def read(self, size=-1):
+    remaining = self.length - self.position
+    if size < 0 or size > remaining:
+      size = remaining
+
+    start = self.position
+    self.position += size
+
+    if self._view is not None:
+      return self._view[start:start + size]
+    return buffer(self.data, start, size)
+
+  def seek(self, offset, whence=os.SEEK_SET):
+    if whence == os.SEEK_CUR:
+      offset += self.position
+    elif whence == os.SEEK_END:
+      offset += self.length
+    self.position = max(0, min(offset, self.length))
+
+  def tell(self):
+    return self.position
+
+
+class MappedFileReader(BufferReader):
+  """Reads a local file through a read-only memory map, without copying.
+
+  :type fh: file
+  :param fh: A (non-empty) file open for reading.
+  """
+
+  def __init__(self, fh):
+    self.fh = fh
+    self.mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    super(MappedFileReader, self).__init__(self.mmap)
+
+  def fileno(self):
+    return self.fh.fileno()
+
+  def close(self):
+    self.mmap.close()
+
+
+class FileSection(object):
+  """A read-only, seekable window onto part of a shared file handle.
+
+  Several sections of the same file handle can be read
+  from different threads at the same time,
+  as long as they share the same ``lock``.
+
+  :type fh: file
+  :param fh: A seekable file handle open for reading.
+
+  :type offset: int
+  :param offset: The position in ``fh`` where this section starts.
+
+  :type length: int
+  :param length: The number of bytes in this section.
+
+  :type lock: :class:`threading.Lock`
+  :param lock: The lock guarding ``fh``.
+  """
+
+  def __init__(self, fh, offset, length, lock):
+    self.fh = fh
+    self.offset = offset
+    self.length = length
+    self.lock = lock
+    self.position = 0
+
+  def read(self, size=-1):
+    remaining = self.length - self.position
+    if size < 0 or size > remaining:
+      size = remaining
+
+    with self.lock:
+      self.fh.seek(self.offset + self.position)
+      data = self.fh.read(size)
+
+    self.position += len(data)
+    return data
+
+  def seek(self, offset, whence=os.SEEK_SET):
+    if whence == os.SEEK_CUR:
+      offset += self.position
+    elif whence == os.SEEK_END:
+      offset += self.length
+    self.position = max(0, min(offset, self.length))
+
+  def tell(self):
+    return self.position
+
+
+class ParallelUpload(object):
+  """Uploads a file as several parts at once, then composes them.
+
+  The file is split into parts of ``part_size`` bytes.
+  Each part is uploaded as a temporary object
+  by a pool of ``num_workers`` threads.
+  The parts are then composed (server side) into the final object,
+  and the temporary objects are deleted.
+
+  :type key: :class:`gcloud.storage.key.Key`
+  :param key: The key to upload to.
+
+  :type num_workers: int
+  :param num_workers: The number of parts to upload at the same time.
+
+  :type part_size: int
+  :param part_size: The size of each part.
+                    Defaults to :attr:`ParallelUpload.PART_SIZE`.
+
+  :type checksum: string
+  :param checksum: (optional) The algorithm (``'md5'`` or ``'crc32c'``)
+                   used to verify each part as it is uploaded.
+  """
+
+  PART_SIZE = 32 * 1024 * 1024  # 32 MB.
+  """The default size of each part (32 MB)."""
+
+  MAX_COMPOSE_SOURCES = 32
+  """The most objects a single compose request can combine."""
+
+  def __init__(self, key, num_workers=4, part_size=None, checksum=None):
+    self.key = key
+    self.num_workers = num_workers
+    self.part_size = part_size or self.PART_SIZE
+    self.checksum = checksum
+    self._part_prefix = '%s.part-%s-' % (key.name, uuid.uuid4().hex)
+    self._part_count = 0
+    self._part_lock = threading.Lock()
+
+  def new_part_key(self):
+    """Create a temporary key to hold one part of the upload.
+
+    :rtype: :class:`gcloud.storage.key.Key`
+    :returns: A new (unsaved) key in the same bucket.
+    """
+
+    with self._part_lock:
+      self._part_count += 1
+      name = '%s%05d' % (self._part_prefix, self._part_count)
+    return self.key.bucket.new_key(name)
+
+  def compose(self, keys, destination, content_type=None):
+    """Combine several keys into one, server side.
+
+    :type keys: list of :class:`gcloud.storage.key.Key`
+    :param keys: The keys to combine, in order.
+
+    :type destination: :class:`gcloud.storage.key.Key`
+    :param destination: The key to write the combined data to.
+
+    :type content_type: string
+    :param content_type: The content type of the combined object.
+
+    :rtype: dict
+    :returns: The metadata of the composed object.
+    """
+
+    data = {
+        'sourceObjects': [{'name': key.name} for key in keys],
+        'destination': {'contentType': content_type or 'application/unknown'},
+        }
+    return self.key.connection.api_request(
+        method='POST', path=destination.path + '/compose', data=data)
+
+  def upload_from_file(self, fh, size, content_type=None):
+    """Upload the data from a file handle.
+
+    Data is read starting at the current position of ``fh``.
+
+    :type fh: file
+    :param fh: A seekable file handle open for reading.
+
+    :type size: int
+    :param size: The number of bytes to upload.
+
+    :type content_type: string
+    :param content_type: The content type of the object.
+
+    :rtype: dict
+    :returns: The metadata of the uploaded object.
+    """
+
+    base = fh.tell()
+    fh_lock = threading.Lock()
+    temporary_keys = []
+
+    def upload_part(offset):
+      length = min(self.part_size, size - offset)
+      part_key = self.new_part_key()
+      part_key.set_contents_from_file(
+          FileSection(fh, base + offset, length, fh_lock), size=length,
+          content_type=content_type, checksum=self.checksum)
+      temporary_keys.append(part_key)
+      return part_key
+
+    def compose_group(keys):
+      if len(keys) == 1:
+        return keys[0]
+      group_key = self.new_part_key()
+      self.compose(keys, group_key, content_type=content_type)
+      temporary_keys.append(group_key)
+      return group_key
+
+    pool = ThreadPool(self.num_workers)
+    try:
+      keys = pool.map(upload_part, xrange(0, size, self.part_size))
+
+      # Each compose request has a limit on the number of sources,
+      # so combine the parts in rounds until few enough remain.
+      while len(keys) > self.MAX_COMPOSE_SOURCES:
+        groups = [keys[i:i + self.MAX_COMPOSE_SOURCES]
+                  for i in xrange(0, len(keys), self.MAX_COMPOSE_SOURCES)]
+        keys = pool.map(compose_group, groups)
+
+      return self.compose(keys, self.key, content_type=content_type)
+    finally:
+      pool.terminate()
+      pool.join()
+
+      # A part that can't be deleted is left behind
+      # rather than hiding why the upload stopped
+      # (or failing an upload that succeeded).
+      for key in temporary_keys:
+        try:
+          key.delete()
+        except exceptions.NotFoundError:
+          pass
+        except Exception:
+          logger.warning('Could not delete temporary part %s.', key.name,
+                         exc_info=True)
@@ -0,0 +1,98 @@
+"""Helpers for spreading work over a pool of threads.
+
+Bulk operations (like deleting every key in a bucket)
+read their input lazily from an iterator
+which might be much too large to hold in memory.
+:class:`multiprocessing.pool.ThreadPool` reads its whole input
+as fast as it can,
+so :func:`imap_unordered` only reads a little ahead instead.
+"""
+
+import Queue
+import sys
+from multiprocessing.pool import ThreadPool
+
+
+def _call(function, item, results):
+  try:
+    results.put((True, function(item)))
+  except:
+    results.put((False, sys.exc_info()))
+
+
+def _get_result(results):
+  succeeded, value = results.get()
+  if not succeeded:
+    raise value[0], value[1], value[2]
+  return value
+
+
+def imap_unordered(function, iterable, num_workers, max_pending=None):
+  """Call a function on every item using a pool of threads.
+
+  This works like :func:`multiprocessing.pool.ThreadPool.imap_unordered`,
+  but never has more than ``max_pending`` items in flight,
+  so ``iterable`` can be very long (or slow to produce).
+
+  :type function: callable
+  :param function: The function to call with each item.
+
+  :type iterable: iterable
+  :param iterable: The items to process.
+
+  :type num_workers: int
+  :param num_workers: The number of threads to use.
+
+  :type max_pending: int
+  :param max_pending: The most items to read ahead of the results.
+                      Defaults to twice ``num_workers``.
+
+  :rtype: generator
+  :returns: The results, in the order they finish.
+            An exception raised by ``function`` is re-raised here.
+  """
+
+  max_pending = max_pending or num_workers * 2
+  results = Queue.Queue()
+  pool = ThreadPool(num_workers)
+  pending = 0
+
+  try:
+    for item in iterable:
+      pool.apply_async(_call, (function, item, results))
+      pending += 1
+
+      while pending >= max_pending or not results.empty():
+        pending -= 1
+        yield _get_result(results)
+
+    while pending:
+      pending -= 1
+      yield _get_result(results)
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def iter_groups(iterable, size):
+  """Split an iterable into lists of (at most) ``size`` items.
+
+  :type iterable: iterable
+  :param iterable: The items to split.
+
+  :type size: int
+  :param size: The most items in each group.
+
+  :rtype: generator of lists
+  :returns: The groups of items, in order.
+  """
+
+  group = []
+  for item in iterable:
+    group.append(item)
+    if len(group) == size:
+      yield group
+      group = []
+
+  if group:
+    yield group
@@ -0,0 +1,236 @@
+"""A thread-safe, pooled HTTP transport.
+
+:class:`httplib2.Http` objects are not thread-safe,
+so sharing a single one across threads isn't an option.
+Building a fresh one per thread works,
+but pays for a new TLS handshake
+(and a new OAuth2 ``authorize`` wrapper)
+each time.
+
+:class:`HttpPool` keeps a bounded number
+of authorized :class:`httplib2.Http` objects per host.
+Each request checks one out,
+uses its keep-alive socket,
+and checks it back in when the response has been read.
+Objects that sit idle for too long are closed and evicted.
+
+A pool quacks like :class:`httplib2.Http`
+(it has a ``request`` method with the same signature),
+so it can be handed to any connection::
+
+  >>> from gcloud.transport import HttpPool
+  >>> from gcloud.storage.connection import Connection
+  >>> pool = HttpPool(credentials=credentials, max_per_host=8)
+  >>> connection = Connection(project, credentials=credentials, http=pool)
+"""
+
+import threading
+import time
+import urlparse
+
+import httplib2
+
+
+class HttpPool(object):
+  """A pool of :class:`httplib2.Http` objects safe to share across threads.
+
+  :type credentials: :class:`gcloud.credentials.Credentials`
+  :param credentials: (optional) The OAuth2 Credentials used to authorize
+                      each pooled :class:`httplib2.Http` object.
+
+  :type max_per_host: int
+  :param max_per_host: The maximum number of :class:`httplib2.Http` objects
+                       (and so keep-alive sockets) per host.
+                       Requests beyond this limit block until
+                       an object is checked back in.
+
+  :type idle_timeout: int or float
+  :param idle_timeout: The number of seconds an object may sit unused
+                       before it is closed and evicted from the pool.
+
+  :type http_factory: callable
+  :param http_factory: (optional) A callable returning a new
+                       :class:`httplib2.Http` object.
+                       Defaults to :class:`httplib2.Http`.
+
+  :type clock: callable
+  :param clock: (optional) A callable returning the current time in seconds,
+                used to tell how long objects have been idle.
+                Defaults to :func:`time.time`.
+  """
+
+  def __init__(self, credentials=None, max_per_host=10, idle_timeout=60,
+               http_factory=None, clock=None):
+    if max_per_host < 1:
+      raise ValueError('max_per_host must be at least 1.')
+
+    self._credentials = credentials
+    self.max_per_host = max_per_host
+    self.idle_timeout = idle_timeout
+    self._http_factory = http_factory or httplib2.Http
+    self._clock = clock or time.time
+
+    self._lock = threading.Condition()
+    self._idle = {}  # host -> list of (last_used, http), oldest first.
+    self._size = {}  # host -> number of objects created (idle or in use).
+
+  @property
+  def credentials(self):
+    return self._credentials
+
+  def request(self, uri, method='GET', body=None, headers=None,
+              redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+              connection_type=None):
+    """Make a request using a pooled :class:`httplib2.Http` object.
+
+    This has the same signature as :func:`httplib2.Http.request`.
+
+    :rtype: tuple of ``response`` (a dictionary of sorts)
+            and ``content`` (a string).
+    :returns: The HTTP response object and the content of the response.
+    """
+
+    host = self.get_host(uri)
+    http = self.checkout(host)
+
+    try:
+      result = http.request(uri, method=method, body=body, headers=headers,
+                            redirections=redirections,
+                            connection_type=connection_type)
+    except:
+      # We don't know what state the sockets are in, so throw it away.
+      self.discard(host, http)
+      raise
+
+    self.checkin(host, http)
+    return result
+
+  @staticmethod
+  def get_host(uri):
+    """Get the pool key (scheme and host) for a URI.
+
+    :type uri: string
+    :param uri: The URI being requested.
+
+    :rtype: string
+    :returns: The scheme and network location, ie ``https://host:port``.
+    """
+
+    parts = urlparse.urlsplit(uri)
+    return '%s://%s' % (parts.scheme, parts.netloc)
+
+  def checkout(self, host):
+    """Take an :class:`httplib2.Http` object for a host out of the pool.
+
+    This blocks if ``max_per_host`` objects are already checked out.
+
+    :type host: string
+    :param host: The pool key, as returned by :func:`HttpPool.get_host`.
+
+    :rtype: :class:`httplib2.Http`
+    :returns: An (authorized) Http object reserved for the caller.
+    """
+
+    with self._lock:
+      self._evict_idle()
+
+      while True:
+        idle = self._idle.get(host)
+        if idle:
+          # Most recently used first, it is the most likely to be alive.
+          return idle.pop()[1]
+
+        if self._size.get(host, 0) < self.max_per_host:
+          self._size[host] = self._size.get(host, 0) + 1
+          break
+
+        self._lock.wait()
+
+    # Creating (and authorizing) happens outside of the lock.
+    try:
+      return self.create_http()
+    except:
+      self._release(host)
+      raise
+
+  def checkin(self, host, http):
+    """Return an :class:`httplib2.Http` object to the pool.
+
+    :type host: string
+    :param host: The pool key the object was checked out with.
+
+    :type http: :class:`httplib2.Http`
+    :param http: The object to return.
+    """
+
+    with self._lock:
+      self._idle.setdefault(host, []).append((self._clock(), http))
+      self._lock.notify()
+
+  def discard(self, host, http):
+    """Close an :class:`httplib2.Http` object instead of returning it.
+
+    :type host: string
+    :param host: The pool key the object was checked out with.
+
+    :type http: :class:`httplib2.Http`
+    :param http: The object to close.
+    """
+
+    self._close_http(http)
+    self._release(host)
+
+  def create_http(self):
+    """Factory method for the :class:`httplib2.Http` objects in the pool.
+
+    :rtype: :class:`httplib2.Http`
+    :returns: A new Http object, authorized if credentials were provided.
+    """
+
+    http = self._http_factory()
+    if self._credentials:
+      http = self._credentials.authorize(http)
+    return http
+
+  def close(self):
+    """Close every idle :class:`httplib2.Http` object in the pool."""
+
+    with self._lock:
+      for host, idle in self._idle.items():
+        for _, http in idle:
+          self._close_http(http)
+        self._size[host] -= len(idle)
+      self._idle.clear()
+      self._lock.notify_all()
+
+  def _release(self, host):
+    with self._lock:
+      self._size[host] -= 1
+      self._lock.notify()
+
+  def _evict_idle(self):
+    # Must be called while holding self._lock.
+    if self.idle_timeout is None:
+      return
+
+    cutoff = self._clock() - self.idle_timeout
+    for host, idle in self._idle.items():
+      # The list is ordered by last use, so stale objects are at the front.
+      stale = 0
+      while stale < len(idle) and idle[stale][0] < cutoff:
+        self._close_http(idle[stale][1])
+        stale += 1
+
+      if stale:
+        del idle[:stale]
+        self._size[host] -= stale
+
+  @staticmethod
+  def _close_http(http):
+    for conn in getattr(http, 'connections', {}).values():
+      try:
+        conn.close()
+      except Exception:
+        pass
+    if hasattr(http, 'connections'):
+      http.connections.clear()
@@ -0,0 +1,96 @@
+import threading
+
+import unittest2
+
+from gcloud.connection import Connection
+from gcloud.transport import HttpPool
+from utils import HttpRecorder
+
+
+class ClosableConnection(object):
+
+  closed = False
+
+  def close(self):
+    self.closed = True
+
+
+class PooledHttp(HttpRecorder):
+
+  def __init__(self):
+    super(PooledHttp, self).__init__(
+        responses=[({'status': '200'}, 'OK')] * 10)
+    self.connections = {'https:www.googleapis.com': ClosableConnection()}
+
+
+class HttpPoolTest(unittest2.TestCase):
+
+  def test_reuses_http_objects(self):
+    created = []
+    def factory():
+      created.append(PooledHttp())
+      return created[-1]
+
+    pool = HttpPool(http_factory=factory)
+    pool.request('https://www.googleapis.com/a')
+    pool.request('https://www.googleapis.com/b')
+    self.assertEqual(1, len(created))
+    self.assertEqual(2, len(created[0].requests))
+
+  def test_hosts_are_pooled_separately(self):
+    created = []
+    def factory():
+      created.append(PooledHttp())
+      return created[-1]
+
+    pool = HttpPool(http_factory=factory)
+    pool.request('https://www.googleapis.com/a')
+    pool.request('https://storage.googleapis.com/a')
+    self.assertEqual(2, len(created))
+
+  def test_checkout_blocks_at_max_per_host(self):
+    pool = HttpPool(max_per_host=1, http_factory=PooledHttp)
+    host = pool.get_host('https://www.googleapis.com/a')
+    http = pool.checkout(host)
+    checked_out = []
+
+    thread = threading.Thread(
+        target=lambda: checked_out.append(pool.checkout(host)))
+    thread.start()
+    thread.join(0.1)
+    self.assertEqual([], checked_out)
+
+    pool.checkin(host, http)
+    thread.join(1)
+    self.assertEqual([http], checked_out)
+
+  def test_idle_objects_are_evicted(self):
+    now = [1000.0]
+    pool = HttpPool(idle_timeout=60, http_factory=PooledHttp,
+                    clock=lambda: now[0])
+    host = pool.get_host('https://www.googleapis.com/a')
+    http = pool.checkout(host)
+    pool.checkin(host, http)
+
+    now[0] += 59
+    self.assertIs(http, pool.checkout(host))
+    pool.checkin(host, http)
+
+    now[0] += 61
+    self.assertIsNot(http, pool.checkout(host))
+    self.assertEqual({}, http.connections)
+
+  def test_failed_request_discards_http(self):
+    class BrokenHttp(PooledHttp):
+      def request(self, *args, **kwargs):
+        raise IOError('Connection reset.')
+
+    pool = HttpPool(max_per_host=1, http_factory=BrokenHttp)
+    self.assertRaises(IOError, pool.request, 'https://www.googleapis.com/a')
+    self.assertEqual({}, pool._idle)
+    self.assertEqual(0, pool._size['https://www.googleapis.com'])
+
+  def test_connection_uses_provided_http(self):
+    pool = HttpPool()
+    connection = Connection(http=pool)
+    self.assertIs(pool, connection.http)